@@ -11,6 +11,8 @@ from app.services.user import user_service
 from app.core.config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
+# 未携带令牌时不返回 401，由依赖自行处理
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login", auto_error=False)
 
 def get_current_user(
     db: Session = Depends(get_db),
@@ -38,15 +40,19 @@ def get_current_user(
 
 def get_optional_current_user(
     db: Session = Depends(get_db),
-    token: Optional[str] = Depends(oauth2_scheme)
+    token: Optional[str] = Depends(optional_oauth2_scheme)
 ) -> Optional[User]:
     """
     获取当前用户（可选）
+
+    用户由令牌中的 sub 确定，未携带令牌、令牌无效或已过期时返回 None
     """
     if token is None:
         return None
     
     try:
-        return get_current_user(db, token)
-    except HTTPException:
-        return None 
\ No newline at end of file
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        user_id = int(payload.get("sub"))
+    except (JWTError, TypeError, ValueError):
+        return None
+    return user_service.get(db, user_id=user_id)
@@ -1,9 +1,11 @@
 from fastapi import APIRouter
-from .endpoints import users, experiments, analysis, execute_code
+from .endpoints import users, experiments, analysis, execute_code, charts, workflows
 
 api_router = APIRouter()
 
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(experiments.router, prefix="/experiments", tags=["experiments"])
 api_router.include_router(analysis.router, prefix="/analysis", tags=["analysis"])
-api_router.include_router(execute_code.router, prefix="/execute-code", tags=["code-execution"]) 
\ No newline at end of file
+api_router.include_router(execute_code.router, prefix="/execute-code", tags=["code-execution"])
+api_router.include_router(charts.router, prefix="/charts", tags=["charts"])
+api_router.include_router(workflows.router, prefix="/workflows", tags=["workflows"])
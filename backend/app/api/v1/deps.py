@@ -11,6 +11,8 @@ from app.services.user import user_service
 from app.core.config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
+# 未携带令牌时不返回 401，由依赖自行处理
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login", auto_error=False)
 
 def get_current_user(
     db: Session = Depends(get_db),
@@ -36,17 +38,42 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
 
+def _token_user(db: Session, token: str) -> Optional[User]:
+    """令牌中的 sub 对应的用户，令牌无效、已过期或用户不存在时返回 None"""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        user_id = int(payload.get("sub"))
+    except (JWTError, TypeError, ValueError):
+        return None
+    return user_service.get(db, user_id=user_id)
+
+def get_authenticated_user(
+    db: Session = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+) -> User:
+    """
+    获取令牌中的用户（必须登录）
+
+    用户由令牌中的 sub 确定，未携带令牌、令牌无效或用户不存在时返回 401
+    """
+    user = _token_user(db, token)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的身份认证凭据",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
 def get_optional_current_user(
     db: Session = Depends(get_db),
-    token: Optional[str] = Depends(oauth2_scheme)
+    token: Optional[str] = Depends(optional_oauth2_scheme)
 ) -> Optional[User]:
     """
     获取当前用户（可选）
+
+    用户由令牌中的 sub 确定，未携带令牌、令牌无效或已过期时返回 None
     """
     if token is None:
         return None
-    
-    try:
-        return get_current_user(db, token)
-    except HTTPException:
-        return None 
\ No newline at end of file
+    return _token_user(db, token)
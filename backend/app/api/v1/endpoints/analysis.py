@@ -1,18 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Dict, List, Any, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Callable, Dict, Iterator, List, Any, Optional
 import pandas as pd
+import io
 import json
 from datetime import date
 
+from app.core.config import settings
 from app.db.session import get_db
 from app.services.stock_analysis import stock_service
 from app.services.bank_analysis import bank_service
 from app.services.insurance_analysis import insurance_service
 from app.services.data_analysis import data_analysis_service
+from app.services.dataset_registry import dataset_registry
+from app.services.model_registry import ModelNotTrained, model_registry
+from app.services.micro_batcher import prediction_batcher
+from app.services.indicator_engine import OHLCV_COLUMNS, indicator_engine
 
 router = APIRouter()
 
+# 模型未训练时建议客户端重试的间隔（秒）
+MODEL_RETRY_AFTER = 30
+
+
+def _model_not_trained(e: ModelNotTrained, background_tasks: BackgroundTasks, train) -> JSONResponse:
+    """预测接口不训练模型：在后台开始训练并返回 503，客户端稍后重试"""
+    background_tasks.add_task(train)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{e}，已开始训练，请稍后重试"},
+        headers={"Retry-After": str(MODEL_RETRY_AFTER)},
+        background=background_tasks
+    )
+
+
+def _parse_customers(content: bytes, filename: str = "") -> pd.DataFrame:
+    """解析上传的客户文件，Parquet（按扩展名或文件头识别）或 CSV"""
+    if filename.lower().endswith((".parquet", ".pq")) or content[:4] == b"PAR1":
+        return pd.read_parquet(io.BytesIO(content))
+    return pd.read_csv(io.BytesIO(content))
+
+
+async def _read_customers(request: Request) -> pd.DataFrame:
+    """读取批量评分的客户数据
+
+    支持 JSON 数组（或 {"customers": [...]}）、multipart 上传的 file 字段，以及直接以 CSV/Parquet 文件
+    内容作为请求体
+    """
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "json" in content_type:
+            payload = await request.json()
+            if isinstance(payload, dict):
+                payload = payload.get("customers")
+            if not isinstance(payload, list):
+                raise HTTPException(status_code=400, detail="请求体应为客户数据数组")
+            customers = pd.DataFrame(payload)
+        elif content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="缺少上传文件 file")
+            customers = await run_in_threadpool(_parse_customers, await upload.read(), upload.filename or "")
+        else:
+            customers = await run_in_threadpool(_parse_customers, await request.body())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无法解析客户数据: {str(e)}")
+
+    if customers.empty:
+        raise HTTPException(status_code=400, detail="客户数据为空")
+    if len(customers) > settings.BATCH_SCORING_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"单次最多评分 {settings.BATCH_SCORING_MAX_ROWS} 个客户")
+    return customers
+
+
+async def _stream_scores(customers: pd.DataFrame, score: Callable[[pd.DataFrame], pd.DataFrame],
+                         output_format: str) -> StreamingResponse:
+    """按块评分并以流的形式返回，每块调用一次模型
+
+    第一块在返回响应前评分，输入数据有误时返回错误状态码而不是中断的流
+    """
+    chunk_rows = max(1, settings.BATCH_SCORING_CHUNK_ROWS)
+
+    def serialize(scored: pd.DataFrame, first: bool) -> str:
+        if output_format == "csv":
+            return scored.to_csv(index=False, header=first)
+        text = scored.to_json(orient="records", lines=True, force_ascii=False)
+        return text if text.endswith("\n") else text + "\n"
+
+    try:
+        first = await run_in_threadpool(score, customers.iloc[:chunk_rows])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"评分失败: {str(e)}")
+
+    def chunks() -> Iterator[str]:
+        yield serialize(first, True)
+        for start in range(chunk_rows, len(customers), chunk_rows):
+            yield serialize(score(customers.iloc[start:start + chunk_rows]), False)
+
+    return StreamingResponse(
+        chunks(),
+        media_type="text/csv" if output_format == "csv" else "application/x-ndjson",
+        headers={"X-Total-Rows": str(len(customers))}
+    )
+
+@router.get("/datasets/stats")
+async def get_dataset_stats() -> Dict[str, Any]:
+    """
+    获取内存中数据集的统计（数据集数、内存占用、命中率）
+    """
+    return dataset_registry.stats()
+
+@router.get("/models/stats")
+async def get_model_stats() -> Dict[str, Any]:
+    """
+    获取模型注册表统计（内存中的模型、从磁盘加载和训练的次数）以及单条预测微批处理的
+    批大小和排队延迟直方图
+    """
+    return {**model_registry.stats(), "micro_batching": prediction_batcher.stats()}
+
 #---- 股票分析接口 ----#
 @router.get("/stock/data")
 async def get_stock_data(
@@ -38,22 +148,69 @@ async def get_stock_data(
 async def get_stock_indicators(
     symbol: str = Query(..., description="股票代码"),
     start_date: str = Query(..., description="开始日期，格式：YYYY-MM-DD"),
-    end_date: Optional[str] = Query(None, description="结束日期，格式：YYYY-MM-DD")
+    end_date: Optional[str] = Query(None, description="结束日期，格式：YYYY-MM-DD"),
+    indicators: Optional[str] = Query(None, description="逗号分隔的指标名称，如 MA5,MACD,RSI14，默认全部")
 ) -> Dict[str, Any]:
     """
-    计算股票技术指标
+    计算股票技术指标（结果缓存，结束日期延后时只计算新增的 K 线）
     """
     try:
-        # 获取股票数据
-        df = stock_service.get_stock_data(symbol, start_date, end_date)
-        
-        # 计算指标
-        df_with_indicators = stock_service.calculate_technical_indicators(df)
+        # 获取股票数据并计算指标
+        names = [name for name in indicators.split(",") if name.strip()] if indicators else None
+        df_with_indicators = await run_in_threadpool(
+            stock_service.get_stock_indicators, symbol, start_date, end_date, names
+        )
         
         return {
             "symbol": symbol,
             "indicators": df_with_indicators.reset_index().to_dict(orient="records")
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stock/indicators/stats")
+async def get_indicator_stats() -> Dict[str, Any]:
+    """
+    获取技术指标缓存统计（命中、增量计算和全量计算的次数）
+    """
+    return indicator_engine.stats()
+
+@router.post("/stock/indicators/batch")
+async def get_stocks_indicators(
+    symbols: List[str],
+    start_date: str = Query(..., description="开始日期，格式：YYYY-MM-DD"),
+    end_date: Optional[str] = Query(None, description="结束日期，格式：YYYY-MM-DD"),
+    indicators: Optional[str] = Query(None, description="逗号分隔的指标名称，如 MA5,MACD,RSI14，默认全部"),
+    include_prices: bool = Query(False, description="是否同时返回 OHLCV 数据")
+) -> Dict[str, Any]:
+    """
+    批量计算多只股票的技术指标
+
+    请求体为股票代码数组。每只股票按列返回：dates 为日期数组，values[i] 为 columns[i] 指标的数组
+    """
+    if not symbols:
+        raise HTTPException(status_code=400, detail="股票代码不能为空")
+    if len(symbols) > settings.STOCK_BATCH_MAX_SYMBOLS:
+        raise HTTPException(status_code=413, detail=f"单次最多查询 {settings.STOCK_BATCH_MAX_SYMBOLS} 只股票")
+    try:
+        names = [name for name in indicators.split(",") if name.strip()] if indicators else None
+        frames = await run_in_threadpool(stock_service.get_stocks_indicators, symbols, start_date, end_date, names)
+
+        def compact(df: pd.DataFrame) -> str:
+            # 按列序列化：values[i] 为 columns[i] 的数组，缺失值（指标尚未产生值的开头部分）为 null
+            columns = df.columns if include_prices else df.columns.difference(OHLCV_COLUMNS, sort=False)
+            values = df[columns].astype(float).T.to_json(orient="values", double_precision=15)
+            dates = json.dumps(df.index.strftime("%Y-%m-%d").tolist())
+            return f'{{"dates":{dates},"columns":{json.dumps([str(c) for c in columns])},"values":{values}}}'
+
+        # 几十只股票、每只数千行的数值逐个转换为 Python 对象再序列化很慢，直接用 pandas 按列生成 JSON
+        data = ",".join(f"{json.dumps(symbol)}:{compact(df)}" for symbol, df in frames.items())
+        header = json.dumps({"start_date": start_date, "end_date": end_date or date.today().strftime('%Y-%m-%d')})
+        return Response(f'{header[:-1]},"data":{{{data}}}}}', media_type="application/json")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -80,27 +237,70 @@ async def get_stock_stats(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/stock/stats/batch")
+async def get_stocks_stats(
+    symbols: List[str],
+    start_date: str = Query(..., description="开始日期，格式：YYYY-MM-DD"),
+    end_date: Optional[str] = Query(None, description="结束日期，格式：YYYY-MM-DD")
+) -> Dict[str, Any]:
+    """
+    批量计算多只股票的基本统计量，请求体为股票代码数组
+    """
+    if not symbols:
+        raise HTTPException(status_code=400, detail="股票代码不能为空")
+    if len(symbols) > settings.STOCK_BATCH_MAX_SYMBOLS:
+        raise HTTPException(status_code=413, detail=f"单次最多查询 {settings.STOCK_BATCH_MAX_SYMBOLS} 只股票")
+    try:
+        stock_data = await run_in_threadpool(stock_service.get_stocks_data, symbols, start_date, end_date)
+        return {
+            "start_date": start_date,
+            "end_date": end_date or date.today().strftime('%Y-%m-%d'),
+            "stats": stock_service.calculate_basic_stats_batch(stock_data)
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/stock/portfolio")
 async def optimize_portfolio(
     symbols: List[str],
     start_date: str = Query(..., description="开始日期，格式：YYYY-MM-DD"),
     end_date: Optional[str] = Query(None, description="结束日期，格式：YYYY-MM-DD"),
-    risk_free_rate: float = Query(0.03, description="无风险利率，默认3%")
+    risk_free_rate: float = Query(0.03, description="无风险利率，默认3%"),
+    num_portfolios: int = Query(10000, ge=1, le=settings.PORTFOLIO_MAX_SIMULATIONS, description="随机投资组合数，默认10000"),
+    method: str = Query("monte_carlo", description="计算方法：monte_carlo（随机模拟）或 optimize（二次规划求解有效前沿）"),
+    frontier_points: int = Query(50, ge=2, le=500, description="optimize 方法的有效前沿点数，默认50"),
+    min_weight: float = Query(0.0, description="optimize 方法中单只股票的最小权重，默认0（不允许卖空）"),
+    max_weight: float = Query(1.0, description="optimize 方法中单只股票的最大权重，默认1")
 ) -> Dict[str, Any]:
     """
     投资组合优化
+
+    monte_carlo 随机模拟投资组合，组合数超过 PORTFOLIO_FRONTIER_POINTS 时有效前沿为抽样结果；
+    optimize 直接求解最大夏普比率组合、最小方差组合和有效前沿，支持权重上下限
     """
+    if method not in ("monte_carlo", "optimize"):
+        raise HTTPException(status_code=400, detail=f"不支持的计算方法: {method}")
     try:
-        # 获取所有股票数据
-        stock_data = {}
-        for symbol in symbols:
-            df = stock_service.get_stock_data(symbol, start_date, end_date)
-            stock_data[symbol] = df
+        # 并行获取所有股票数据
+        stock_data = await run_in_threadpool(stock_service.get_stocks_data, symbols, start_date, end_date)
         
         # 优化投资组合
-        result = stock_service.portfolio_optimization(stock_data, risk_free_rate)
+        if method == "optimize":
+            result = await run_in_threadpool(
+                stock_service.efficient_frontier, stock_data, risk_free_rate, frontier_points,
+                min_weight, max_weight
+            )
+        else:
+            result = await run_in_threadpool(
+                stock_service.portfolio_optimization, stock_data, risk_free_rate, num_portfolios,
+                settings.PORTFOLIO_CHUNK_SIZE, settings.PORTFOLIO_FRONTIER_POINTS
+            )
         
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -141,17 +341,51 @@ async def train_default_model(
 @router.post("/bank/predict-default")
 async def predict_default(
     customer_data: Dict[str, Any],
+    background_tasks: BackgroundTasks,
     model_type: str = Query("random_forest", description="模型类型：random_forest 或 logistic_regression")
 ) -> Dict[str, Any]:
     """
-    预测客户违约概率
+    预测客户违约概率（使用已训练的模型，模型未训练时返回 503 并在后台训练）
+
+    并发的单条请求在几毫秒内合并成一批，调用一次模型
     """
     try:
-        result = bank_service.predict_default_probability(customer_data, model_type)
-        return result
+        pipeline = bank_service.get_credit_default_model(model_type)
+        scored = await prediction_batcher.submit(
+            ("credit_default", model_type, id(pipeline), tuple(sorted(customer_data))),
+            customer_data,
+            lambda customers: bank_service.score_default_probability(customers, pipeline)
+        )
+        return bank_service.format_default_prediction(customer_data, scored)
+    except ModelNotTrained as e:
+        return _model_not_trained(e, background_tasks, lambda: bank_service.train_credit_default_model(
+            bank_service.load_credit_data(), model_type
+        ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/bank/predict-default/batch")
+async def predict_default_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    model_type: str = Query("random_forest", description="模型类型：random_forest 或 logistic_regression"),
+    output_format: str = Query("ndjson", alias="format", description="结果格式：ndjson 或 csv")
+):
+    """
+    批量预测违约概率：请求体为客户数据 JSON 数组，或上传的 CSV/Parquet 文件；
+    结果按块流式返回，每行包含 customer_id、default_probability、predicted_default、risk_level
+    """
+    try:
+        pipeline = bank_service.get_credit_default_model(model_type)
+    except ModelNotTrained as e:
+        return _model_not_trained(e, background_tasks, lambda: bank_service.train_credit_default_model(
+            bank_service.load_credit_data(), model_type
+        ))
+    customers = await _read_customers(request)
+    return await _stream_scores(
+        customers, lambda chunk: bank_service.score_default_probability(chunk, pipeline), output_format
+    )
+
 @router.get("/bank/analyze-factors")
 async def analyze_credit_factors() -> Dict[str, Any]:
     """
@@ -217,23 +451,50 @@ async def analyze_car_claims() -> Dict[str, Any]:
 
 @router.post("/insurance/predict-car-claim")
 async def predict_car_claim(
-    customer_data: Dict[str, Any]
+    customer_data: Dict[str, Any],
+    background_tasks: BackgroundTasks
 ) -> Dict[str, Any]:
     """
-    预测车险客户的预期索赔金额
+    预测车险客户的预期索赔金额（使用已训练的模型，模型未训练时返回 503 并在后台训练）
+
+    并发的单条请求在几毫秒内合并成一批，调用一次模型
     """
     try:
-        # 首先分析数据（会训练模型）
-        df = insurance_service.load_car_insurance_data()
-        insurance_service.analyze_car_insurance_claims(df)
-        
-        # 预测
-        result = insurance_service.predict_car_claim_amount(customer_data)
-        
-        return result
+        model = insurance_service.get_car_claim_model()
+        scored = await prediction_batcher.submit(
+            ("car_claim_amount", id(model), tuple(sorted(customer_data))),
+            customer_data,
+            lambda customers: insurance_service.score_car_claim_amount(customers, model)
+        )
+        return insurance_service.format_car_claim_prediction(customer_data, scored)
+    except ModelNotTrained as e:
+        return _model_not_trained(e, background_tasks, lambda: insurance_service.analyze_car_insurance_claims(
+            insurance_service.load_car_insurance_data()
+        ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/insurance/predict-car-claim/batch")
+async def predict_car_claim_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    output_format: str = Query("ndjson", alias="format", description="结果格式：ndjson 或 csv")
+):
+    """
+    批量预测车险预期索赔金额：请求体为客户数据 JSON 数组，或上传的 CSV/Parquet 文件；
+    结果按块流式返回，每行包含 customer_id、predicted_claim_amount、risk_level
+    """
+    try:
+        model = insurance_service.get_car_claim_model()
+    except ModelNotTrained as e:
+        return _model_not_trained(e, background_tasks, lambda: insurance_service.analyze_car_insurance_claims(
+            insurance_service.load_car_insurance_data()
+        ))
+    customers = await _read_customers(request)
+    return await _stream_scores(
+        customers, lambda chunk: insurance_service.score_car_claim_amount(chunk, model), output_format
+    )
+
 @router.post("/insurance/segment-customers")
 async def segment_health_customers(
     n_clusters: int = Query(5, description="分群数量")
@@ -270,20 +531,19 @@ async def predict_health_purchase() -> Dict[str, Any]:
 
 @router.post("/insurance/recommend-products")
 async def recommend_insurance_products(
-    customer_data: Dict[str, Any]
+    customer_data: Dict[str, Any],
+    background_tasks: BackgroundTasks
 ) -> Dict[str, Any]:
     """
-    推荐保险产品
+    推荐保险产品（使用已训练的模型，模型未训练时返回 503 并在后台训练）
     """
     try:
-        # 首先训练模型
-        df = insurance_service.load_health_insurance_data()
-        insurance_service.predict_health_insurance_purchase(df)
-        
-        # 推荐产品
         result = insurance_service.recommend_insurance_products(customer_data)
-        
         return result
+    except ModelNotTrained as e:
+        return _model_not_trained(e, background_tasks, lambda: insurance_service.predict_health_insurance_purchase(
+            insurance_service.load_health_insurance_data()
+        ))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -319,12 +579,12 @@ async def generate_data_visualization(
     params: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
     """
-    生成数据可视化
+    生成数据可视化，返回图表ID，图片通过 /charts/{id} 获取
     """
     try:
         df = pd.DataFrame(data)
-        img_str = data_analysis_service.generate_visualization(df, viz_type, params or {})
-        return {"image": img_str}
+        chart_id = data_analysis_service.generate_visualization(df, viz_type, params or {})
+        return {"image": chart_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Header, Response
+from typing import Dict, Any, Optional
+
+from app.services.chart_store import chart_store
+
+router = APIRouter()
+
+@router.get("/stats", response_model=Dict[str, Any])
+async def get_chart_stats() -> Dict[str, Any]:
+    """
+    获取图表缓存统计（图表数量、占用大小、去重命中次数）
+    """
+    return chart_store.stats()
+
+@router.get("/{chart_id}")
+async def get_chart(
+    chart_id: str,
+    if_none_match: Optional[str] = Header(None)
+) -> Response:
+    """
+    获取图表图片
+
+    图表ID是内容哈希，同一ID的内容不会改变，浏览器可长期缓存
+    """
+    etag = f'"{chart_id}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match and etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+
+    chart = chart_store.get(chart_id)
+    if chart is None:
+        raise HTTPException(status_code=404, detail="图表不存在或已过期，请重新运行代码")
+    content, media_type = chart
+    return Response(content=content, media_type=media_type, headers=headers)
@@ -1,25 +1,59 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+import json
+
+from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional, List
-import base64
-import traceback
-import io
-import sys
-import contextlib
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
 
+from app.core.config import settings
 from app.db.session import get_db
-from app.kernel_manager import KernelManager
-import matplotlib
-from app.services.docker_matplotlib_fix import configure_matplotlib_fonts
-
-# 配置字体以支持中文显示
-configure_matplotlib_fonts()
+from app.models.user import User
+from ..deps import get_optional_current_user
+from app.kernel_manager import get_kernel_manager
+from app.services.admission import admission_controller, AdmissionRejected
+from app.services.code_executor import code_executor
+from app.services.result_cache import result_cache
 
 router = APIRouter()
-kernel_manager = KernelManager()
+
+def _admission_user(current_user: Optional[User], request: Request) -> str:
+    """准入控制中按用户公平调度，未登录时按客户端地址区分"""
+    if current_user is not None:
+        return f"user:{current_user.id}"
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
+def _session(current_user: Optional[User], experiment_id: Any) -> Optional[tuple]:
+    """会话键 (用户, 实验)，用户只取自登录令牌，不信任请求体中的用户ID；未登录时不使用会话"""
+    if current_user is None:
+        return None
+    return str(current_user.id), str(experiment_id)
+
+def _rejected(e: AdmissionRejected) -> HTTPException:
+    """排队已满或超时：返回 503，并在 Retry-After 中给出建议的重试时间"""
+    return HTTPException(
+        status_code=503,
+        detail=e.detail(),
+        headers={"Retry-After": str(int(e.eta or 0) + 1)}
+    )
+
+class TicketStreamingResponse(StreamingResponse):
+    """结束时释放准入票据的流式响应
+
+    票据在创建响应之前申请（排队已满时可以直接返回 503），而 AdmissionController.stream 只在
+    响应体被迭代时才会在结束后释放票据。客户端在响应体开始前断开或发送响应头失败时响应体不会被迭代，
+    这里保证无论响应体是否执行都会释放。
+    """
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_in_threadpool(self.ticket.release)
 
 class ExecutionRequest:
     def __init__(self, code: str, experiment_id: int, step_id: int):
@@ -29,21 +63,27 @@ class ExecutionRequest:
 
 @router.post("", response_model=Dict[str, Any])
 async def execute_code_root(
+    request: Request,
     request_data: Dict[str, Any] = Body(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_current_user)
 ) -> Dict[str, Any]:
     """
     执行代码并返回结果 (根路径版本)
     """
-    return await execute_code(request_data, db)
+    return await execute_code(request, request_data, db, current_user)
 
 @router.post("/execute-code", response_model=Dict[str, Any])
 async def execute_code(
+    request: Request,
     request_data: Dict[str, Any] = Body(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_current_user)
 ) -> Dict[str, Any]:
     """
-    执行代码并返回结果
+    执行代码并返回结果，charts 为图表ID列表，图片通过 /charts/{id} 获取
+
+    执行前需通过准入控制排队，排队已满或等待超时时返回 503，detail 中包含排队位置和预计等待时间
     """
     try:
         # 从请求体中提取代码和元数据
@@ -59,75 +99,109 @@ async def execute_code(
         # 创建执行请求对象
         execution_request = ExecutionRequest(code, experiment_id, step_id)
         
-        # 重定向标准输出来捕获打印输出
-        stdout_capture = io.StringIO()
-        stderr_capture = io.StringIO()
-        charts = []
-        
-        # 捕获可能的matplotlib绘图
-        plt.figure()
+        # 登录用户同一实验的各步骤共享执行命名空间，后续步骤可直接使用前面的变量
+        session = _session(current_user, experiment_id)
+        reset_session = bool(request_data.get("reset_session", False))
         
-        # 使用上下文管理器捕获标准输出和错误
-        with contextlib.redirect_stdout(stdout_capture), contextlib.redirect_stderr(stderr_capture):
-            try:
-                # 创建安全的局部变量环境
-                local_vars = {
-                    'pd': pd,
-                    'np': np,
-                    'plt': plt
-                }
-                
-                # 执行代码
-                exec(code, local_vars)
-                
-                # 检查是否有图形输出
-                if plt.get_fignums():
-                    for i in plt.get_fignums():
-                        fig = plt.figure(i)
-                        img_data = io.BytesIO()
-                        fig.savefig(img_data, format='png')
-                        img_data.seek(0)
-                        chart_base64 = base64.b64encode(img_data.read()).decode('utf-8')
-                        charts.append(chart_base64)
-                    plt.close('all')
-                
-                # 获取标准输出和错误
-                stdout = stdout_capture.getvalue()
-                stderr = stderr_capture.getvalue()
-                
-                # 组合输出信息
-                output = stdout
-                if stderr:
-                    output += f"\nError: {stderr}"
-                
-                # 获取执行结果
-                result = {
-                    "output": output,
-                    "charts": charts,
-                    "success": True if not stderr else False
-                }
-                
-                return result
+        # 未修改的示例代码直接返回缓存的结果，会话中缺少的变量在下次真正执行前补上
+        cached = result_cache.get(execution_request.code)
+        if cached is not None:
+            if session is not None:
+                result_cache.defer(session, execution_request.code, reset_session)
+            return cached
+        async with admission_controller.admit_async(
+            _admission_user(current_user, request), "code", settings.ADMISSION_QUEUE_TIMEOUT
+        ):
+            reset_session, prelude = result_cache.take_deferred(session, reset_session)
             
-            except Exception as e:
-                # 记录错误堆栈并返回错误信息
-                error_trace = traceback.format_exc()
-                return {
-                    "output": f"Error: {str(e)}\n\n{error_trace}",
-                    "charts": [],
-                    "success": False
-                }
-            finally:
-                # 确保关闭所有图表
-                plt.close('all')
+            # 在执行进程池中运行代码，不阻塞事件循环
+            result = await code_executor.run(
+                execution_request.code,
+                capture="all",
+                session=session,
+                reset_session=reset_session,
+                prelude=prelude
+            )
+        result_cache.put(execution_request.code, result, result.pop("data_files", []),
+                         side_effects=result.pop("side_effects", []))
+        return result
     
+    except AdmissionRejected as e:
+        raise _rejected(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/stream")
+async def stream_execute_code(
+    request: Request,
+    request_data: Dict[str, Any] = Body(...),
+    current_user: Optional[User] = Depends(get_optional_current_user)
+) -> StreamingResponse:
+    """
+    流式执行代码，以 Server-Sent Events 逐步返回输出和图表
+
+    每条消息的 data 为一个 JSON 事件：
+    - {"type": "stdout"/"stderr", "data": 文本}
+    - {"type": "chart", "id": 图表ID}，在调用 plt.show() 时或执行结束时发送，图片通过 /charts/{id} 获取
+    - {"type": "ping"}，长时间没有输出时的心跳
+    - {"type": "session_reset"}，执行进程被替换导致该实验之前定义的变量丢失，在输出之前发送
+    - {"type": "queued", "queue_position": 排队位置, "estimated_wait": 预计等待秒数}，排队期间定期发送
+    - {"type": "done", "success": 是否成功}，最后一条
+
+    排队已满时直接返回 503；排队超时时以失败的 done 事件结束
+    """
+    code = request_data.get("code", "")
+    experiment_id = request_data.get("experiment_id")
+
+    if not code:
+        raise HTTPException(status_code=400, detail="代码不能为空")
+    if not experiment_id:
+        raise HTTPException(status_code=400, detail="必须提供实验ID")
+
+    session = _session(current_user, experiment_id)
+    reset_session = bool(request_data.get("reset_session", False))
+
+    cached = result_cache.get(code, mode="stream")
+    ticket = None
+    if cached is not None:
+        if session is not None:
+            result_cache.defer(session, code, reset_session)
+        events = result_cache.replay(cached)
+    else:
+        try:
+            ticket = await admission_controller.submit_async(_admission_user(current_user, request), "code")
+        except AdmissionRejected as e:
+            raise _rejected(e)
+
+        def execute():
+            # 获准后再取出待补执行的代码，排队超时不会丢失
+            reset, prelude = result_cache.take_deferred(session, reset_session)
+            return result_cache.record_stream(code, code_executor.stream(
+                code,
+                session=session,
+                reset_session=reset,
+                prelude=prelude
+            ))
+
+        events = admission_controller.stream(ticket, execute, settings.ADMISSION_QUEUE_TIMEOUT)
+
+    async def event_source():
+        # 客户端读取较慢时 yield 会等待发送完成，执行器的缓冲区随之写满并暂停执行进程的输出
+        async for event in events:
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    # 禁止 nginx 缓冲响应，保证事件及时送达
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if ticket is None:
+        return StreamingResponse(event_source(), media_type="text/event-stream", headers=headers)
+    return TicketStreamingResponse(event_source(), ticket, media_type="text/event-stream", headers=headers)
+
 @router.post("/execute", response_model=Dict[str, Any])
 async def execute_custom_code(
+    request: Request,
     request_data: Dict[str, Any] = Body(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_current_user)
 ) -> Dict[str, Any]:
     """
     执行自定义代码并返回结果
@@ -139,65 +213,45 @@ async def execute_custom_code(
         if not code:
             raise HTTPException(status_code=400, detail="代码不能为空")
         
-        # 重定向标准输出来捕获打印输出
-        stdout_capture = io.StringIO()
-        stderr_capture = io.StringIO()
-        
-        # 捕获可能的matplotlib绘图
-        visualization_data = None
+        # 在执行进程池中运行代码，只返回当前图形
+        async with admission_controller.admit_async(
+            _admission_user(current_user, request), "code", settings.ADMISSION_QUEUE_TIMEOUT
+        ):
+            result = await code_executor.run(code, capture="current")
         
-        # 使用上下文管理器捕获标准输出和错误
-        with contextlib.redirect_stdout(stdout_capture), contextlib.redirect_stderr(stderr_capture):
-            try:
-                # 创建安全的局部变量环境 - 导入常用的数据分析库
-                local_vars = {
-                    'pd': pd,
-                    'np': np,
-                    'plt': plt,
-                }
-                
-                # 执行代码
-                exec(code, local_vars)
-                
-                # 检查是否有图形输出
-                if plt.get_fignums():
-                    fig = plt.gcf()  # 获取当前图形
-                    img_data = io.BytesIO()
-                    fig.savefig(img_data, format='png', bbox_inches='tight')
-                    img_data.seek(0)
-                    visualization_data = base64.b64encode(img_data.read()).decode('utf-8')
-                    plt.close('all')
-                
-                # 获取标准输出和错误
-                stdout = stdout_capture.getvalue()
-                stderr = stderr_capture.getvalue()
-                
-                # 组合输出信息
-                output = stdout
-                if stderr:
-                    output += f"\nError: {stderr}"
-                
-                return {
-                    "output": output,
-                    "visualization": visualization_data,
-                    "success": True if not stderr else False
-                }
-            
-            except Exception as e:
-                # 记录错误堆栈并返回错误信息
-                error_trace = traceback.format_exc()
-                return {
-                    "output": f"Error: {str(e)}\n\n{error_trace}",
-                    "visualization": None,
-                    "success": False
-                }
-            finally:
-                # 确保关闭所有图表
-                plt.close('all')
+        return {
+            "output": result["output"],
+            "visualization": result["charts"][0] if result["charts"] else None,
+            "success": result["success"]
+        }
     
+    except AdmissionRejected as e:
+        raise _rejected(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/stats", response_model=Dict[str, Any])
+async def get_executor_stats() -> Dict[str, Any]:
+    """
+    获取代码执行器运行统计（执行模式、进程数、任务启动延迟、示例代码结果缓存）
+    """
+    return {**code_executor.stats(), "result_cache": result_cache.stats()}
+
+@router.get("/admission", response_model=Dict[str, Any])
+async def get_admission_status() -> Dict[str, Any]:
+    """
+    获取准入控制状态（执行中/排队数、资源占用）以及新请求的预计排队位置和等待时间
+    """
+    stats = await run_in_threadpool(admission_controller.stats)
+    return {**stats, "estimate": await run_in_threadpool(admission_controller.estimate, "code")}
+
+@router.get("/kernel-pool", response_model=Dict[str, Any])
+async def get_kernel_pool_stats() -> Dict[str, Any]:
+    """
+    获取内核预热容器池统计（空闲/使用中容器数、命中率、分配延迟）
+    """
+    return get_kernel_manager().pool_stats()
+
 @router.post("/user_codes", response_model=Dict[str, Any])
 async def save_user_code(
     request_data: Dict[str, Any] = Body(...),
@@ -0,0 +1,127 @@
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Any, Optional
+import json
+
+from app.models.user import User
+from app.services.workflow_runs import workflow_runs, FINISHED_STATES
+from app.worker import execute_workflow_task
+from ..deps import get_authenticated_user
+
+router = APIRouter()
+
+# 事件流中等待新事件的最长时间（毫秒），超时后发送心跳
+STREAM_BLOCK_MS = 15000
+
+
+def _get_run(run_id: str, current_user: User) -> Dict[str, Any]:
+    run = workflow_runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="运行不存在或已过期")
+    if run["user_id"] != str(current_user.id):
+        raise HTTPException(status_code=403, detail="无权查看该运行")
+    return run
+
+
+@router.post("/runs", response_model=Dict[str, Any])
+async def submit_workflow_run(
+    request_data: Dict[str, Any] = Body(...),
+    current_user: User = Depends(get_authenticated_user)
+) -> Dict[str, Any]:
+    """
+    提交工作流异步执行，立即返回运行ID
+
+    请求体：{"workflow": {"nodes": [...], "edges": [...]}, "experiment_id": 实验ID, "use_cache": 是否使用缓存}
+    """
+    workflow = request_data.get("workflow") or {}
+    experiment_id = request_data.get("experiment_id")
+
+    if not workflow.get("nodes"):
+        raise HTTPException(status_code=400, detail="工作流不能为空")
+    if not experiment_id:
+        raise HTTPException(status_code=400, detail="必须提供实验ID")
+
+    try:
+        run_id = workflow_runs.create(current_user.id, experiment_id, len(workflow["nodes"]))
+        execute_workflow_task.apply_async(
+            args=(workflow, current_user.id, experiment_id),
+            kwargs={"run_id": run_id, "use_cache": bool(request_data.get("use_cache", True))},
+            task_id=run_id
+        )
+        return {"run_id": run_id, "status": workflow_runs.get(run_id)["status"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/runs/{run_id}", response_model=Dict[str, Any])
+async def get_workflow_run(
+    run_id: str,
+    current_user: User = Depends(get_authenticated_user)
+) -> Dict[str, Any]:
+    """
+    查询运行状态：status 为 queued/running/succeeded/failed，completed_nodes/total_nodes 为进度，
+    结束后 result 为工作流的执行结果
+    """
+    return _get_run(run_id, current_user)
+
+
+@router.get("/runs/{run_id}/events", response_model=Dict[str, Any])
+async def get_workflow_run_events(
+    run_id: str,
+    after: str = "0",
+    current_user: User = Depends(get_authenticated_user)
+) -> Dict[str, Any]:
+    """
+    轮询进度事件：返回 after 之后的事件，下次请求时把 last_id 作为 after
+    """
+    run = _get_run(run_id, current_user)
+    events = workflow_runs.events(run_id, after=after)
+    return {
+        "status": run["status"],
+        "events": [dict(event, id=event_id) for event_id, event in events],
+        "last_id": events[-1][0] if events else after,
+    }
+
+
+@router.get("/runs/{run_id}/stream")
+async def stream_workflow_run(
+    run_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_authenticated_user)
+) -> StreamingResponse:
+    """
+    以 Server-Sent Events 推送进度事件，run_finished 事件后结束；断线重连时从 Last-Event-ID 之后继续
+
+    事件：{"type": "run_started"}、{"type": "node_started", "node": 节点ID}、{"type": "node_waiting", "node": 节点ID}、
+    {"type": "node_finished", "node": 节点ID, "success": ..., "cached": ..., "duration": ...}、
+    {"type": "run_finished", "status": ..., "success": ...}，长时间没有事件时发送 {"type": "ping"}
+    """
+    run = _get_run(run_id, current_user)
+
+    async def event_source():
+        after = last_event_id or "0"
+        finished = run["status"] in FINISHED_STATES
+        while not await request.is_disconnected():
+            # 阻塞读取放到线程池中，不占用事件循环
+            events = await run_in_threadpool(
+                workflow_runs.events, run_id, after, 100, None if finished else STREAM_BLOCK_MS
+            )
+            if not events:
+                if finished:
+                    return
+                yield f"data: {json.dumps({'type': 'ping'})}\n\n"
+                continue
+            for event_id, event in events:
+                after = event_id
+                yield f"id: {event_id}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if event.get("type") == "run_finished":
+                    return
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        # 禁止 nginx 缓冲响应，保证事件及时送达
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
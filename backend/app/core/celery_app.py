@@ -5,9 +5,14 @@ from app.core.config import settings
 celery_app = Celery(
     "worker",
     backend=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/0",
-    broker=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/0"
+    broker=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/0",
+    include=["app.worker"]
 )
 
 celery_app.conf.task_routes = {
     "app.worker.test_celery": "main-queue",
-}
\ No newline at end of file
+    "app.worker.execute_workflow_task": "workflow-queue",
+}
+# 工作流任务耗时较长，每个 worker 进程只预取一个任务，避免任务积压在繁忙的 worker 上
+celery_app.conf.worker_prefetch_multiplier = 1
+celery_app.conf.task_always_eager = settings.CELERY_TASK_ALWAYS_EAGER
@@ -33,7 +33,73 @@ class Settings:
     
     # 实验环境配置
     PYTHON_ENV_PATH: str = os.getenv("PYTHON_ENV_PATH", "/usr/local/bin/python")
-    MAX_CONCURRENT_EXPERIMENTS: int = 60
+    MAX_CONCURRENT_EXPERIMENTS: int = int(os.getenv("MAX_CONCURRENT_EXPERIMENTS", "60"))
+    
+    # 代码执行进程池配置
+    CODE_EXECUTOR_MODE: str = os.getenv("CODE_EXECUTOR_MODE", "pool")  # pool: 常驻进程池; zygote: 预加载后按任务fork
+    CODE_EXECUTOR_WORKERS: int = int(os.getenv("CODE_EXECUTOR_WORKERS", "4"))
+    CODE_EXECUTOR_START_METHOD: Optional[str] = os.getenv("CODE_EXECUTOR_START_METHOD") or None  # fork / spawn / forkserver
+    CODE_EXECUTION_TIMEOUT: int = int(os.getenv("CODE_EXECUTION_TIMEOUT", "120"))  # 单次执行最长时间（秒）
+    CODE_EXECUTION_MEMORY_LIMIT_MB: int = int(os.getenv("CODE_EXECUTION_MEMORY_LIMIT_MB", "1024"))  # 单次执行内存上限
+    CODE_SESSION_TTL: int = int(os.getenv("CODE_SESSION_TTL", "1800"))  # 会话命名空间空闲多久后清理（秒）
+    CODE_SESSION_MEMORY_MB: int = int(os.getenv("CODE_SESSION_MEMORY_MB", "2048"))  # 所有会话命名空间的内存预算
+    
+    # 图表缓存配置
+    CHART_FORMAT: str = os.getenv("CHART_FORMAT", "png")  # png / webp
+    CHART_DPI: int = int(os.getenv("CHART_DPI", "100"))  # 图表分辨率，降低可减小图片体积
+    CHART_CACHE_MB: int = int(os.getenv("CHART_CACHE_MB", "256"))  # 图表缓存总大小上限
+    
+    # 示例代码执行结果缓存配置
+    DATA_DIR: str = os.getenv("DATA_DIR", "./data")  # 数据文件目录
+    RESULT_CACHE_ENTRIES: int = int(os.getenv("RESULT_CACHE_ENTRIES", "256"))  # 最多缓存的结果数，0 表示关闭
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", "3600"))  # 缓存结果的有效期（秒），0 表示不过期
+    DATASET_CACHE_ENTRIES: int = int(os.getenv("DATASET_CACHE_ENTRIES", "32"))  # 分析服务在内存中保留的数据集数，0 表示关闭
+    MODEL_DIR: str = os.getenv("MODEL_DIR", os.path.join(DATA_DIR, "models"))  # 训练好的分析模型的保存目录
+    MODEL_CACHE_ENTRIES: int = int(os.getenv("MODEL_CACHE_ENTRIES", "8"))  # 内存中最多保留的模型数
+    BATCH_SCORING_CHUNK_ROWS: int = int(os.getenv("BATCH_SCORING_CHUNK_ROWS", "5000"))  # 批量评分每次送入模型的行数
+    BATCH_SCORING_MAX_ROWS: int = int(os.getenv("BATCH_SCORING_MAX_ROWS", "500000"))  # 批量评分单次请求的最大行数
+    MICRO_BATCH_MAX_SIZE: int = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))  # 单条预测请求合并成一批的最大请求数，1 表示不合并
+    MICRO_BATCH_MAX_DELAY_MS: float = float(os.getenv("MICRO_BATCH_MAX_DELAY_MS", "5"))  # 单条预测请求等待合并的最长时间（毫秒）
+    PORTFOLIO_MAX_SIMULATIONS: int = int(os.getenv("PORTFOLIO_MAX_SIMULATIONS", "2000000"))  # 投资组合优化单次请求最多模拟的组合数
+    PORTFOLIO_CHUNK_SIZE: int = int(os.getenv("PORTFOLIO_CHUNK_SIZE", "100000"))  # 投资组合模拟每块计算的组合数
+    PORTFOLIO_FRONTIER_POINTS: int = int(os.getenv("PORTFOLIO_FRONTIER_POINTS", "10000"))  # 有效前沿最多返回的点数
+    OHLCV_LOAD_WORKERS: int = int(os.getenv("OHLCV_LOAD_WORKERS", "8"))  # 批量获取多只股票行情时的线程数
+    STOCK_BATCH_MAX_SYMBOLS: int = int(os.getenv("STOCK_BATCH_MAX_SYMBOLS", "200"))  # 批量指标和统计接口单次最多查询的股票数
+    INDICATOR_CACHE_ENTRIES: int = int(os.getenv("INDICATOR_CACHE_ENTRIES", "64"))  # 最多缓存的技术指标计算结果数
+    
+    # 内核预热容器池配置（容器总数上限为 MAX_CONCURRENT_EXPERIMENTS）
+    KERNEL_POOL_SIZE: int = int(os.getenv("KERNEL_POOL_SIZE", "4"))  # 保持的空闲容器数，0 表示不预热
+    KERNEL_POOL_MAX_USES: int = int(os.getenv("KERNEL_POOL_MAX_USES", "20"))  # 每个容器最多复用次数
+    KERNEL_ACQUIRE_TIMEOUT: int = int(os.getenv("KERNEL_ACQUIRE_TIMEOUT", "60"))  # 容器全部占用时的最长等待（秒）
+    KERNEL_HEALTH_CHECK_INTERVAL: int = int(os.getenv("KERNEL_HEALTH_CHECK_INTERVAL", "30"))  # 空闲容器健康检查间隔（秒）
+    KERNEL_IDLE_TIMEOUT: int = int(os.getenv("KERNEL_IDLE_TIMEOUT", "1800"))  # 内核超过该时间（秒）没有执行代码即被回收，0 表示不回收
+    KERNEL_REAP_INTERVAL: int = int(os.getenv("KERNEL_REAP_INTERVAL", "60"))  # 扫描空闲内核的间隔（秒）
+    KERNEL_REAP_BATCH: int = int(os.getenv("KERNEL_REAP_BATCH", "20"))  # 每批回收的内核数
+    
+    # 工作流执行配置
+    WORKFLOW_MAX_PARALLEL_NODES: int = int(os.getenv("WORKFLOW_MAX_PARALLEL_NODES", "4"))  # 同时执行的节点数（每个占用一个内核）
+    WORKFLOW_NODE_TIMEOUT: int = int(os.getenv("WORKFLOW_NODE_TIMEOUT", "600"))  # 单个节点最长执行时间（秒），超时中断内核，0 表示不限制
+    WORKFLOW_POOLED_KERNELS: bool = os.getenv("WORKFLOW_POOLED_KERNELS", "true").lower() == "true"  # 节点使用预热池中的内核（节点之间通过共享卷传递数据，不挂载用户工作目录 /data/user_{id}），false 时冷启动挂载工作目录的内核
+    WORKFLOW_ARTIFACT_VOLUME: str = os.getenv("WORKFLOW_ARTIFACT_VOLUME", "platform_workflow_artifacts")  # 节点间传递数据的共享卷
+    WORKFLOW_ARTIFACT_INLINE_KB: int = int(os.getenv("WORKFLOW_ARTIFACT_INLINE_KB", "64"))  # 不超过该大小的 JSON 结果直接传递，超过则写入文件
+    WORKFLOW_ARTIFACT_TTL: int = int(os.getenv("WORKFLOW_ARTIFACT_TTL", "3600"))  # 异常退出遗留的数据文件保留时间（秒）
+    WORKFLOW_NODE_CACHE_ENTRIES: int = int(os.getenv("WORKFLOW_NODE_CACHE_ENTRIES", "1000"))  # 最多缓存的节点输出数，0 表示关闭
+    WORKFLOW_NODE_CACHE_MB: int = int(os.getenv("WORKFLOW_NODE_CACHE_MB", "2048"))  # 缓存的节点输出文件总大小上限
+    WORKFLOW_NODE_CACHE_TTL: int = int(os.getenv("WORKFLOW_NODE_CACHE_TTL", "86400"))  # 节点输出缓存的有效期（秒）
+    WORKFLOW_RUN_TTL: int = int(os.getenv("WORKFLOW_RUN_TTL", "86400"))  # 异步运行的状态和进度事件保留时间（秒）
+    WORKFLOW_RUN_MAX_EVENTS: int = int(os.getenv("WORKFLOW_RUN_MAX_EVENTS", "10000"))  # 每次运行最多保留的进度事件数
+    
+    # 准入控制配置（同时执行的任务总数上限为 MAX_CONCURRENT_EXPERIMENTS）
+    ADMISSION_CPU_BUDGET: float = float(os.getenv("ADMISSION_CPU_BUDGET", "0"))  # 同时执行的任务占用的CPU核数上限，0 表示主机核数
+    ADMISSION_MEMORY_MB: int = int(os.getenv("ADMISSION_MEMORY_MB", "0"))  # 同时执行的任务占用的内存上限，0 表示物理内存的80%
+    ADMISSION_USER_CODE_LIMIT: int = int(os.getenv("ADMISSION_USER_CODE_LIMIT", "2"))  # 每个用户同时执行的代码数
+    ADMISSION_USER_KERNEL_LIMIT: int = int(os.getenv("ADMISSION_USER_KERNEL_LIMIT", "4"))  # 每个用户同时占用的内核数
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))  # 排队的请求数上限
+    ADMISSION_MAX_WAIT: int = int(os.getenv("ADMISSION_MAX_WAIT", "300"))  # 预计等待超过该时间（秒）时拒绝，0 表示不限制
+    ADMISSION_QUEUE_TIMEOUT: int = int(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))  # 代码执行请求最长排队时间（秒）
+    
+    # Celery配置
+    CELERY_TASK_ALWAYS_EAGER: bool = os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() == "true"  # 在提交任务的进程中同步执行（测试用）
     
     def __init__(self):
         if self.DB_TYPE.lower() == "postgres":
@@ -1,14 +1,49 @@
-import json
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import networkx as nx
-from compute_engine.kernel_manager import KernelManager
+from app.core.config import settings
+from app.kernel_manager import get_kernel_manager
+from app.services.admission import AdmissionRejected
+from app.workflow_artifacts import MANIFEST_VAR, check_artifacts, cleanup_code, node_code, parse_manifest
+from app.workflow_cache import node_key, node_output_cache
 
 class WorkflowEngine:
     """工作流执行引擎"""
-    def __init__(self):
-        self.kernel_manager = KernelManager()
+    def __init__(self, kernel_manager=None, node_cache=None):
+        # 默认使用进程内共享的内核管理器；节点不需要用户工作目录时内核从预热容器池中分配，执行结束后回收
+        self.kernel_manager = kernel_manager if kernel_manager is not None else get_kernel_manager()
+        self.node_cache = node_cache if node_cache is not None else node_output_cache
         
-    def execute_workflow(self, workflow_data, user_id, experiment_id):
-        """执行整个工作流"""
+    def execute_workflow(self, workflow_data, user_id, experiment_id, max_parallel=None, use_cache=True,
+                         on_event=None):
+        """执行整个工作流
+        
+        节点的前驱全部完成后立即开始执行，互不依赖的分支（如基于同一特征节点训练的多个模型）
+        在不同的内核中并行执行。节点的输出写入所有内核共享的数据卷（表格为 Parquet），
+        后继节点按引用读取，引擎中只传递小的结果清单，因此节点可以分配到任意内核。
+        某个节点失败后不再启动尚未开始的节点，已在执行的节点执行完毕后返回。
+        节点执行超过 settings.WORKFLOW_NODE_TIMEOUT 秒时中断内核，该节点按失败处理。
+        工作流结束后删除本次执行产生的文件；没有后继的节点的 JSON 结果总是直接返回。
+        
+        节点的输出按用户、节点代码及其全部上游代码缓存，重新运行修改过的工作流时只执行修改的节点及其下游，
+        其余节点直接使用缓存的输出（全部命中时不需要分配内核）。
+        
+        Args:
+            workflow_data: 工作流定义，包含 nodes 和 edges
+            user_id: 用户ID
+            experiment_id: 实验ID
+            max_parallel: 同时执行的节点数（即使用的内核数）上限，默认使用 settings.WORKFLOW_MAX_PARALLEL_NODES
+            use_cache: 是否使用缓存的节点输出，为 False 时执行所有节点（结果仍会写入缓存）
+            on_event: 进度回调，节点开始时收到 {"type": "node_started", "node": 节点ID}，
+                结束时收到 {"type": "node_finished", "node": 节点ID, "success": ..., "cached": ..., "duration": ...}，
+                未获准创建额外内核、等待已有内核时收到 {"type": "node_waiting", "node": 节点ID}
+            
+        Returns:
+            执行结果，results 为各节点的结果清单（文件以 {"__artifact__": 路径, "format": 格式, ...} 表示），
+            timings 中记录每个节点相对工作流开始的开始时间、结束时间和耗时（秒），
+            cache_hits 为使用了缓存输出的节点
+        """
         # 解析工作流
         nodes = workflow_data.get('nodes', [])
         edges = workflow_data.get('edges', [])
@@ -31,68 +66,218 @@ class WorkflowEngine:
                 "message": "工作流不是有向无环图，无法执行"
             }
         
-        # 获取拓扑排序
-        topological_order = list(nx.topological_sort(G))
+        max_parallel = max(1, max_parallel or settings.WORKFLOW_MAX_PARALLEL_NODES)
+        # 节点ID -> 尚未完成的前驱数量
+        waiting = {node_id: G.in_degree(node_id) for node_id in G.nodes}
+        # 按拓扑排序决定同时就绪的节点的启动顺序
+        order = {node_id: i for i, node_id in enumerate(nx.topological_sort(G))}
         
-        # 创建内核
-        kernel_id = self.kernel_manager.create_kernel(user_id, experiment_id)
+        # 节点ID -> 缓存键
+        cache = self.node_cache if self.node_cache.enabled else None
+        keys = {}
+        for node_id in order:
+            keys[node_id] = node_key(G.nodes[node_id]['data'].get('code', ''),
+                                     [(pred, keys[pred]) for pred in G.predecessors(node_id)], user_id)
         
+        run_id = uuid.uuid4().hex
+        inline_limit = settings.WORKFLOW_ARTIFACT_INLINE_KB * 1024
         results = {}
-        # 按拓扑排序执行节点
+        timings = {}
+        cache_hits = []
+        # 节点ID -> 节点输出的缓存目录
+        publish_dirs = {}
+        failure = None
+        ready = []
+        started = time.perf_counter()
+        
+        def notify(event):
+            # 进度回调失败不影响工作流执行
+            if on_event is not None:
+                try:
+                    on_event(event)
+                except Exception:
+                    pass
+        
+        def complete(node_id, manifest):
+            """记录节点结果，前驱全部完成的后继节点命中缓存时直接完成，否则进入就绪队列"""
+            results[node_id] = manifest
+            for succ in G.successors(node_id):
+                waiting[succ] -= 1
+                if waiting[succ] == 0:
+                    enqueue(succ)
+        
+        def enqueue(node_id):
+            manifest = cache.get(user_id, keys[node_id], run_id) if cache is not None and use_cache else None
+            if manifest is None:
+                ready.append(node_id)
+                return
+            now = round(time.perf_counter() - started, 3)
+            timings[node_id] = {"start": now, "end": now, "duration": 0.0, "success": True, "cached": True}
+            cache_hits.append(node_id)
+            notify({"type": "node_finished", "node": node_id, "success": True, "cached": True, "duration": 0.0})
+            complete(node_id, manifest)
+        
+        # 已创建的内核和当前空闲的内核
+        kernels = []
+        idle_kernels = []
+        # 正在创建的内核数；准入控制不允许再创建内核时，并行度降为已有的内核数
+        creating = 0
+        # 需要先创建内核的节点任务，结束时（无论成功与否）减少 creating
+        creators = set()
+        limit = max_parallel
+        running = {}
+        
+        executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="workflow-node")
         try:
-            for node_id in topological_order:
-                node_data = G.nodes[node_id]['data']
-                component_code = node_data.get('code', '')
-                
-                # 准备输入
-                input_vars = {}
-                for pred in G.predecessors(node_id):
-                    input_vars[pred] = results.get(pred, {})
-                
-                # 准备执行代码
-                exec_code = f"""
-# 输入数据
-input_data = {json.dumps(input_vars)}
-                
-# 组件代码
-{component_code}
-                
-# 输出结果
-print("<<<RESULT_START>>>")
-print(json.dumps(result))
-print("<<<RESULT_END>>>")
-"""
-                
-                # 执行代码
-                execution_result = self.kernel_manager.execute_code(kernel_id, exec_code)
-                
-                if execution_result['exit_code'] != 0:
-                    return {
-                        "success": False,
-                        "message": f"节点 {node_id} 执行失败",
-                        "error": execution_result['output']
-                    }
-                
-                # 解析结果
-                output = execution_result['output']
-                result_start = output.find("<<<RESULT_START>>>") + len("<<<RESULT_START>>>")
-                result_end = output.find("<<<RESULT_END>>>")
+            for node_id in order:
+                if G.in_degree(node_id) == 0:
+                    enqueue(node_id)
+            ready.sort(key=order.get)
+            
+            while ready or running:
+                # 失败后不再启动新的节点
+                while ready and failure is None and len(running) < limit:
+                    node_id = ready.pop(0)
+                    kernel_id = idle_kernels.pop() if idle_kernels else None
+                    # 第一个内核排队等待准入，额外的内核只在资源充足时创建
+                    admission_timeout = None if not kernels and not creating else 0
+                    inputs = {pred: results.get(pred, {}) for pred in G.predecessors(node_id)}
+                    # 使用缓存时输出先写入本次执行的目录，写完后改名为缓存目录，工作流结束后保留
+                    if cache is not None:
+                        output_dir, publish_dirs[node_id] = f"{run_id}/{keys[node_id]}", cache.directory(
+                            user_id, keys[node_id], run_id)
+                    else:
+                        output_dir = run_id
+                    code = node_code(output_dir, node_id, G.nodes[node_id]['data'].get('code', ''), inputs,
+                                     inline_limit if G.out_degree(node_id) else None, publish_dirs.get(node_id))
+                    future = executor.submit(self._run_node, code, kernel_id, user_id, experiment_id, started,
+                                             admission_timeout)
+                    running[future] = node_id
+                    if kernel_id is None:
+                        creating += 1
+                        creators.add(future)
+                    notify({"type": "node_started", "node": node_id})
+                if not running:
+                    break
                 
-                if result_start > 0 and result_end > result_start:
-                    result_json = output[result_start:result_end].strip()
-                    results[node_id] = json.loads(result_json)
-                else:
-                    results[node_id] = {"output": output}
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node_id = running.pop(future)
+                    if future in creators:
+                        creators.discard(future)
+                        creating -= 1
+                    kernel_id, execution_result, timing = future.result()
+                    if execution_result is None:
+                        # 未获准创建内核：节点放回队首，等已有内核空闲后执行
+                        ready.insert(0, node_id)
+                        limit = max(1, len(kernels) + creating)
+                        notify({"type": "node_waiting", "node": node_id})
+                        continue
+                    if kernel_id is not None:
+                        if kernel_id not in kernels:
+                            kernels.append(kernel_id)
+                        idle_kernels.append(kernel_id)
+                    timings[node_id] = timing
+                    notify({"type": "node_finished", "node": node_id, "success": timing["success"],
+                            "cached": False, "duration": timing["duration"]})
+                    
+                    if execution_result.get('exit_code') != 0:
+                        # 缓存的上游输出文件可能已被删除，不再使用
+                        for pred in G.predecessors(node_id):
+                            if pred in cache_hits:
+                                cache.invalidate(user_id, keys[pred])
+                        if failure is None:
+                            failure = {
+                                "success": False,
+                                "message": f"节点 {node_id} 执行{'超时' if execution_result.get('timed_out') else '失败'}",
+                                "error": execution_result['output']
+                            }
+                        continue
+                    
+                    manifest = parse_manifest(execution_result)
+                    # 只接受引用节点自己输出目录的清单，避免读取（反序列化）其他用户的文件
+                    check_artifacts(manifest, publish_dirs.get(node_id, run_id))
+                    if cache is not None:
+                        cache.put(user_id, keys[node_id], manifest, publish_dirs[node_id], run_id)
+                    complete(node_id, manifest)
+                    ready.sort(key=order.get)
             
-            return {
+            summary = {
+                "timings": timings,
+                "cache_hits": cache_hits,
+                "elapsed": round(time.perf_counter() - started, 3),
+                "max_parallel": max_parallel
+            }
+            if failure is not None:
+                skipped = [node_id for node_id in order if node_id not in timings]
+                return dict(failure, results=results, skipped=skipped, **summary)
+            
+            return dict({
                 "success": True,
                 "results": results
-            }
+            }, **summary)
         except Exception as e:
             return {
                 "success": False,
                 "message": str(e)
             }
         finally:
+            executor.shutdown(wait=True)
+            # 删除本次执行的文件和被淘汰的缓存目录（仍被其他工作流使用的除外），没有内核时留到下次
+            evicted = []
+            if cache is not None:
+                try:
+                    cache.unpin(run_id)
+                    evicted = cache.take_evicted()
+                except Exception:
+                    pass
+            cleaned = False
+            if kernels:
+                try:
+                    cleaned = self.kernel_manager.execute_code(kernels[0], cleanup_code(
+                        run_id, settings.WORKFLOW_ARTIFACT_TTL, evicted, self.node_cache.ttl
+                    ), timeout=settings.WORKFLOW_NODE_TIMEOUT or None)['exit_code'] == 0
+                except Exception:
+                    pass
+            if evicted and not cleaned:
+                cache.restore_evicted(evicted)
             # 终止内核
-            self.kernel_manager.terminate_kernel(kernel_id)
+            for kernel_id in kernels:
+                self.kernel_manager.terminate_kernel(kernel_id)
+            
+    def _run_node(self, code, kernel_id, user_id, experiment_id, started, admission_timeout=None):
+        """在工作线程中执行一个节点，没有空闲内核时先创建一个
+        
+        Args:
+            admission_timeout: 创建内核时等待准入的最长时间（秒），0 表示资源不足时不等待
+        
+        Returns:
+            (内核ID, 执行结果, 节点耗时)，内核创建失败时内核ID为 None；
+            不等待准入且未获准创建内核时返回 (None, None, None)。
+            执行超过 settings.WORKFLOW_NODE_TIMEOUT 秒时内核被中断，执行结果为失败并带有 timed_out
+        """
+        node_start = time.perf_counter()
+        try:
+            if kernel_id is None:
+                kernel_id = self.kernel_manager.create_kernel(user_id, experiment_id,
+                                                              workspace=not settings.WORKFLOW_POOLED_KERNELS,
+                                                              admission_timeout=admission_timeout)
+            execution_result = self.kernel_manager.execute_code(
+                kernel_id, code, timeout=settings.WORKFLOW_NODE_TIMEOUT or None,
+                user_expressions={MANIFEST_VAR: MANIFEST_VAR}
+            )
+        except AdmissionRejected as e:
+            if admission_timeout == 0:
+                return None, None, None
+            execution_result = {"exit_code": 1, "output": str(e)}
+        except Exception as e:
+            execution_result = {"exit_code": 1, "output": str(e)}
+        node_end = time.perf_counter()
+        timing = {
+            "start": round(node_start - started, 3),
+            "end": round(node_end - started, 3),
+            "duration": round(node_end - node_start, 3),
+            "success": execution_result.get('exit_code') == 0
+        }
+        return kernel_id, execution_result, timing
+
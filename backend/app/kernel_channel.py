@@ -0,0 +1,230 @@
+import io
+import json
+import logging
+import queue
+import re
+import tarfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from jupyter_client import BlockingKernelClient
+
+logger = logging.getLogger(__name__)
+
+# 容器内内核的连接文件，以及各通道使用的固定端口（每个容器有独立的网络命名空间）
+CONNECTION_FILE = "/home/jovyan/.platform-kernel.json"
+KERNEL_PORTS = {
+    "shell_port": 50001,
+    "iopub_port": 50002,
+    "stdin_port": 50003,
+    "control_port": 50004,
+    "hb_port": 50005,
+}
+
+# 内核启动后预先导入的模块，使第一个节点也不必等待导入
+KERNEL_PRELOAD = "import json\nimport pandas as pd\nimport numpy as np\n"
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+def _container_ip(container, network: Optional[str]) -> str:
+    """容器在指定网络中的 IP 地址，取不到时使用容器名（依赖 Docker 内置 DNS）"""
+    networks = (container.attrs.get("NetworkSettings") or {}).get("Networks") or {}
+    if network and networks.get(network, {}).get("IPAddress"):
+        return networks[network]["IPAddress"]
+    for endpoint in networks.values():
+        if endpoint.get("IPAddress"):
+            return endpoint["IPAddress"]
+    return container.name
+
+
+class KernelChannel:
+    """与容器内 Jupyter 内核的长连接
+
+    在容器中启动一个 ipykernel，并通过 jupyter-client 的 ZMQ 通道直接与其通信。每次执行代码只需
+    一次消息往返，不再需要 docker cp 和新的 Python 进程，解释器状态在多次执行之间保留。
+    """
+
+    def __init__(self, container, connection_info: Dict[str, Any], ip: str):
+        self.container = container
+        self.connection_info = connection_info
+        self.ip = ip
+        self._client: Optional[BlockingKernelClient] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, container, network: Optional[str] = None, timeout: float = 60) -> "KernelChannel":
+        """连接容器中的内核，内核不存在或已退出时启动一个新的
+
+        Args:
+            container: 内核容器
+            network: 容器所在的 Docker 网络，用于确定连接地址
+            timeout: 等待内核就绪的最长时间（秒）
+        """
+        container.reload()
+        ip = _container_ip(container, network)
+        connection_info = cls._read_connection_file(container)
+        if connection_info is not None:
+            channel = cls(container, connection_info, ip)
+            try:
+                channel._connect(timeout=min(timeout, 5))
+                return channel
+            except RuntimeError:
+                channel.close()
+
+        connection_info = dict(KERNEL_PORTS, ip="0.0.0.0", key=uuid.uuid4().hex,
+                               transport="tcp", signature_scheme="hmac-sha256")
+        channel = cls(container, connection_info, ip)
+        channel._launch()
+        channel._connect(timeout)
+        channel.execute(KERNEL_PRELOAD, timeout)
+        return channel
+
+    @staticmethod
+    def _read_connection_file(container) -> Optional[Dict[str, Any]]:
+        try:
+            stream, _ = container.get_archive(CONNECTION_FILE)
+            with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+                member = tar.getmembers()[0]
+                return json.loads(tar.extractfile(member).read().decode("utf-8"))
+        except Exception:
+            return None
+
+    def _launch(self):
+        """写入连接文件并在容器中后台启动内核"""
+        data = json.dumps(self.connection_info).encode("utf-8")
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            info = tarfile.TarInfo(CONNECTION_FILE.rsplit("/", 1)[1])
+            info.size = len(data)
+            info.mode = 0o600
+            info.uid = info.gid = 1000
+            tar.addfile(info, io.BytesIO(data))
+        self.container.put_archive(CONNECTION_FILE.rsplit("/", 1)[0], buf.getvalue())
+        self.container.exec_run(
+            ["python", "-m", "ipykernel_launcher", "-f", CONNECTION_FILE],
+            user="jovyan",
+            detach=True
+        )
+
+    def _connect(self, timeout: float):
+        """建立通道并等待内核回复 kernel_info
+
+        不使用 wait_for_ready：内核启动时导入较慢，心跳偶尔超时会被它误判为内核已退出。
+        """
+        client = BlockingKernelClient()
+        client.load_connection_info(dict(self.connection_info, ip=self.ip))
+        client.start_channels()
+        self._client = client
+        deadline = time.monotonic() + timeout
+        while True:
+            msg_id = client.kernel_info()
+            try:
+                while True:
+                    reply = client.get_shell_msg(timeout=1)
+                    if reply["parent_header"].get("msg_id") == msg_id:
+                        break
+                break
+            except queue.Empty:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"内核在 {timeout} 秒内没有响应")
+        # 丢弃启动阶段的 IOPub 消息
+        while True:
+            try:
+                client.get_iopub_msg(timeout=0.2)
+            except queue.Empty:
+                break
+
+    def is_alive(self, timeout: float = 5) -> bool:
+        """检查内核能否在 timeout 秒内回复 kernel_info（心跳通道在内核繁忙时不可靠）"""
+        if self._client is None or not self._lock.acquire(timeout=timeout):
+            return False
+        try:
+            msg_id = self._client.kernel_info()
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                reply = self._client.get_shell_msg(timeout=remaining)
+                if reply["parent_header"].get("msg_id") == msg_id:
+                    return True
+        except queue.Empty:
+            return False
+        finally:
+            self._lock.release()
+
+    def execute(self, code: str, timeout: Optional[float] = None,
+                user_expressions: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """在内核中执行代码
+
+        Args:
+            code: 待执行的代码
+            timeout: 最长执行时间（秒），超时后中断内核
+            user_expressions: 执行成功后在内核中求值的表达式，结果随执行回复一起返回
+
+        Returns:
+            包含 exit_code、output（标准输出、错误输出和异常堆栈）和 user_expressions 的字典，
+            超时被中断时 exit_code 为 1 并带有 timed_out
+        """
+        outputs: List[str] = []
+
+        def collect(msg):
+            msg_type = msg["header"]["msg_type"]
+            content = msg["content"]
+            if msg_type == "stream":
+                outputs.append(content["text"])
+            elif msg_type == "error":
+                outputs.append(_ANSI_ESCAPE.sub("", "\n".join(content["traceback"])) + "\n")
+
+        with self._lock:
+            try:
+                reply = self._client.execute_interactive(
+                    code, store_history=False, timeout=timeout, output_hook=collect,
+                    user_expressions=user_expressions or {}
+                )
+            except TimeoutError:
+                self.interrupt()
+                # 等被中断的代码结束，避免中断信号落到下一次执行上
+                try:
+                    self._client.execute_interactive("", store_history=False, timeout=5,
+                                                     output_hook=lambda msg: None)
+                except TimeoutError:
+                    pass
+                outputs.append(f"Error: 代码执行超时（超过 {timeout} 秒），已被中断\n")
+                return {"exit_code": 1, "output": "".join(outputs), "timed_out": True}
+        content = reply["content"]
+        return {
+            "exit_code": 0 if content["status"] == "ok" else 1,
+            "output": "".join(outputs),
+            "user_expressions": content.get("user_expressions", {}),
+        }
+
+    def interrupt(self):
+        """向内核进程发送 SIGINT，中断正在执行的代码"""
+        try:
+            self.container.exec_run(["pkill", "-INT", "-f", "ipykernel_launcher"], user="jovyan")
+        except Exception as e:
+            logger.warning(f"中断内核失败: {e}")
+
+    def restart(self, timeout: float = 60):
+        """结束当前内核并启动新的内核，清空解释器状态"""
+        self.close()
+        try:
+            self.container.exec_run(["pkill", "-KILL", "-f", "ipykernel_launcher"], user="jovyan")
+        except Exception:
+            pass
+        # 等旧进程释放端口
+        time.sleep(0.2)
+        self.connection_info = dict(self.connection_info, key=uuid.uuid4().hex)
+        self._launch()
+        self._connect(timeout)
+        self.execute(KERNEL_PRELOAD, timeout)
+
+    def close(self):
+        """关闭本地通道（不结束容器中的内核）"""
+        if self._client is not None:
+            self._client.stop_channels()
+            self._client = None
@@ -1,38 +1,181 @@
 import docker
 import json
+import logging
+import time
 import uuid
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import redis
 
+from app.core.config import settings
+from app.kernel_channel import KernelChannel
+from app.kernel_pool import KernelPool
+from app.services.admission import admission_controller
+from app.workflow_artifacts import ARTIFACT_ROOT
+
+KERNEL_IMAGE = "jupyter/datascience-notebook"
+KERNEL_NETWORK = "platform_network"
+# 内核信息（String）和最近活动时间（Sorted Set，分数为时间戳）的键
+KERNEL_KEY = "kernel:{}"
+ACTIVITY_KEY = "kernels:activity"
+
+logger = logging.getLogger(__name__)
+
 class KernelManager:
     """Jupyter内核管理器"""
-    def __init__(self):
-        self.docker_client = docker.from_env()
-        self.redis_client = redis.StrictRedis(host='redis', port=6379, db=0)
+    def __init__(self, docker_client=None, redis_client=None, admission=None):
+        """
+        Args:
+            docker_client: Docker 客户端，默认从环境变量创建（测试时可传入假的客户端）
+            redis_client: Redis 客户端，默认连接 redis 服务
+            admission: 准入控制，默认与代码执行共用同一个实例（预算保存在 Redis 中，所有进程共享）
+        """
+        self.docker_client = docker_client if docker_client is not None else docker.from_env()
+        self.redis_client = redis_client if redis_client is not None else redis.StrictRedis(host='redis', port=6379, db=0)
         self.kernels = {}
+        self.admission = admission if admission is not None else admission_controller
+        # 内核ID -> 准入票据，终止内核时释放
+        self._admissions = {}
+        # 正在执行代码的内核，不会被回收
+        self._busy = set()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+        self._reaper_lock = threading.Lock()
+        # 容器ID -> 与容器内 Jupyter 内核的长连接
+        self.channels = {}
+        self._channels_lock = threading.Lock()
+        # 预热容器池，所有进程同时运行的容器总数不超过最大并发实验数
+        self.pool = KernelPool(
+            self.docker_client,
+            self._run_pooled_container,
+            size=settings.KERNEL_POOL_SIZE,
+            max_total=settings.MAX_CONCURRENT_EXPERIMENTS,
+            max_uses=settings.KERNEL_POOL_MAX_USES,
+            acquire_timeout=settings.KERNEL_ACQUIRE_TIMEOUT,
+            health_check_interval=settings.KERNEL_HEALTH_CHECK_INTERVAL,
+            check_container=self._kernel_alive,
+            reset_container=self._restart_kernel,
+            on_destroy=self._close_channel,
+            redis_client=self.redis_client
+        )
         
-    def create_kernel(self, user_id, experiment_id):
-        """为用户创建一个新的Jupyter内核"""
-        kernel_id = str(uuid.uuid4())
-        container_name = f"kernel-{user_id}-{kernel_id}"
-        
-        # 创建容器
-        container = self.docker_client.containers.run(
-            "jupyter/datascience-notebook",
+    def _run_container(self, name, volumes=None, labels=None):
+        """启动一个内核容器，所有容器都挂载工作流节点之间传递数据的共享卷"""
+        volumes = dict(volumes or {})
+        volumes[settings.WORKFLOW_ARTIFACT_VOLUME] = {"bind": ARTIFACT_ROOT, "mode": "rw"}
+        return self.docker_client.containers.run(
+            KERNEL_IMAGE,
             detach=True,
-            name=container_name,
+            name=name,
             environment={
                 "JUPYTER_ENABLE_LAB": "yes",
                 "GRANT_SUDO": "yes"
             },
-            volumes={
-                f"/data/user_{user_id}": {"bind": "/home/jovyan/work", "mode": "rw"},
-            },
+            volumes=volumes,
+            labels=labels or {},
             mem_limit="2g",
             cpu_count=2,
-            network="platform_network"
+            network=KERNEL_NETWORK
+        )
+        
+    def _run_pooled_container(self, labels):
+        """启动一个预热容器并在其中启动内核，不挂载任何用户目录，可分配给任意用户"""
+        container = self._run_container(f"kernel-pool-{uuid.uuid4()}", labels=labels)
+        try:
+            self._channel(container)
+        except Exception:
+            container.remove(force=True)
+            raise
+        return container
+        
+    def _channel(self, container):
+        """获取容器内核的长连接，不存在时连接或启动内核"""
+        with self._channels_lock:
+            channel = self.channels.get(container.id)
+        if channel is None:
+            channel = KernelChannel.open(container, KERNEL_NETWORK, timeout=settings.KERNEL_ACQUIRE_TIMEOUT)
+            with self._channels_lock:
+                self.channels[container.id] = channel
+        return channel
+        
+    def _close_channel(self, container):
+        with self._channels_lock:
+            channel = self.channels.pop(container.id, None)
+        if channel is not None:
+            channel.close()
+        
+    def _kernel_alive(self, container):
+        """健康检查：容器内核的心跳正常"""
+        with self._channels_lock:
+            channel = self.channels.get(container.id)
+        return channel is not None and channel.is_alive()
+        
+    def _restart_kernel(self, container):
+        """回收容器时重启内核，下一个用户拿到的是全新的解释器"""
+        try:
+            self._channel(container).restart(timeout=settings.KERNEL_ACQUIRE_TIMEOUT)
+            return True
+        except Exception:
+            self._close_channel(container)
+            return False
+        
+    def start_pool(self):
+        """启动预热容器池（幂等）"""
+        if settings.KERNEL_POOL_SIZE > 0:
+            self.pool.start()
+        
+    def pool_stats(self):
+        """预热容器池的命中率和分配延迟统计"""
+        return self.pool.stats()
+        
+    def start_reaper(self):
+        """启动回收空闲内核的后台线程（幂等）"""
+        if settings.KERNEL_IDLE_TIMEOUT <= 0:
+            return
+        with self._reaper_lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="kernel-reaper", daemon=True)
+                self._reaper.start()
+        
+    def stop_reaper(self):
+        self._reaper_stop.set()
+        
+    def _reap_loop(self):
+        while not self._reaper_stop.wait(settings.KERNEL_REAP_INTERVAL):
+            try:
+                self.reap_idle_kernels()
+                self.sync_kernels()
+            except Exception as e:
+                logger.error(f"回收空闲内核失败: {str(e)}")
+        
+    def create_kernel(self, user_id, experiment_id, workspace=True, admission_timeout=None):
+        """为用户创建一个新的Jupyter内核
+        
+        每个内核按容器的资源限制占用准入控制的 CPU 和内存预算，直到内核终止
+        
+        Args:
+            user_id: 用户ID
+            experiment_id: 实验ID
+            workspace: 是否挂载用户的工作目录 /data/user_{user_id}（默认挂载）。预热容器启动时无法确定用户，
+                运行中的容器也无法再挂载目录，因此需要工作目录时冷启动专用容器，为 False 时从预热池中分配
+            admission_timeout: 准入排队的最长时间（秒），默认 KERNEL_ACQUIRE_TIMEOUT，0 表示不等待
+            
+        Raises:
+            AdmissionRejected: 排队超时或资源已满
+        """
+        kernel_id = str(uuid.uuid4())
+        ticket = self.admission.acquire(
+            f"user:{user_id}", "kernel",
+            timeout=settings.KERNEL_ACQUIRE_TIMEOUT if admission_timeout is None else admission_timeout,
+            max_wait=0
         )
+        try:
+            container = self._start_container(user_id, kernel_id, workspace)
+        except Exception:
+            ticket.release()
+            raise
+        self._admissions[kernel_id] = ticket
         
         # 存储内核信息
         kernel_info = {
@@ -41,65 +184,211 @@ class KernelManager:
             "user_id": user_id,
             "experiment_id": experiment_id,
             "created_at": datetime.now().isoformat(),
+            "pooled": not workspace,
             "status": "running"
         }
         
         self.kernels[kernel_id] = kernel_info
-        self.redis_client.set(f"kernel:{kernel_id}", json.dumps(kernel_info))
+        pipe = self.redis_client.pipeline()
+        pipe.set(KERNEL_KEY.format(kernel_id), json.dumps(kernel_info))
+        pipe.zadd(ACTIVITY_KEY, {kernel_id: time.time()})
+        pipe.execute()
+        self.start_reaper()
         
         return kernel_id
         
-    def execute_code(self, kernel_id, code):
-        """在指定内核中执行代码"""
-        if kernel_id not in self.kernels:
-            # 从Redis恢复内核信息
-            kernel_info_str = self.redis_client.get(f"kernel:{kernel_id}")
-            if kernel_info_str:
-                self.kernels[kernel_id] = json.loads(kernel_info_str)
-            else:
-                raise Exception(f"Kernel {kernel_id} not found")
-        
-        container_id = self.kernels[kernel_id]["container_id"]
-        container = self.docker_client.containers.get(container_id)
-        
-        # 将代码写入临时文件
-        script_path = f"/tmp/script_{uuid.uuid4()}.py"
-        with open(script_path, "w") as f:
-            f.write(code)
-        
-        # 将文件复制到容器
-        os.system(f"docker cp {script_path} {container_id}:/home/jovyan/script.py")
-        
-        # 执行代码并获取结果
-        exec_result = container.exec_run(
-            "python /home/jovyan/script.py",
-            user="jovyan"
-        )
+    def _start_container(self, user_id, kernel_id, workspace):
+        """冷启动挂载工作目录的专用容器，或从预热池中分配"""
+        if workspace:
+            container = self._run_container(
+                f"kernel-{user_id}-{kernel_id}",
+                volumes={
+                    f"/data/user_{user_id}": {"bind": "/home/jovyan/work", "mode": "rw"},
+                }
+            )
+        else:
+            self.start_pool()
+            container = self.pool.acquire(user_id)
+        return container
         
-        os.remove(script_path)
+    def execute_code(self, kernel_id, code, timeout=None, user_expressions=None):
+        """在指定内核中执行代码
         
-        return {
-            "exit_code": exec_result.exit_code,
-            "output": exec_result.output.decode('utf-8')
-        }
+        代码通过与容器内 Jupyter 内核的长连接执行，只需一次消息往返，
+        同一内核中前面执行的代码定义的变量在后续执行中仍然可用
         
-    def terminate_kernel(self, kernel_id):
-        """终止内核"""
-        if kernel_id not in self.kernels:
-            kernel_info_str = self.redis_client.get(f"kernel:{kernel_id}")
-            if kernel_info_str:
-                self.kernels[kernel_id] = json.loads(kernel_info_str)
-            else:
-                return False
+        Args:
+            kernel_id: 内核ID
+            code: 待执行的代码
+            timeout: 最长执行时间（秒），超时后中断执行
+            user_expressions: 执行成功后在内核中求值的表达式（名称 -> 表达式）
+        """
+        kernel_info = self.get_kernels([kernel_id]).get(kernel_id)
+        if kernel_info is None:
+            raise Exception(f"Kernel {kernel_id} not found")
+        if kernel_info.get("status") != "running":
+            raise Exception(f"Kernel {kernel_id} is {kernel_info.get('status')}")
         
-        container_id = self.kernels[kernel_id]["container_id"]
+        container = self.docker_client.containers.get(kernel_info["container_id"])
+        
+        # 执行期间把活动时间推迟到预计结束之后，其他进程的回收线程也不会回收
+        self._busy.add(kernel_id)
+        self._touch(kernel_id, time.time() + (timeout or settings.KERNEL_IDLE_TIMEOUT))
+        try:
+            try:
+                return self._channel(container).execute(code, timeout, user_expressions)
+            except (RuntimeError, TimeoutError):
+                # 连接失效（如内核进程退出），重新连接或启动内核后再试一次
+                self._close_channel(container)
+                return self._channel(container).execute(code, timeout, user_expressions)
+        finally:
+            self._busy.discard(kernel_id)
+            self._touch(kernel_id, time.time())
+        
+    def _touch(self, kernel_id, timestamp):
+        """更新内核的最近活动时间，内核已被回收时不再加入"""
         try:
+            self.redis_client.zadd(ACTIVITY_KEY, {kernel_id: timestamp}, xx=True)
+        except redis.RedisError:
+            pass
+        
+    def get_kernels(self, kernel_ids):
+        """批量获取内核信息，本进程没有的一次 MGET 从Redis读取
+        
+        Returns:
+            内核ID -> 内核信息，不存在的内核不包含在内
+        """
+        kernels = {k: self.kernels[k] for k in kernel_ids if k in self.kernels}
+        missing = [k for k in kernel_ids if k not in kernels]
+        if missing:
+            values = self.redis_client.mget([KERNEL_KEY.format(k) for k in missing])
+            for kernel_id, value in zip(missing, values):
+                if value:
+                    kernels[kernel_id] = json.loads(value)
+        return kernels
+        
+    def terminate_kernel(self, kernel_id, reusable=True):
+        """终止内核，预热池中的容器重置后放回池中
+        
+        Args:
+            kernel_id: 内核ID
+            reusable: 为 False 时不回收容器，直接销毁
+        """
+        kernel_info = self.get_kernels([kernel_id]).get(kernel_id)
+        if kernel_info is None:
+            return False
+        
+        status = self._stop_kernel(kernel_id, kernel_info, reusable)
+        if status is None:
+            return False
+        self._save_kernels({kernel_id: dict(kernel_info, status=status)})
+        return True
+        
+    def _stop_kernel(self, kernel_id, kernel_info, reusable=True):
+        """释放准入票据并回收或销毁容器
+        
+        Returns:
+            内核的新状态（released/terminated），失败时返回 None
+        """
+        ticket = self._admissions.pop(kernel_id, None)
+        if ticket is not None:
+            ticket.release()
+        
+        container_id = kernel_info["container_id"]
+        try:
+            if self.pool.owns(container_id):
+                self.pool.release(container_id, reusable)
+                return "released"
+            
             container = self.docker_client.containers.get(container_id)
+            self._close_channel(container)
             container.stop(timeout=5)
             container.remove()
-            
-            self.kernels[kernel_id]["status"] = "terminated"
-            self.redis_client.set(f"kernel:{kernel_id}", json.dumps(self.kernels[kernel_id]))
-            return True
+            return "terminated"
         except:
-            return False
+            return None
+        
+    def _save_kernels(self, kernels):
+        """在一个 pipeline 中保存已结束内核的状态并移出活动集合"""
+        pipe = self.redis_client.pipeline()
+        for kernel_id, kernel_info in kernels.items():
+            self.kernels.pop(kernel_id, None)
+            pipe.set(KERNEL_KEY.format(kernel_id), json.dumps(kernel_info))
+            pipe.zrem(ACTIVITY_KEY, kernel_id)
+        pipe.execute()
+        
+    def reap_idle_kernels(self, idle_timeout=None, batch_size=None):
+        """回收超过 idle_timeout 没有执行代码的内核（如用户关闭页面后遗留的内核）
+        
+        空闲内核按最近活动时间存放在 Redis 有序集合中，每批用一次范围查询取出、一次 MGET
+        读取内核信息，并行停止容器后用一个 pipeline 写回状态。多个进程同时回收时，
+        成功从有序集合中删除内核的进程负责停止它
+        
+        Args:
+            idle_timeout: 空闲时间（秒），默认 KERNEL_IDLE_TIMEOUT
+            batch_size: 每批回收的内核数，默认 KERNEL_REAP_BATCH
+            
+        Returns:
+            被回收的内核ID
+        """
+        idle_timeout = settings.KERNEL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        batch_size = batch_size or settings.KERNEL_REAP_BATCH
+        cutoff = time.time() - idle_timeout
+        reaped = []
+        skipped = 0
+        while True:
+            candidates = self.redis_client.zrangebyscore(ACTIVITY_KEY, "-inf", cutoff, start=skipped, num=batch_size)
+            if not candidates:
+                return reaped
+            candidates = [k.decode() if isinstance(k, bytes) else k for k in candidates]
+            busy = [k for k in candidates if k in self._busy]
+            skipped += len(busy)
+            candidates = [k for k in candidates if k not in self._busy]
+            
+            # 认领：只有删除成功的进程回收该内核
+            pipe = self.redis_client.pipeline()
+            for kernel_id in candidates:
+                pipe.zrem(ACTIVITY_KEY, kernel_id)
+            claimed = [k for k, removed in zip(candidates, pipe.execute()) if removed]
+            kernels = self.get_kernels(claimed)
+            
+            with ThreadPoolExecutor(max_workers=max(1, len(kernels))) as executor:
+                statuses = dict(zip(kernels, executor.map(
+                    lambda item: self._stop_kernel(*item), kernels.items()
+                )))
+            self._save_kernels({
+                kernel_id: dict(kernel_info, status=statuses[kernel_id] or "terminated", reaped_at=datetime.now().isoformat())
+                for kernel_id, kernel_info in kernels.items()
+            })
+            reaped.extend(kernels)
+            if kernels:
+                logger.info(f"已回收 {len(kernels)} 个空闲内核")
+        
+    def sync_kernels(self):
+        """同步其他进程对本进程内核的回收：释放它们的准入票据并清除本地缓存
+        
+        所有内核的状态用一次 MGET 读取
+        """
+        kernel_ids = list(set(self.kernels) | set(self._admissions))
+        if not kernel_ids:
+            return
+        values = self.redis_client.mget([KERNEL_KEY.format(k) for k in kernel_ids])
+        for kernel_id, value in zip(kernel_ids, values):
+            if value and json.loads(value).get("status") == "running":
+                continue
+            self.kernels.pop(kernel_id, None)
+            ticket = self._admissions.pop(kernel_id, None)
+            if ticket is not None:
+                ticket.release()
+
+
+_shared_manager = None
+_shared_lock = threading.Lock()
+
+def get_kernel_manager():
+    """进程内共享的内核管理器，预热容器池需要在多次工作流执行之间共享"""
+    global _shared_manager
+    with _shared_lock:
+        if _shared_manager is None:
+            _shared_manager = KernelManager()
+        return _shared_manager
@@ -0,0 +1,507 @@
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 预热容器的标签，用于识别和清理上次运行遗留的容器
+POOL_LABEL = "finance-platform.kernel-pool"
+# 创建容器的容器池实例（主机名:进程号:随机串），只清理自己或已退出的实例遗留的容器
+POOL_OWNER_LABEL = "finance-platform.kernel-pool.owner"
+
+# 存活的容器池实例（Sorted Set，分数为租约到期时间）
+POOL_OWNERS_KEY = "kernel-pool:owners"
+# 所有实例占用的容器名额（Sorted Set，分数为租约到期时间），名额数即主机上的容器总数
+POOL_SLOTS_KEY = "kernel-pool:slots"
+# 主机上的容器已达上限时，重新尝试占用名额的间隔（秒）；其他实例归还容器时不会通知本实例
+SLOT_RETRY_INTERVAL = 1.0
+
+# 清除过期名额后，名额数未达到上限时占用一个
+RESERVE_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+# 健康检查命令：容器内的 Python 可以正常启动
+HEALTH_CHECK_COMMAND = ["python", "-c", "pass"]
+
+# 回收容器时的重置命令：结束用户进程，清理脚本和临时文件
+RESET_COMMAND = [
+    "sh", "-c",
+    "pkill -u jovyan -f 'python /home/jovyan' ; "
+    "rm -rf /home/jovyan/script*.py /home/jovyan/work/* /tmp/* ; true",
+]
+
+
+class _PooledContainer:
+    """池中的一个容器及其占用的名额"""
+
+    def __init__(self, container, slot: str):
+        self.container = container
+        self.slot = slot
+        self.uses = 0
+        self.last_user: Optional[Any] = None
+        self.idle_since = time.monotonic()
+
+
+class KernelPool:
+    """预热的内核容器池
+
+    后台线程保持若干个已启动并通过健康检查的容器，创建内核时直接分配，避免每次冷启动
+    jupyter/datascience-notebook 镜像。容器用完后重置并放回池中，使用次数达到上限或重置失败的
+    容器会被销毁。空闲容器与使用中容器的总数不超过 max_total（最大并发实验数）。
+
+    每个进程有自己的容器池实例，容器带有实例标签，启动时只清理本实例或已退出的实例遗留的容器。
+    提供 Redis 客户端时，所有实例的容器在 Redis 中占用名额，名额和实例都带有定期续期的租约，
+    max_total 限制的是主机上所有实例的容器总数，实例异常退出后其名额在租约到期后释放；
+    否则只限制本实例的容器数。
+    """
+
+    def __init__(self, docker_client, create_container: Callable[[Dict[str, str]], Any], size: int,
+                 max_total: int, max_uses: int = 20, acquire_timeout: float = 60,
+                 health_check_interval: float = 30,
+                 check_container: Optional[Callable[[Any], bool]] = None,
+                 reset_container: Optional[Callable[[Any], bool]] = None,
+                 on_destroy: Optional[Callable[[Any], None]] = None,
+                 redis_client=None):
+        """初始化容器池（不会立即启动容器）
+
+        Args:
+            docker_client: Docker 客户端
+            create_container: 启动一个新容器的函数，参数为容器需要带的标签，返回容器对象
+            size: 保持的空闲容器数量
+            max_total: 空闲和使用中的容器总数上限
+            max_uses: 每个容器最多被分配多少次，之后销毁重建
+            acquire_timeout: 容器全部被占用时最长等待时间（秒）
+            health_check_interval: 后台检查空闲容器健康状态的间隔（秒）
+            check_container: 额外的健康检查（如内核心跳），返回 False 的容器会被销毁
+            reset_container: 回收容器时额外的重置操作（如重启内核），返回 False 时销毁容器
+            on_destroy: 容器被销毁前的回调
+            redis_client: Redis 客户端，用于在多个实例之间共享容器总数上限，为空时只限制本实例
+        """
+        self.docker_client = docker_client
+        self.redis_client = redis_client
+        self.instance = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.labels = {POOL_LABEL: "warm", POOL_OWNER_LABEL: self.instance}
+        # 续期间隔为健康检查间隔，启动容器期间无法续期，租约留出启动容器的时间
+        self.lease = 3 * health_check_interval + acquire_timeout
+        self.size = size
+        self.max_total = max_total
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._create_container = create_container
+        self._check_container = check_container
+        self._reset_container = reset_container
+        self._on_destroy = on_destroy
+
+        self._idle: "collections.deque[_PooledContainer]" = collections.deque()
+        # 容器ID -> 使用中的容器
+        self._busy: Dict[str, _PooledContainer] = {}
+        self._starting = 0
+        # 已从空闲队列取出、正在检查是否仍在运行的容器数
+        self._checking = 0
+        # 本实例占用的名额
+        self._slots: Set[str] = set()
+        self._reserve_slot = redis_client.register_script(RESERVE_SLOT_SCRIPT) if redis_client is not None else None
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._maintainer: Optional[threading.Thread] = None
+
+        self._hits = 0
+        self._misses = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._latencies: "collections.deque[float]" = collections.deque(maxlen=1000)
+
+    def start(self):
+        """登记本实例，清理遗留容器并启动后台补充线程"""
+        with self._cond:
+            if self._maintainer is not None:
+                return
+            self._stopped.clear()
+            self._maintainer = threading.Thread(target=self._maintain, name="kernel-pool", daemon=True)
+        self._heartbeat()
+        self._remove_stale()
+        self._maintainer.start()
+
+    def shutdown(self):
+        """停止后台线程并销毁空闲容器，使用中的容器在归还时销毁"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._maintainer is not None:
+            self._maintainer.join(10)
+            self._maintainer = None
+        with self._cond:
+            idle, self._idle = list(self._idle), collections.deque()
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.zrem(POOL_OWNERS_KEY, self.instance)
+            except Exception as e:
+                logger.warning(f"注销内核容器池实例失败: {e}")
+
+    def _target_idle(self) -> int:
+        return max(0, min(self.size, self.max_total - len(self._busy)))
+
+    def _total(self) -> int:
+        return len(self._idle) + len(self._busy) + self._starting + self._checking
+
+    def acquire(self, user_id: Any = None):
+        """分配一个容器
+
+        优先分配该用户上次用过的空闲容器；没有空闲容器时，未达到上限则立即冷启动一个，
+        否则等待其他容器归还。
+
+        Args:
+            user_id: 使用容器的用户
+
+        Returns:
+            容器对象
+
+        Raises:
+            TimeoutError: 等待超过 acquire_timeout 仍没有可用容器
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while True:
+                    entry = self._take_idle(user_id)
+                    if entry is not None:
+                        self._checking += 1
+                        break
+                    if self._total() < self.max_total:
+                        self._starting += 1
+                        break
+                    self._wait(deadline, None)
+
+            if entry is not None:
+                # 检查容器状态需要访问 Docker，不持有锁
+                if self._is_running(entry.container):
+                    hit = True
+                    break
+                with self._cond:
+                    self._checking -= 1
+                    self._discarded += 1
+                    self._cond.notify()
+                threading.Thread(target=self._discard, args=(entry,), daemon=True).start()
+                continue
+
+            slot = self._reserve()
+            if slot is not None:
+                hit = False
+                break
+            # 主机上的容器已达上限，等待本实例或其他实例归还容器
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify()
+                self._wait(deadline, SLOT_RETRY_INTERVAL)
+
+        if not hit:
+            try:
+                entry = _PooledContainer(self._create_container(dict(self.labels)), slot)
+            except Exception:
+                self._release_slot(slot)
+                with self._cond:
+                    self._starting -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            entry.uses += 1
+            entry.last_user = user_id
+            self._busy[entry.container.id] = entry
+            if hit:
+                self._checking -= 1
+                self._hits += 1
+            else:
+                self._starting -= 1
+                self._misses += 1
+            self._latencies.append((time.perf_counter() - started) * 1000)
+        # 池中少了一个容器，通知后台线程补充
+        self._wakeup.set()
+        return entry.container
+
+    def _take_idle(self, user_id: Any) -> Optional[_PooledContainer]:
+        """取出一个空闲容器，优先取该用户上次用过的；调用时需持有锁，不访问 Docker"""
+        for entry in self._idle:
+            if entry.last_user == user_id:
+                self._idle.remove(entry)
+                return entry
+        return self._idle.popleft() if self._idle else None
+
+    def _wait(self, deadline: float, interval: Optional[float]):
+        """等待容器归还，调用时需持有锁
+
+        Raises:
+            TimeoutError: 已超过等待期限
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"内核容器已全部占用（上限 {self.max_total}），请稍后重试")
+        self._cond.wait(remaining if interval is None else min(remaining, interval))
+
+    def _reserve(self) -> Optional[str]:
+        """占用一个容器名额，主机上的容器已达上限时返回 None"""
+        slot = f"{self.instance}:{uuid.uuid4().hex}"
+        if self._reserve_slot is not None:
+            try:
+                now = time.time()
+                if not self._reserve_slot(keys=[POOL_SLOTS_KEY],
+                                          args=[now, self.max_total, now + self.lease, slot]):
+                    return None
+            except Exception as e:
+                # Redis 不可用时退化为只限制本实例的容器数
+                logger.warning(f"占用内核容器名额失败: {e}")
+        with self._cond:
+            self._slots.add(slot)
+        return slot
+
+    def _release_slot(self, slot: str):
+        with self._cond:
+            self._slots.discard(slot)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.zrem(POOL_SLOTS_KEY, slot)
+            except Exception as e:
+                logger.warning(f"释放内核容器名额失败: {e}")
+
+    def _heartbeat(self):
+        """续期本实例及其占用的名额的租约"""
+        if self.redis_client is None:
+            return
+        with self._cond:
+            slots = list(self._slots)
+        expires = time.time() + self.lease
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.zadd(POOL_OWNERS_KEY, {self.instance: expires})
+            if slots:
+                pipe.zadd(POOL_SLOTS_KEY, {slot: expires for slot in slots})
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"内核容器池续期失败: {e}")
+
+    def owns(self, container_id: str) -> bool:
+        with self._cond:
+            return container_id in self._busy
+
+    def release(self, container_id: str, reusable: bool = True):
+        """归还容器：重置后放回池中，无法重置或已达到使用次数上限时销毁
+
+        Args:
+            container_id: 容器ID
+            reusable: 为 False 时直接销毁（如执行中出现了异常）
+        """
+        with self._cond:
+            entry = self._busy.pop(container_id, None)
+        if entry is None:
+            return
+
+        keep = (reusable and not self._stopped.is_set() and entry.uses < self.max_uses
+                and self._reset(entry.container))
+        with self._cond:
+            if keep and len(self._idle) < self._target_idle():
+                entry.idle_since = time.monotonic()
+                self._idle.append(entry)
+                self._recycled += 1
+                self._cond.notify()
+                return
+            self._discarded += 1
+            self._cond.notify()
+        self._discard(entry)
+        self._wakeup.set()
+
+    def _maintain(self):
+        """后台线程：检查空闲容器的健康状态，并补充到目标数量"""
+        next_check = time.monotonic() + self.health_check_interval
+        while not self._stopped.is_set():
+            if time.monotonic() >= next_check:
+                self._heartbeat()
+                self._check_idle()
+                self._remove_stale()
+                next_check = time.monotonic() + self.health_check_interval
+
+            with self._cond:
+                missing = self._target_idle() - len(self._idle) - self._starting
+                missing = min(missing, self.max_total - self._total())
+                if missing > 0:
+                    self._starting += 1
+            if missing > 0:
+                self._start_one()
+                continue
+
+            self._wakeup.wait(max(0.0, next_check - time.monotonic()))
+            self._wakeup.clear()
+
+    def _start_one(self):
+        slot = self._reserve()
+        if slot is None:
+            with self._cond:
+                self._starting -= 1
+            # 主机上的容器已达上限，稍后再试
+            self._stopped.wait(SLOT_RETRY_INTERVAL)
+            return
+
+        container = None
+        try:
+            container = self._create_container(dict(self.labels))
+            healthy = self._is_healthy(container)
+        except Exception as e:
+            logger.warning(f"预热内核容器启动失败: {e}")
+            healthy = False
+            # 启动失败时稍后再试，避免连续失败占满 CPU
+            self._stopped.wait(5)
+
+        with self._cond:
+            self._starting -= 1
+            if healthy and not self._stopped.is_set():
+                self._idle.append(_PooledContainer(container, slot))
+                self._cond.notify()
+                return
+        if container is not None:
+            self._destroy(container)
+        self._release_slot(slot)
+
+    def _check_idle(self):
+        with self._cond:
+            idle = list(self._idle)
+        unhealthy = [entry for entry in idle if not self._is_healthy(entry.container)]
+        if not unhealthy:
+            return
+        with self._cond:
+            for entry in unhealthy:
+                if entry in self._idle:
+                    self._idle.remove(entry)
+                    self._discarded += 1
+        for entry in unhealthy:
+            self._discard(entry)
+
+    @staticmethod
+    def _is_running(container) -> bool:
+        try:
+            container.reload()
+            return container.status == "running"
+        except Exception:
+            return False
+
+    def _is_healthy(self, container) -> bool:
+        if not self._is_running(container):
+            return False
+        try:
+            if self._check_container is not None:
+                return self._check_container(container)
+            return container.exec_run(HEALTH_CHECK_COMMAND).exit_code == 0
+        except Exception:
+            return False
+
+    def _reset(self, container) -> bool:
+        try:
+            if container.exec_run(RESET_COMMAND, user="root").exit_code != 0:
+                return False
+            return self._reset_container is None or self._reset_container(container)
+        except Exception:
+            return False
+
+    def _destroy(self, container):
+        if self._on_destroy is not None:
+            try:
+                self._on_destroy(container)
+            except Exception as e:
+                logger.warning(f"销毁内核容器前的清理失败: {e}")
+        try:
+            container.remove(force=True)
+        except Exception as e:
+            logger.warning(f"销毁内核容器失败: {e}")
+
+    def _discard(self, entry: _PooledContainer):
+        """销毁池中的容器并释放其名额"""
+        self._destroy(entry.container)
+        self._release_slot(entry.slot)
+
+    def _owner_alive(self, owner: Optional[str], live_owners: Optional[Set[str]]) -> bool:
+        """创建容器的实例是否仍在运行
+
+        有 Redis 时以实例的租约为准；否则只能判断同一主机上的进程是否存在，其他主机的实例视为存活
+        """
+        if not owner:
+            # 没有实例标签的旧版容器
+            return False
+        if live_owners is not None:
+            return owner in live_owners
+        host, _, rest = owner.partition(":")
+        pid = rest.partition(":")[0]
+        if host != socket.gethostname() or not pid.isdigit():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def _live_owners(self) -> Optional[Set[str]]:
+        if self.redis_client is None:
+            return None
+        try:
+            owners = self.redis_client.zrangebyscore(POOL_OWNERS_KEY, time.time(), "+inf")
+        except Exception as e:
+            logger.warning(f"查询内核容器池实例失败: {e}")
+            return None
+        return {o.decode() if isinstance(o, bytes) else o for o in owners} | {self.instance}
+
+    def _remove_stale(self):
+        """销毁已退出的实例遗留的预热容器，不影响其他正在运行的实例"""
+        try:
+            containers = self.docker_client.containers.list(all=True, filters={"label": POOL_LABEL})
+        except Exception as e:
+            logger.warning(f"查询遗留的内核容器失败: {e}")
+            return
+        live_owners = self._live_owners()
+        for container in containers:
+            owner = (container.labels or {}).get(POOL_OWNER_LABEL)
+            if owner != self.instance and not self._owner_alive(owner, live_owners):
+                self._destroy(container)
+
+    def stats(self) -> Dict[str, Any]:
+        """容器池统计：命中/未命中次数和分配延迟（毫秒）"""
+        with self._cond:
+            latencies: List[float] = sorted(self._latencies)
+            stats = {
+                "idle": len(self._idle),
+                "busy": len(self._busy),
+                "starting": self._starting,
+                "target_idle": self._target_idle(),
+                "max_total": self.max_total,
+                "instance": self.instance,
+                "hits": self._hits,
+                "misses": self._misses,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+            }
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else None
+        if latencies:
+            stats["acquire_latency_ms"] = {
+                "avg": round(sum(latencies) / len(latencies), 3),
+                "p50": round(latencies[len(latencies) // 2], 3),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                "max": round(latencies[-1], 3),
+            }
+        else:
+            stats["acquire_latency_ms"] = None
+        return stats
@@ -5,6 +5,8 @@ from .db.session import init_db, get_db
 from .api.v1.api import api_router
 from .schemas.user import UserCreate
 from .services.user import user_service
+from .services.code_executor import code_executor
+from .kernel_manager import get_kernel_manager
 from sqlalchemy.orm import Session
 import logging
 
@@ -57,6 +59,20 @@ async def startup_event():
         logger.info("已完成数据迁移")
     except Exception as e:
         logger.error(f"数据迁移失败: {str(e)}")
+    
+    # 预先启动代码执行进程池
+    code_executor.start()
+    
+    # 回收用户断开后遗留的空闲内核（包括之前进程创建的）
+    try:
+        get_kernel_manager().start_reaper()
+    except Exception as e:
+        logger.error(f"启动空闲内核回收失败: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 关闭代码执行进程池
+    code_executor.shutdown()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,606 @@
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 各类任务占用的资源：(CPU 核数, 内存 MB)。内核按 KernelManager 中容器的资源限制计算
+TASK_COSTS: Dict[str, Tuple[float, int]] = {
+    "code": (1, settings.CODE_EXECUTION_MEMORY_LIMIT_MB),
+    "kernel": (2, 2048),
+}
+
+# 还没有执行记录时使用的平均执行时间（秒），用于估计等待时间
+DEFAULT_DURATIONS = {
+    "code": 5.0,
+    "kernel": 300.0,
+}
+
+# 执行时间滑动平均的权重
+DURATION_SMOOTHING = 0.2
+
+# 排队的票据（Sorted Set，分数为排队序号）、执行中的票据和排队票据的租约（Sorted Set，分数为租约到期时间）
+QUEUE_KEY = "admission:queue"
+RUNNING_KEY = "admission:running"
+LEASES_KEY = "admission:leases"
+# 资源占用（Hash）：cpu、memory、"user:类型:用户" -> 该用户正在执行的数量，"pool:进程" -> 该进程的执行槽位占用
+USAGE_KEY = "admission:usage"
+# 排队序号（String）、统计计数（Hash）、各类任务的平均执行时间（Hash）
+SEQ_KEY = "admission:seq"
+STATS_KEY = "admission:stats"
+DURATIONS_KEY = "admission:durations"
+# 票据信息（Hash）：user、kind、cpu、memory、pool、capacity、enqueued、granted
+TICKET_KEY = "admission:ticket:{}"
+
+# 提交、释放票据或续租，并按公平份额放行排队的票据
+# KEYS: 排队, 执行中, 租约, 占用, 序号, 统计, 平均执行时间
+# ARGV: 操作, 当前时间, 租约时长, 并发上限, CPU 预算, 内存预算, 每用户上限("类型:上限;..."), 票据键前缀, 操作参数...
+#   submit: 票据ID, 用户, 类型, CPU, 内存, 执行槽位所在的进程（不占用槽位时为空）, 该进程的槽位数
+#   release: 票据ID, 滑动平均权重, 默认执行时间；poll: 本进程持有的票据ID...
+# 返回 submit/release 时本次放行的票据ID，poll 时参数中已获准的票据ID
+_ADMISSION_SCRIPT = """
+local queue, running, leases, usage = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local action, now, lease = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local max_concurrent, cpu_budget, memory_budget = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local prefix = ARGV[8]
+local limits = {}
+for kind, limit in string.gmatch(ARGV[7], '([^:;]+):(%d+)') do
+    limits[kind] = tonumber(limit)
+end
+
+local function user_field(user, kind)
+    return 'user:' .. kind .. ':' .. user
+end
+
+local function decrement(field)
+    if redis.call('HINCRBY', usage, field, -1) <= 0 then
+        redis.call('HDEL', usage, field)
+    end
+end
+
+-- 归还执行中票据占用的资源
+local function free(id)
+    if redis.call('ZREM', running, id) == 0 then
+        return false
+    end
+    local t = redis.call('HMGET', prefix .. id, 'user', 'kind', 'cpu', 'memory', 'pool')
+    if t[1] then
+        redis.call('HINCRBYFLOAT', usage, 'cpu', tostring(-tonumber(t[3])))
+        redis.call('HINCRBY', usage, 'memory', tostring(-tonumber(t[4])))
+        decrement(user_field(t[1], t[2]))
+        if t[5] and t[5] ~= '' then
+            decrement('pool:' .. t[5])
+        end
+    end
+    return true
+end
+
+local function drop(id)
+    redis.call('ZREM', queue, id)
+    redis.call('ZREM', leases, id)
+    redis.call('DEL', prefix .. id)
+end
+
+-- 持有票据的进程退出后租约过期，归还资源、移出队列
+local function expire()
+    for _, id in ipairs(redis.call('ZRANGEBYSCORE', running, '-inf', now)) do
+        free(id)
+        redis.call('DEL', prefix .. id)
+    end
+    for _, id in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now)) do
+        drop(id)
+    end
+end
+
+-- 占用最少的用户优先，同一用户先到先得；排在最前面的票据资源不足时不放行后面的票据。
+-- 用户达到上限或所在进程的执行槽位已满的票据不参与排序，不阻塞其他票据
+local function dispatch()
+    local granted = {}
+    while true do
+        local best, best_count, best_seq, best_t
+        local waiting = redis.call('ZRANGE', queue, 0, -1, 'WITHSCORES')
+        for i = 1, #waiting, 2 do
+            local id, seq = waiting[i], tonumber(waiting[i + 1])
+            local t = redis.call('HMGET', prefix .. id, 'user', 'kind', 'cpu', 'memory', 'enqueued', 'pool', 'capacity')
+            if not t[1] then
+                drop(id)
+            else
+                local count = tonumber(redis.call('HGET', usage, user_field(t[1], t[2])) or '0')
+                local slot_free = t[6] == '' or tonumber(redis.call('HGET', usage, 'pool:' .. t[6]) or '0') < tonumber(t[7])
+                if count < (limits[t[2]] or 1) and slot_free
+                        and (best == nil or count < best_count or (count == best_count and seq < best_seq)) then
+                    best, best_count, best_seq, best_t = id, count, seq, t
+                end
+            end
+        end
+        if best == nil then
+            break
+        end
+        local running_count = redis.call('ZCARD', running)
+        -- 预算小于单个任务时仍允许一个任务执行
+        if running_count > 0 and (running_count >= max_concurrent
+                or tonumber(redis.call('HGET', usage, 'cpu') or '0') + tonumber(best_t[3]) > cpu_budget
+                or tonumber(redis.call('HGET', usage, 'memory') or '0') + tonumber(best_t[4]) > memory_budget) then
+            break
+        end
+        redis.call('ZREM', queue, best)
+        redis.call('ZREM', leases, best)
+        redis.call('ZADD', running, now + lease, best)
+        redis.call('HSET', prefix .. best, 'granted', ARGV[2])
+        redis.call('HINCRBYFLOAT', usage, 'cpu', best_t[3])
+        redis.call('HINCRBY', usage, 'memory', best_t[4])
+        redis.call('HINCRBY', usage, user_field(best_t[1], best_t[2]), 1)
+        if best_t[6] ~= '' then
+            redis.call('HINCRBY', usage, 'pool:' .. best_t[6], 1)
+        end
+        redis.call('HINCRBY', KEYS[6], 'admitted', 1)
+        redis.call('HINCRBYFLOAT', KEYS[6], 'wait_total', tostring(now - tonumber(best_t[5])))
+        table.insert(granted, best)
+    end
+    return granted
+end
+
+expire()
+if action == 'submit' then
+    local id = ARGV[9]
+    redis.call('HSET', prefix .. id, 'user', ARGV[10], 'kind', ARGV[11], 'cpu', ARGV[12], 'memory', ARGV[13],
+        'pool', ARGV[14], 'capacity', ARGV[15], 'enqueued', ARGV[2])
+    redis.call('ZADD', queue, redis.call('INCR', KEYS[5]), id)
+    redis.call('ZADD', leases, now + lease, id)
+elseif action == 'release' then
+    local id = ARGV[9]
+    local t = redis.call('HMGET', prefix .. id, 'kind', 'granted')
+    if free(id) and t[1] and t[2] then
+        local average = tonumber(redis.call('HGET', KEYS[7], t[1]) or ARGV[11])
+        local duration = now - tonumber(t[2])
+        redis.call('HSET', KEYS[7], t[1], tostring(average + tonumber(ARGV[10]) * (duration - average)))
+    end
+    drop(id)
+end
+local granted = dispatch()
+if action ~= 'poll' then
+    return granted
+end
+local mine = {}
+for i = 9, #ARGV do
+    local id = ARGV[i]
+    if redis.call('ZSCORE', running, id) then
+        redis.call('ZADD', running, now + lease, id)
+        table.insert(mine, id)
+    elseif redis.call('ZSCORE', leases, id) then
+        redis.call('ZADD', leases, now + lease, id)
+    end
+end
+return mine
+"""
+
+
+def default_memory_budget_mb() -> int:
+    """默认内存预算：物理内存的 80%"""
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 8192
+    return int(total * 0.8 / (1024 * 1024))
+
+
+class AdmissionRejected(Exception):
+    """排队已满、预计等待过长或排队超时，请求被拒绝"""
+
+    def __init__(self, message: str, position: Optional[int] = None, eta: Optional[float] = None):
+        super().__init__(message)
+        self.position = position
+        self.eta = eta
+
+    def detail(self) -> Dict[str, Any]:
+        return {"message": str(self), "queue_position": self.position, "estimated_wait": self.eta}
+
+
+class AdmissionTicket:
+    """一次准入申请，获准后占用资源直到 release"""
+
+    def __init__(self, controller: "AdmissionController", ticket_id: str, user: Hashable, kind: str,
+                 cpu: float, memory_mb: int):
+        self.controller = controller
+        self.id = ticket_id
+        self.user = user
+        self.kind = kind
+        self.cpu = cpu
+        self.memory_mb = memory_mb
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._event = threading.Event()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    def _grant(self):
+        """获准，调用时需持有控制器的锁"""
+        self.granted_at = time.monotonic()
+        self._event.set()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters = []
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """阻塞等待获准，返回是否获准"""
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout: Optional[float] = None) -> bool:
+        """在事件循环中等待获准，返回是否获准"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.controller._lock:
+            if self.granted:
+                return True
+            self._async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.controller._lock:
+                with contextlib.suppress(ValueError):
+                    self._async_waiters.remove((loop, future))
+
+    def position(self) -> Dict[str, Any]:
+        """排队位置（0 表示已获准）和预计等待时间（秒）"""
+        return self.controller.position(self)
+
+    def release(self):
+        self.controller.release(self)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """代码执行和内核容器的准入控制
+
+    请求先排队，在不超过全局并发数、CPU 和内存预算以及每个用户的并发上限时获准执行。
+    排队的请求按公平份额调度：当前占用最少的用户优先，同一用户内先到先得；排在最前面的请求
+    资源不足时后面的请求也不会插队，避免占用资源较多的内核请求一直得不到执行。
+    排队已满或预计等待过长时直接拒绝，请求方可以稍后重试，负载过高时吞吐量平稳下降而不是压垮主机。
+
+    预算和队列保存在 Redis 中，由 Lua 脚本原子地提交、释放和放行，所有 API 进程和 worker 共用同一份预算。
+    每个进程的后台线程为本进程持有的票据续租，并在有票据排队时定期检查是否已被其他进程放行；
+    进程退出后其票据在租约到期时自动归还。
+
+    代码在提交请求的进程自己的执行器中运行，执行器只有固定数量的工作进程。slots 中的任务类型
+    除全局预算外还占用本进程的执行槽位，槽位已满时不放行，获准的任务不会在执行器内部再次排队，
+    排队位置和预计等待时间也按同一进程中争用槽位的请求计算。
+
+    事件循环中使用 admit_async、stream、submit_async 和 release_async，Redis 请求在线程池中执行。
+    """
+
+    def __init__(self, redis_client, max_concurrent: int, cpu_budget: float, memory_budget_mb: int,
+                 user_limits: Dict[str, int], max_queue: int, max_wait: float,
+                 slots: Optional[Dict[str, int]] = None, lease: float = 30, poll_interval: float = 0.1):
+        """初始化准入控制
+
+        Args:
+            redis_client: Redis 客户端（decode_responses=True）
+            max_concurrent: 同时执行的任务数上限
+            cpu_budget: 同时执行的任务占用的 CPU 核数上限
+            memory_budget_mb: 同时执行的任务占用的内存上限（MB）
+            user_limits: 任务类型 -> 每个用户同时执行的上限
+            max_queue: 排队的请求数上限
+            max_wait: 预计等待超过该时间（秒）时拒绝新请求，0 表示不限制
+            slots: 任务类型 -> 每个进程的执行槽位数（如代码执行器的工作进程数），不在其中的类型只受全局预算限制
+            lease: 票据的租约（秒），持有票据的进程在此期间没有续租时票据失效
+            poll_interval: 有票据排队时检查是否获准的间隔（秒）
+        """
+        self.redis_client = redis_client
+        self.max_concurrent = max_concurrent
+        self.cpu_budget = cpu_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.user_limits = user_limits
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.slots = dict(slots or {})
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self._script = redis_client.register_script(_ADMISSION_SCRIPT)
+        self._keys = [QUEUE_KEY, RUNNING_KEY, LEASES_KEY, USAGE_KEY, SEQ_KEY, STATS_KEY, DURATIONS_KEY]
+        self._limits = ";".join(f"{kind}:{int(limit)}" for kind, limit in user_limits.items())
+        # 本进程的执行槽位在 Redis 中的标识
+        self.instance = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        # 本进程持有的票据（排队中和执行中）
+        self._tickets: Dict[str, AdmissionTicket] = {}
+        self._wakeup = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+
+    def _call(self, action: str, *args) -> List[str]:
+        return self._script(keys=self._keys, args=[
+            action, time.time(), self.lease, self.max_concurrent, self.cpu_budget, self.memory_budget_mb,
+            self._limits, TICKET_KEY.format(""), *args,
+        ])
+
+    def _pool(self, kind: str) -> str:
+        """任务类型在本进程中的执行槽位标识，不占用槽位时为空"""
+        return f"{self.instance}:{kind}" if kind in self.slots else ""
+
+    def _granted(self, ticket_ids: List[str]):
+        """通知本进程中获准的票据"""
+        with self._lock:
+            for ticket_id in ticket_ids:
+                ticket = self._tickets.get(ticket_id)
+                if ticket is not None and not ticket.granted and not ticket.released:
+                    ticket._grant()
+
+    def _start_poller(self):
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_loop, name="admission-poller", daemon=True)
+                self._poller.start()
+        self._wakeup.set()
+
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                ticket_ids = list(self._tickets)
+                waiting = any(not ticket.granted for ticket in self._tickets.values())
+            if ticket_ids:
+                try:
+                    self._granted(self._call("poll", *ticket_ids))
+                except redis.RedisError as e:
+                    logger.error(f"准入控制续租失败: {str(e)}")
+            if waiting:
+                timeout = self.poll_interval
+            else:
+                # 只有执行中的票据时按租约的三分之一续租，没有票据时等待新的票据
+                timeout = self.lease / 3 if ticket_ids else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def submit(self, user: Hashable, kind: str = "code", max_wait: Optional[float] = None) -> AdmissionTicket:
+        """申请执行，资源充足时立即获准，否则排队
+
+        Args:
+            user: 用户（公平调度和每用户上限的单位）
+            kind: 任务类型，见 TASK_COSTS
+            max_wait: 预计等待超过该时间时拒绝，默认使用 self.max_wait，0 表示不限制
+
+        Raises:
+            AdmissionRejected: 排队已满或预计等待超过 max_wait
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        cpu, memory_mb = TASK_COSTS[kind]
+        ticket = AdmissionTicket(self, uuid.uuid4().hex, user, kind, cpu, memory_mb)
+        with self._lock:
+            self._tickets[ticket.id] = ticket
+        self._start_poller()
+        try:
+            self._granted(self._call("submit", ticket.id, str(user), kind, cpu, memory_mb,
+                                     self._pool(kind), self.slots.get(kind, 0)))
+        except Exception:
+            with self._lock:
+                self._tickets.pop(ticket.id, None)
+            raise
+        if ticket.granted:
+            return ticket
+        waiting, position, eta = self._position(ticket)
+        if position == 0:
+            # 已被其他进程放行，由后台线程通知
+            return ticket
+        if waiting > self.max_queue or (max_wait and eta > max_wait):
+            self.release(ticket)
+            self.redis_client.hincrby(STATS_KEY, "rejected", 1)
+            raise AdmissionRejected("当前执行请求过多，请稍后重试", position, eta)
+        self.redis_client.hincrby(STATS_KEY, "queued", 1)
+        return ticket
+
+    def release(self, ticket: AdmissionTicket):
+        """结束执行或放弃排队，可以重复调用"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._tickets.pop(ticket.id, None)
+        self._granted(self._call("release", ticket.id, DURATION_SMOOTHING, DEFAULT_DURATIONS.get(ticket.kind, 0)))
+
+    async def submit_async(self, user: Hashable, kind: str = "code",
+                           max_wait: Optional[float] = None) -> AdmissionTicket:
+        """在线程池中执行 submit，不阻塞事件循环"""
+        return await run_in_threadpool(self.submit, user, kind, max_wait)
+
+    async def release_async(self, ticket: AdmissionTicket):
+        """在线程池中执行 release，不阻塞事件循环"""
+        await run_in_threadpool(self.release, ticket)
+
+    def _snapshot(self) -> Tuple[List[Tuple[str, str, str]], int, Dict[str, str], Dict[str, float]]:
+        """排队票据的调度顺序 [(票据ID, 类型, 执行槽位)]、执行中的数量、资源占用和各类任务的平均执行时间"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrange(QUEUE_KEY, 0, -1, withscores=True)
+        pipe.zcount(RUNNING_KEY, time.time(), "+inf")
+        pipe.hgetall(USAGE_KEY)
+        pipe.hgetall(DURATIONS_KEY)
+        waiting, running, usage, durations = pipe.execute()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for ticket_id, _ in waiting:
+            pipe.hmget(TICKET_KEY.format(ticket_id), "user", "kind", "pool")
+        infos = pipe.execute() if waiting else []
+        order = sorted(
+            ((int(usage.get(f"user:{kind}:{user}", 0)), seq, ticket_id, kind, pool or "")
+             for (ticket_id, seq), (user, kind, pool) in zip(waiting, infos) if user is not None),
+        )
+        averages = dict(DEFAULT_DURATIONS)
+        averages.update({kind: float(value) for kind, value in durations.items()})
+        return [(ticket_id, kind, pool) for _, _, ticket_id, kind, pool in order], running, usage, averages
+
+    def _competing(self, order: List[Tuple[str, str, str]], kind: str, running: int
+                   ) -> Tuple[List[Tuple[str, str, str]], int]:
+        """与 kind 类型的新请求争用同一资源的排队请求，以及该资源的并发度
+
+        占用执行槽位的类型只与本进程中同类型的请求争用槽位，并发度为槽位数；其他类型按全局的执行数计算
+        """
+        pool = self._pool(kind)
+        if pool:
+            return [entry for entry in order if entry[2] == pool], self.slots[kind]
+        return order, max(1, running)
+
+    def _position(self, ticket: AdmissionTicket) -> Tuple[int, int, float]:
+        """排队数、排队位置（从 1 开始，不在队列中时为 0）和预计等待时间"""
+        order, running, _, durations = self._snapshot()
+        competing, parallelism = self._competing(order, ticket.kind, running)
+        ids = [ticket_id for ticket_id, _, _ in competing]
+        if ticket.id not in ids:
+            return len(order), 0, 0.0
+        position = ids.index(ticket.id) + 1
+        # 前面的请求（含自身）按各自类型的平均执行时间，由并发度分摊
+        work = sum(durations.get(kind, 0) for _, kind, _ in competing[:position])
+        return len(order), position, round(work / parallelism, 1)
+
+    def position(self, ticket: AdmissionTicket) -> Dict[str, Any]:
+        if ticket.granted or ticket.released:
+            return {"queue_position": 0, "estimated_wait": 0.0}
+        _, position, eta = self._position(ticket)
+        return {"queue_position": position, "estimated_wait": eta}
+
+    @contextlib.contextmanager
+    def admit(self, user: Hashable, kind: str = "code", timeout: Optional[float] = None) -> Iterator[AdmissionTicket]:
+        """阻塞等待准入，退出时释放
+
+        Raises:
+            AdmissionRejected: 被拒绝或等待超过 timeout
+        """
+        ticket = self.acquire(user, kind, timeout)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def acquire(self, user: Hashable, kind: str = "code", timeout: Optional[float] = None,
+                max_wait: Optional[float] = None) -> AdmissionTicket:
+        """阻塞等待准入，返回的票据需由调用方 release
+
+        Raises:
+            AdmissionRejected: 被拒绝或等待超过 timeout
+        """
+        ticket = self.submit(user, kind, max_wait)
+        if not ticket.wait(timeout):
+            self._expire(ticket)
+        return ticket
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self, user: Hashable, kind: str = "code",
+                          timeout: Optional[float] = None) -> AsyncIterator[AdmissionTicket]:
+        """在事件循环中等待准入，退出时释放
+
+        Raises:
+            AdmissionRejected: 被拒绝或等待超过 timeout
+        """
+        ticket = await self.submit_async(user, kind)
+        try:
+            if not await ticket.wait_async(timeout):
+                await run_in_threadpool(self._expire, ticket)
+            yield ticket
+        finally:
+            await self.release_async(ticket)
+
+    async def stream(self, ticket: AdmissionTicket, events: Callable[[], AsyncIterator[Dict[str, Any]]],
+                     timeout: Optional[float] = None,
+                     update_interval: float = 2.0) -> AsyncIterator[Dict[str, Any]]:
+        """排队期间定期返回 {"type": "queued", "queue_position": ..., "estimated_wait": ...}，
+        获准后返回 events() 的事件，结束后释放。排队超时时以失败的 done 事件结束"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    await run_in_threadpool(self._expire, ticket)
+                yield dict(await run_in_threadpool(ticket.position), type="queued")
+                wait = update_interval if remaining is None else min(update_interval, remaining)
+                await ticket.wait_async(wait)
+            async for event in events():
+                yield event
+        except AdmissionRejected as e:
+            yield {"type": "stderr", "data": f"{e}\n"}
+            yield {"type": "done", "success": False}
+        finally:
+            await self.release_async(ticket)
+
+    def _expire(self, ticket: AdmissionTicket):
+        """排队超时：放弃排队并拒绝"""
+        status = ticket.position()
+        ticket.release()
+        # 释放前可能刚好获准，此时已归还资源，仍按超时处理
+        self.redis_client.hincrby(STATS_KEY, "rejected", 1)
+        raise AdmissionRejected("排队等待超时，请稍后重试", status["queue_position"], status["estimated_wait"])
+
+    def estimate(self, kind: str = "code") -> Dict[str, Any]:
+        """新请求的预计排队位置和等待时间"""
+        order, running, usage, durations = self._snapshot()
+        competing, parallelism = self._competing(order, kind, running)
+        waiting = len(competing)
+        work = sum(durations.get(k, 0) for _, k, _ in competing) + durations.get(kind, 0)
+        pool = self._pool(kind)
+        if pool:
+            full = int(usage.get(f"pool:{pool}", 0)) >= self.slots[kind]
+        else:
+            full = running >= self.max_concurrent
+        eta = round(work / parallelism, 1) if waiting or full else 0.0
+        return {"queue_position": waiting + 1 if waiting or full else 0, "estimated_wait": eta}
+
+    def stats(self) -> Dict[str, Any]:
+        """准入控制统计（所有进程共享）"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zcount(RUNNING_KEY, time.time(), "+inf")
+        pipe.zcard(QUEUE_KEY)
+        pipe.hgetall(USAGE_KEY)
+        pipe.hgetall(STATS_KEY)
+        pipe.hgetall(DURATIONS_KEY)
+        running, waiting, usage, counters, durations = pipe.execute()
+        admitted = int(counters.get("admitted", 0))
+        averages = dict(DEFAULT_DURATIONS)
+        averages.update({kind: float(value) for kind, value in durations.items()})
+        return {
+            "running": running,
+            "waiting": waiting,
+            "max_concurrent": self.max_concurrent,
+            "cpu_used": round(float(usage.get("cpu", 0)), 3),
+            "cpu_budget": self.cpu_budget,
+            "memory_used_mb": int(usage.get("memory", 0)),
+            "memory_budget_mb": self.memory_budget_mb,
+            "admitted": admitted,
+            "queued": int(counters.get("queued", 0)),
+            "rejected": int(counters.get("rejected", 0)),
+            "avg_wait": round(float(counters.get("wait_total", 0)) / admitted, 3) if admitted else None,
+            "avg_duration": {kind: round(value, 3) for kind, value in averages.items()},
+            # 本进程的执行槽位：任务类型 -> (占用, 槽位数)
+            "slots": {kind: {"used": int(usage.get(f"pool:{self._pool(kind)}", 0)), "total": total}
+                      for kind, total in self.slots.items()},
+        }
+
+
+# 创建准入控制实例
+admission_controller = AdmissionController(
+    redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0, decode_responses=True),
+    max_concurrent=settings.MAX_CONCURRENT_EXPERIMENTS,
+    cpu_budget=settings.ADMISSION_CPU_BUDGET or (os.cpu_count() or 1),
+    memory_budget_mb=settings.ADMISSION_MEMORY_MB or default_memory_budget_mb(),
+    user_limits={"code": settings.ADMISSION_USER_CODE_LIMIT, "kernel": settings.ADMISSION_USER_KERNEL_LIMIT},
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    max_wait=settings.ADMISSION_MAX_WAIT,
+    # 代码在本进程的执行器中运行，同时执行的数量不超过执行器的工作进程数
+    slots={"code": settings.CODE_EXECUTOR_WORKERS},
+)
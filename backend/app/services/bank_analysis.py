@@ -11,6 +11,13 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix
 
+from .dataset_registry import dataset_fingerprint, dataset_registry
+from .model_registry import ModelNotTrained, model_registry
+
+# 违约概率的风险等级：概率落在第 i 个区间时为 RISK_LEVELS[i]
+RISK_BINS = np.array([0.2, 0.4, 0.6, 0.8])
+RISK_LEVELS = np.array(["低风险", "中低风险", "中风险", "中高风险", "高风险"])
+
 class BankAnalysisService:
     """银行信贷分析服务，提供信贷风险控制和违约分析功能"""
     
@@ -22,32 +29,25 @@ class BankAnalysisService:
         """
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        
-        # 预训练模型
-        self.models = {}
     
-    def load_credit_data(self, dataset: str = "taiwan_credit") -> pd.DataFrame:
+    def load_credit_data(self, dataset: str = "taiwan_credit", copy: bool = False,
+                         columns: Optional[List[str]] = None) -> pd.DataFrame:
         """加载信用卡客户数据
         
         Args:
             dataset: 数据集名称，默认为 "taiwan_credit"
+            copy: 是否返回可原地修改的副本，默认返回只读的共享数据
+            columns: 只读取这些列，默认读取全部
             
         Returns:
             信用卡客户数据 DataFrame
         """
-        # 检查本地是否有缓存
+        # 本地没有数据文件时生成模拟数据并保存，之后从内存中的数据集注册表读取
         cache_file = os.path.join(self.data_dir, f"{dataset}.csv")
-        
-        if os.path.exists(cache_file):
-            return pd.read_csv(cache_file)
-        
-        # 否则生成模拟数据
-        df = self._generate_mock_credit_data(10000)
-        
-        # 保存到缓存
-        df.to_csv(cache_file, index=False)
-        
-        return df
+        return dataset_registry.get_or_create(
+            cache_file, lambda: self._generate_mock_credit_data(10000),
+            copy=copy, columns=columns, write_kwargs={"index": False}
+        )
     
     def _generate_mock_credit_data(self, n_samples: int) -> pd.DataFrame:
         """生成模拟信用卡数据
@@ -117,7 +117,7 @@ class BankAnalysisService:
         return train_test_split(X, y, test_size=test_size, random_state=42)
     
     def train_credit_default_model(self, data: pd.DataFrame, model_type: str = "random_forest") -> Dict[str, Any]:
-        """训练信用卡违约预测模型
+        """训练信用卡违约预测模型，用同样的数据训练过时直接返回保存的模型的结果
         
         Args:
             data: 数据
@@ -126,6 +126,19 @@ class BankAnalysisService:
         Returns:
             包含模型训练结果的字典
         """
+        _, info = model_registry.get_or_train(
+            "credit_default", dataset_fingerprint(data), {"model_type": model_type},
+            lambda: self._fit_credit_default_model(data, model_type)
+        )
+        return {
+            'model_type': model_type,
+            'metrics': info['metrics'],
+            'feature_importance': info['feature_importance'],
+            'test_predictions': info['test_predictions']
+        }
+    
+    def _fit_credit_default_model(self, data: pd.DataFrame, model_type: str) -> Tuple[Pipeline, Dict[str, Any]]:
+        """拟合违约预测模型，返回 (模型管道, 评估结果)"""
         # 分割数据
         X_train, X_test, y_train, y_test = self.split_data(data)
         
@@ -172,11 +185,7 @@ class BankAnalysisService:
             'confusion_matrix': confusion_matrix(y_test, y_pred).tolist()
         }
         
-        # 保存模型
-        self.models[model_type] = pipeline
-        
-        return {
-            'model_type': model_type,
+        return pipeline, {
             'metrics': metrics,
             'feature_importance': self._get_feature_importance(pipeline, X_train.columns),
             'test_predictions': y_prob.tolist()[:10]  # 返回前10个预测样本的概率
@@ -207,34 +216,70 @@ class BankAnalysisService:
         indices = np.argsort(importances)[::-1][:10]
         return {str(feature_names[i]): float(importances[i]) for i in indices}
     
-    def predict_default_probability(self, customer_data: Dict[str, Any], model_type: str = "random_forest") -> Dict[str, Any]:
-        """预测客户违约概率
+    def predict_default_probability(self, customer_data: Dict[str, Any], model_type: str = "random_forest",
+                                    dataset: str = "taiwan_credit") -> Dict[str, Any]:
+        """预测客户违约概率，使用以当前数据集训练并保存的模型，不会训练
         
         Args:
             customer_data: 客户数据字典
             model_type: 模型类型
+            dataset: 训练模型所用的数据集名称
             
         Returns:
             包含预测结果的字典
+            
+        Raises:
+            ModelNotTrained: 模型尚未用当前数据集训练，需先调用 train_credit_default_model
         """
-        if model_type not in self.models:
-            raise ValueError(f"Model {model_type} not trained. Call train_credit_default_model first.")
+        pipeline = self.get_credit_default_model(model_type, dataset)
         
         # 将输入转换为DataFrame
         df = pd.DataFrame([customer_data])
         
         # 预测
-        pipeline = self.models[model_type]
-        prob = pipeline.predict_proba(df)[0, 1]
-        prediction = 1 if prob >= 0.5 else 0
-        
+        return self.format_default_prediction(customer_data, self.score_default_probability(df, pipeline).iloc[0])
+    
+    def format_default_prediction(self, customer_data: Dict[str, Any], scored: Dict[str, Any]) -> Dict[str, Any]:
+        """把一个客户的评分结果（score_default_probability 的一行）转换为单条预测接口的返回值"""
         return {
             'customer_id': customer_data.get('id', 'unknown'),
-            'default_probability': float(prob),
-            'predicted_default': int(prediction),
-            'risk_level': self._get_risk_level(prob)
+            'default_probability': float(scored['default_probability']),
+            'predicted_default': int(scored['predicted_default']),
+            'risk_level': str(scored['risk_level'])
         }
     
+    def score_default_probability(self, customers: pd.DataFrame, pipeline: Pipeline) -> pd.DataFrame:
+        """批量预测违约概率，一次调用模型完成整批客户
+        
+        Args:
+            customers: 客户数据，每行一个客户，有 id 列时作为客户ID，否则使用行索引
+            pipeline: 违约预测模型，见 get_credit_default_model
+            
+        Returns:
+            customer_id、default_probability、predicted_default、risk_level 四列
+        """
+        probs = pipeline.predict_proba(customers)[:, 1]
+        return pd.DataFrame({
+            'customer_id': customers['id'].values if 'id' in customers.columns else customers.index.values,
+            'default_probability': probs,
+            'predicted_default': (probs >= 0.5).astype(int),
+            'risk_level': self._get_risk_levels(probs)
+        })
+    
+    def get_credit_default_model(self, model_type: str = "random_forest", dataset: str = "taiwan_credit") -> Pipeline:
+        """获取以当前数据集训练的违约预测模型
+        
+        Raises:
+            ModelNotTrained: 模型尚未训练
+        """
+        cache_file = os.path.join(self.data_dir, f"{dataset}.csv")
+        if not os.path.exists(cache_file):
+            raise ModelNotTrained(f"模型 {model_type} 尚未训练")
+        pipeline, _ = model_registry.get(
+            "credit_default", dataset_registry.fingerprint(cache_file), {"model_type": model_type}
+        )
+        return pipeline
+    
     def _get_risk_level(self, probability: float) -> str:
         """根据违约概率确定风险等级
         
@@ -244,16 +289,11 @@ class BankAnalysisService:
         Returns:
             风险等级
         """
-        if probability < 0.2:
-            return "低风险"
-        elif probability < 0.4:
-            return "中低风险"
-        elif probability < 0.6:
-            return "中风险"
-        elif probability < 0.8:
-            return "中高风险"
-        else:
-            return "高风险"
+        return str(self._get_risk_levels(np.array([probability]))[0])
+    
+    def _get_risk_levels(self, probabilities: np.ndarray) -> np.ndarray:
+        """批量确定风险等级，区间左闭右开（如 0.2 属于中低风险）"""
+        return RISK_LEVELS[np.digitize(probabilities, RISK_BINS)]
     
     def analyze_credit_factors(self, data: pd.DataFrame) -> Dict[str, Any]:
         """分析影响信用评分的因素
@@ -0,0 +1,113 @@
+import collections
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from matplotlib.figure import Figure
+
+from app.core.config import settings
+from .execution_capture import render_figure
+
+# 支持的图表格式及其 MIME 类型
+CHART_MEDIA_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+
+def encode_chart(fig: Figure, fmt: Optional[str] = None, dpi: Optional[int] = None,
+                 **savefig_kwargs) -> Tuple[bytes, str]:
+    """按配置的格式和分辨率渲染图表
+
+    Args:
+        fig: matplotlib 图形
+        fmt: 图片格式（png/webp），默认使用 settings.CHART_FORMAT
+        dpi: 分辨率，默认使用 settings.CHART_DPI
+        **savefig_kwargs: 其他传给 savefig 的参数，如 bbox_inches
+
+    Returns:
+        (图片字节, 格式)
+    """
+    fmt = (fmt or settings.CHART_FORMAT).lower()
+    if fmt not in CHART_MEDIA_TYPES:
+        fmt = "png"
+    if fmt == "webp":
+        # 图表以纯色和文字为主，无损 WebP 比 PNG 小得多且文字清晰
+        savefig_kwargs.setdefault("pil_kwargs", {"lossless": True})
+    data = render_figure(fig, fmt, dpi=dpi or settings.CHART_DPI, **savefig_kwargs)
+    return data, fmt
+
+
+class ChartStore:
+    """内容寻址的图表缓存
+
+    图表以内容哈希作为ID保存，相同的图表（如许多学生运行同一段示例代码）只保存一份。
+    图表通过独立的二进制接口获取，执行结果中只返回ID。总大小超出预算时按最近最少使用淘汰。
+    """
+
+    def __init__(self, max_bytes: int):
+        """初始化图表缓存
+
+        Args:
+            max_bytes: 缓存的总大小上限（字节），0 表示不限制
+        """
+        self.max_bytes = max_bytes
+        # 图表ID -> (图片字节, MIME类型)
+        self._charts: "collections.OrderedDict[str, Tuple[bytes, str]]" = collections.OrderedDict()
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, chart_id: str) -> bool:
+        with self._lock:
+            return chart_id in self._charts
+
+    def put(self, data: bytes, fmt: str = "png") -> str:
+        """保存图表并返回其ID（内容哈希加扩展名）"""
+        chart_id = f"{hashlib.sha256(data).hexdigest()[:32]}.{fmt}"
+        with self._lock:
+            if chart_id in self._charts:
+                self._hits += 1
+                self._charts.move_to_end(chart_id)
+                return chart_id
+            self._misses += 1
+            self._charts[chart_id] = (data, CHART_MEDIA_TYPES.get(fmt, "application/octet-stream"))
+            self._total_bytes += len(data)
+            self._evict()
+        return chart_id
+
+    def put_figure(self, fig: Figure, **kwargs) -> str:
+        """渲染图形并保存，参数见 :func:`encode_chart`"""
+        return self.put(*encode_chart(fig, **kwargs))
+
+    def get(self, chart_id: str) -> Optional[Tuple[bytes, str]]:
+        """获取图表的 (图片字节, MIME类型)，不存在或已被淘汰时返回 None"""
+        with self._lock:
+            chart = self._charts.get(chart_id)
+            if chart is not None:
+                self._charts.move_to_end(chart_id)
+            return chart
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        # 至少保留刚写入的图表
+        while len(self._charts) > 1 and self._total_bytes > self.max_bytes:
+            _, (data, _) = self._charts.popitem(last=False)
+            self._total_bytes -= len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计，dedup_hits 为写入时已存在相同图表的次数"""
+        with self._lock:
+            return {
+                "charts": len(self._charts),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "dedup_hits": self._hits,
+                "stored": self._misses,
+            }
+
+
+# 创建图表缓存实例
+chart_store = ChartStore(settings.CHART_CACHE_MB * 1024 * 1024)
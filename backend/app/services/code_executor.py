@@ -0,0 +1,1266 @@
+import asyncio
+import collections
+import contextlib
+import gc
+import importlib
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from .docker_matplotlib_fix import configure_matplotlib_fonts
+from .chart_store import chart_store, encode_chart
+from .execution_capture import capture_scope, track_io
+from .execution_sessions import SessionNamespaceStore
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块，不做内存限制
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 工作进程初始化（导入依赖、配置字体）的最长等待时间（秒）
+WORKER_STARTUP_TIMEOUT = 60
+
+# 空闲时检查会话超时的间隔（秒）
+SESSION_SWEEP_INTERVAL = 30
+
+# 流式执行：输出累计到多少字符时立即发送，以及定时发送剩余输出的间隔（秒）
+STREAM_CHUNK_SIZE = 8192
+STREAM_FLUSH_INTERVAL = 0.1
+# 流式执行：每个请求最多缓冲的事件数，超出时暂停读取执行进程的输出
+STREAM_BUFFER_EVENTS = 256
+# 流式执行：长时间没有输出时发送心跳的间隔（秒），避免代理断开连接
+STREAM_HEARTBEAT_INTERVAL = 15
+
+# zygote 模式下预先导入的模块，fork 出的子进程以写时复制方式共享这些内存页
+PRELOAD_MODULES = [
+    "pandas",
+    "numpy",
+    "matplotlib.pyplot",
+    "seaborn",
+    "scipy.stats",
+    "sklearn.model_selection",
+    "sklearn.preprocessing",
+    "sklearn.linear_model",
+    "sklearn.ensemble",
+    "sklearn.metrics",
+]
+
+
+def new_namespace() -> Dict[str, Any]:
+    """创建安全的局部变量环境"""
+    return {
+        'pd': pd,
+        'np': np,
+        'plt': plt
+    }
+
+
+def run_code(code: str, capture: str = "all", namespace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """执行一段学生代码，捕获标准输出、错误输出和matplotlib图表
+
+    Args:
+        code: 待执行的Python代码
+        capture: 图表捕获方式，"all" 返回所有图形，"current" 只返回当前图形（紧凑边框）
+        namespace: 执行使用的全局变量字典，为空时使用新的命名空间；会话执行时传入持久的命名空间
+
+    Returns:
+        包含 output、charts、success 的字典，charts 为 (图片字节, 格式) 列表，由父进程存入图表缓存
+    """
+    charts = []
+
+    # 每次执行使用独立的输出缓冲区和图形登记表，并发执行时互不干扰
+    with capture_scope() as scope:
+        # 捕获可能的matplotlib绘图
+        if capture == "all":
+            plt.figure()
+
+        try:
+            # 创建安全的局部变量环境
+            local_vars = namespace if namespace is not None else new_namespace()
+
+            # 执行代码
+            exec(code, local_vars)
+
+            # 检查是否有图形输出
+            if capture == "all":
+                figures = scope.figures()
+                savefig_kwargs = {}
+            else:
+                figures = [fig for fig in [scope.current_figure()] if fig is not None]
+                savefig_kwargs = {'bbox_inches': 'tight'}
+            for fig in figures:
+                charts.append(encode_chart(fig, **savefig_kwargs))
+
+            # 获取标准输出和错误
+            stdout = scope.stdout.getvalue()
+            stderr = scope.stderr.getvalue()
+
+            # 组合输出信息
+            output = stdout
+            if stderr:
+                output += f"\nError: {stderr}"
+
+            return {
+                "output": output,
+                "charts": charts,
+                "success": True if not stderr else False
+            }
+
+        except Exception as e:
+            # 记录错误堆栈并返回错误信息
+            error_trace = traceback.format_exc()
+            return {
+                "output": f"Error: {str(e)}\n\n{error_trace}",
+                "charts": [],
+                "success": False
+            }
+
+
+class _StreamWriter:
+    """流式执行时接收标准输出/错误输出的写入端
+
+    写入的文本先暂存，累计超过 STREAM_CHUNK_SIZE 时立即发送，其余由刷新线程按
+    STREAM_FLUSH_INTERVAL 定时发送，避免逐行发送大量小消息。发送阻塞时写入也随之阻塞。
+    """
+
+    encoding = 'utf-8'
+
+    def __init__(self, kind: str, emit: Callable[[Dict[str, Any]], None]):
+        self.kind = kind
+        self.written = False
+        self._emit = emit
+        self._parts: List[str] = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def write(self, s: str) -> int:
+        if not s:
+            return 0
+        with self._lock:
+            self.written = True
+            self._parts.append(s)
+            self._size += len(s)
+            if self._size >= STREAM_CHUNK_SIZE:
+                self._send()
+        return len(s)
+
+    def flush(self):
+        with self._lock:
+            self._send()
+
+    def isatty(self) -> bool:
+        return False
+
+    def _send(self):
+        if self._parts:
+            data = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self._emit({"type": self.kind, "data": data})
+
+
+def stream_code(code: str, emit: Callable[[Dict[str, Any]], None],
+                namespace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """执行一段学生代码，在执行过程中逐步发送输出和图表
+
+    输出以 ``{"type": "stdout"/"stderr", "data": 文本}`` 事件发送；调用 ``plt.show()`` 时
+    立即渲染并发送当前所有图形（``{"type": "chart", "data": 图片字节, "format": 格式}``）后将其关闭，
+    与 notebook 中的行为一致，执行结束时再发送尚未显示的图形。
+
+    Args:
+        code: 待执行的Python代码
+        emit: 发送事件的函数，可能在刷新线程中调用
+        namespace: 执行使用的全局变量字典，为空时使用新的命名空间
+
+    Returns:
+        包含 output、charts、success 的字典，输出和图表已通过事件发送，output 和 charts 为空
+    """
+    stdout = _StreamWriter("stdout", emit)
+    stderr = _StreamWriter("stderr", emit)
+    stop = threading.Event()
+
+    def flush_periodically():
+        while not stop.wait(STREAM_FLUSH_INTERVAL):
+            stdout.flush()
+            stderr.flush()
+
+    flusher = threading.Thread(target=flush_periodically, name="code-executor-flusher", daemon=True)
+    flusher.start()
+    try:
+        with capture_scope(stdout, stderr) as scope:
+            def show():
+                # 先发送已有的输出，保证图表排在之前打印的内容后面
+                stdout.flush()
+                stderr.flush()
+                for fig in scope.figures():
+                    data, fmt = encode_chart(fig)
+                    emit({"type": "chart", "data": data, "format": fmt})
+                plt.close('all')
+
+            scope.on_show = show
+            try:
+                exec(code, namespace if namespace is not None else new_namespace())
+                show()
+            except Exception as e:
+                stderr.write(f"Error: {str(e)}\n\n{traceback.format_exc()}")
+    finally:
+        stop.set()
+        flusher.join()
+        stdout.flush()
+        stderr.flush()
+
+    return {"output": "", "charts": [], "success": not stderr.written}
+
+
+def _execute(job: Dict[str, Any], namespace: Optional[Dict[str, Any]],
+             send: Callable[[str, Any], None]) -> Dict[str, Any]:
+    """在执行进程中运行一个任务，流式任务在执行过程中通过 send 发送事件
+
+    会话任务可带有 prelude：之前命中结果缓存而未真正执行的代码，先在会话命名空间中补执行
+    （不返回输出）。结果中的 data_files 为执行期间读取的文件，用于结果缓存失效判断；side_effects 为
+    执行期间修改的文件和网络访问，有副作用的执行结果不缓存。
+    """
+    if namespace is not None:
+        for code in job.get("prelude") or []:
+            with capture_scope(), contextlib.suppress(Exception):
+                exec(code, namespace)
+
+    with track_io() as trace:
+        if job.get("stream"):
+            result = stream_code(job["code"], lambda event: send("event", event), namespace)
+        else:
+            result = run_code(job["code"], job.get("capture", "all"), namespace)
+    result["data_files"] = sorted(trace.reads)
+    result["side_effects"] = trace.side_effects()
+    return result
+
+
+def _make_sender(conn) -> Callable[[str, Any], None]:
+    """返回向父进程发送 (类型, 内容) 消息的函数，刷新线程和主线程可同时使用"""
+    lock = threading.Lock()
+
+    def send(kind: str, payload: Any):
+        with lock:
+            conn.send((kind, payload))
+
+    return send
+
+
+def _error_result(message: str) -> Dict[str, Any]:
+    return {"output": f"Error: {message}", "charts": [], "success": False}
+
+
+def _publish_charts(result: Dict[str, Any]) -> Dict[str, Any]:
+    """把执行进程返回的图表存入图表缓存，结果中只保留图表ID"""
+    result["charts"] = [chart_store.put(data, fmt) for data, fmt in result["charts"]]
+    return result
+
+
+def _publish_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """图表事件中的图片存入图表缓存，只发送图表ID"""
+    if event.get("type") == "chart":
+        return {"type": "chart", "id": chart_store.put(event["data"], event["format"])}
+    return event
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _EventChannel:
+    """执行进程与流式响应之间的有界事件缓冲区
+
+    生产者是读取执行进程消息的线程，消费者是事件循环中的流式响应。缓冲区满时，阻塞写入的
+    生产者会一直等待（进程池模式下进而阻塞执行进程的管道写入）；非阻塞写入则调用 on_full
+    通知上游暂停读取（zygote 模式），消费到一半以下时调用 on_drain 恢复。消费者关闭后写入的
+    事件直接丢弃。
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int,
+                 on_full: Optional[Callable[[], None]] = None,
+                 on_drain: Optional[Callable[[], None]] = None):
+        self.maxsize = maxsize
+        self._loop = loop
+        self._on_full = on_full
+        self._on_drain = on_drain
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._waiter: Optional[asyncio.Future] = None
+        self._paused = False
+        self._closed = False
+
+    def put(self, item: tuple, block: bool = True):
+        """写入一个 ("event", 事件) 或 ("result", 结果)，可在任意线程调用"""
+        with self._cond:
+            while block and len(self._items) >= self.maxsize and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return
+            self._items.append(item)
+            pause = (not block and not self._paused and self._on_full is not None
+                     and len(self._items) >= self.maxsize)
+            if pause:
+                self._paused = True
+            waiter, self._waiter = self._waiter, None
+        if pause:
+            self._on_full()
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_wake, waiter)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        """取出下一项，超过 timeout 秒仍没有数据时返回 None"""
+        while True:
+            with self._cond:
+                if self._items:
+                    item = self._items.popleft()
+                    self._cond.notify_all()
+                    resume = self._paused and len(self._items) <= self.maxsize // 2
+                    if resume:
+                        self._paused = False
+                    break
+                waiter = self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+        if resume:
+            self._on_drain()
+        return item
+
+    def close(self):
+        """消费者不再读取，丢弃缓冲的事件并解除生产者的阻塞"""
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._cond.notify_all()
+            resume, self._paused = self._paused, False
+        if resume:
+            self._on_drain()
+
+
+async def _iter_events(channel: _EventChannel, stats: "_LatencyStats") -> AsyncIterator[Dict[str, Any]]:
+    """把缓冲区中的消息转换为流式事件，最后一个事件为
+    {"type": "done", "success": ..., "data_files": ..., "side_effects": ...}"""
+    try:
+        while True:
+            item = await channel.get(STREAM_HEARTBEAT_INTERVAL)
+            if item is None:
+                yield {"type": "ping"}
+                continue
+            kind, payload = item
+            if kind == "event":
+                yield _publish_event(payload)
+                continue
+            result = stats.record(payload)
+            # 超时、进程崩溃等错误由父进程生成，错误信息在 output 中
+            if result["output"]:
+                yield {"type": "stderr", "data": result["output"]}
+            yield {"type": "done", "success": result["success"], "data_files": result.get("data_files", []),
+                   "side_effects": result.get("side_effects", [])}
+            return
+    finally:
+        channel.close()
+
+
+class _LatencyStats:
+    """记录最近若干个任务的启动延迟（从交给执行进程到开始执行代码）"""
+
+    def __init__(self, maxlen: int = 1000):
+        self._samples = collections.deque(maxlen=maxlen)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def record(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """取出结果中的 startup_ms 并记录，返回去掉该字段后的结果"""
+        startup_ms = result.pop("startup_ms", None)
+        if startup_ms is not None:
+            with self._lock:
+                self._samples.append(startup_ms)
+                self._total += 1
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+            total = self._total
+        if not samples:
+            return {"jobs": total, "avg_ms": None, "p50_ms": None, "p95_ms": None, "max_ms": None}
+        return {
+            "jobs": total,
+            "avg_ms": round(sum(samples) / len(samples), 3),
+            "p50_ms": round(samples[len(samples) // 2], 3),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+            "max_ms": round(samples[-1], 3),
+        }
+
+
+def _current_vm_bytes() -> Optional[int]:
+    """读取当前进程的虚拟内存大小（仅Linux）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@contextlib.contextmanager
+def _memory_limit(limit_mb: int):
+    """在当前进程已占用内存的基础上，为单个任务额外限制 limit_mb 的地址空间"""
+    current = _current_vm_bytes()
+    if resource is None or not limit_mb or current is None:
+        yield
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    new_soft = current + limit_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        new_soft = min(new_soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (new_soft, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _init_worker():
+    """工作进程初始化：配置字体，忽略 Ctrl-C 交由父进程统一关闭"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_matplotlib_fonts()
+
+
+def _serve(conn, memory_limit_mb: int, sessions: SessionNamespaceStore):
+    """执行进程主循环：接收任务、执行、返回结果，收到 None 时退出
+
+    结果以 ("result", 结果) 发送，流式任务在此之前还会发送若干 ("event", 事件)。
+    """
+    send = _make_sender(conn)
+    while True:
+        try:
+            if not conn.poll(SESSION_SWEEP_INTERVAL):
+                sessions.sweep()
+                continue
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        startup_ms = (time.perf_counter() - job["dispatched_at"]) * 1000
+        key = job.get("session")
+        namespace = None
+        if key is not None:
+            if job.get("reset_session"):
+                sessions.reset(key)
+            namespace = sessions.get(key)
+
+        with _memory_limit(memory_limit_mb):
+            result = _execute(job, namespace, send)
+        result["startup_ms"] = startup_ms
+        send("result", result)
+
+        # 先返回结果，再估算会话占用的内存
+        if key is not None:
+            sessions.update(key)
+    conn.close()
+
+
+def _worker_main(conn, memory_limit_mb: int, session_max_bytes: int, session_ttl: float):
+    """进程池工作进程入口"""
+    _init_worker()
+    # 初始化完成后通知父进程，超时从此时才开始计算
+    conn.send("ready")
+    _serve(conn, memory_limit_mb, SessionNamespaceStore(session_max_bytes, session_ttl, new_namespace))
+
+
+class _Worker:
+    """预先启动的代码执行工作进程"""
+
+    def __init__(self, ctx, memory_limit_mb: int, session_max_bytes: int, session_ttl: float):
+        self._ctx = ctx
+        self.memory_limit_mb = memory_limit_mb
+        self.session_max_bytes = session_max_bytes
+        self.session_ttl = session_ttl
+        self.process = None
+        self.conn = None
+        # 进程被替换的次数，替换后进程中保存的会话命名空间全部丢失
+        self.restarts = 0
+
+    def start(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.memory_limit_mb, self.session_max_bytes, self.session_ttl),
+            name="code-executor-worker",
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def wait_ready(self):
+        """等待进程完成初始化（spawn 方式需要重新导入依赖）"""
+        with contextlib.suppress(EOFError, OSError):
+            if self.conn.poll(WORKER_STARTUP_TIMEOUT):
+                self.conn.recv()
+
+    def stop(self, graceful: bool = False):
+        if graceful and self.process.is_alive():
+            with contextlib.suppress(OSError):
+                self.conn.send(None)
+            self.process.join(2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(5)
+        self.conn.close()
+
+    def restart(self):
+        self.restarts += 1
+        self.stop()
+        self.start()
+        self.wait_ready()
+
+    def run(self, job: Dict[str, Any], timeout: float,
+            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """在该进程中执行任务，阻塞直到完成、超时或进程异常退出
+
+        Args:
+            job: 任务
+            timeout: 最长运行时间（秒）
+            on_event: 流式任务的事件回调，阻塞时不再读取进程的输出
+        """
+        try:
+            job["dispatched_at"] = time.perf_counter()
+            deadline = time.monotonic() + timeout
+            self.conn.send(job)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.conn.poll(remaining):
+                    self.restart()
+                    return _error_result(f"代码执行超时（超过 {timeout} 秒），已被终止")
+                kind, payload = self.conn.recv()
+                if kind == "result":
+                    return payload
+                if on_event is not None:
+                    on_event(payload)
+        except (EOFError, OSError):
+            self.restart()
+            return _error_result("代码执行进程异常退出，可能超出了内存限制")
+
+
+class CodeExecutorPool:
+    """学生代码执行进程池
+
+    启动时预先创建若干工作进程，请求处理函数通过 ``await run(...)`` 将代码交给空闲进程执行，
+    不会阻塞事件循环。每个任务都有独立的运行时间和内存上限，超时或崩溃的进程会被替换。
+    带会话键的任务总是交给同一个进程执行，从而复用该进程中保存的会话命名空间。
+    进程被替换时，绑定在该进程上的会话全部解除绑定，这些会话下一次执行的结果中
+    ``session_reset`` 为 True（流式执行时先发送 ``{"type": "session_reset"}`` 事件）。
+    """
+
+    def __init__(self, max_workers: int, timeout: float, memory_limit_mb: int,
+                 start_method: Optional[str] = None, session_memory_mb: int = 0,
+                 session_ttl: float = 0):
+        """初始化进程池（不会立即启动进程）
+
+        Args:
+            max_workers: 工作进程数量
+            timeout: 单个任务的最长运行时间（秒）
+            memory_limit_mb: 单个任务可额外使用的内存（MB），0 表示不限制
+            start_method: multiprocessing 启动方式，默认使用平台默认值
+            session_memory_mb: 会话命名空间的总内存预算（MB），平均分配给各工作进程，0 表示不限制
+            session_ttl: 会话空闲多久后被清理（秒），0 表示不清理
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.start_method = start_method
+        self.session_memory_mb = session_memory_mb
+        self.session_ttl = session_ttl
+
+        self._workers: List[_Worker] = []
+        self._busy: set = set()
+        self._waiters: list = []
+        # 会话键 -> [工作进程序号, 最近使用时间]
+        self._affinity: "collections.OrderedDict[Any, list]" = collections.OrderedDict()
+        # 因进程被替换而丢失命名空间、尚未通知的会话
+        self._lost_sessions: set = set()
+        self._session_resets = 0
+        self._waiter: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = _LatencyStats()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """预先启动所有工作进程"""
+        with self._lock:
+            if self._workers:
+                return
+            ctx = multiprocessing.get_context(self.start_method)
+            session_max_bytes = self.session_memory_mb * 1024 * 1024 // max(self.max_workers, 1)
+            self._workers = [_Worker(ctx, self.memory_limit_mb, session_max_bytes, self.session_ttl)
+                             for _ in range(self.max_workers)]
+            for worker in self._workers:
+                worker.start()
+            for worker in self._workers:
+                worker.wait_ready()
+            self._waiter = ThreadPoolExecutor(max_workers=self.max_workers,
+                                              thread_name_prefix="code-executor")
+            self._busy = set()
+            self._affinity.clear()
+            self._lost_sessions.clear()
+
+    def shutdown(self):
+        """关闭所有工作进程"""
+        with self._lock:
+            for worker in self._workers:
+                worker.stop(graceful=True)
+            self._workers = []
+            if self._waiter is not None:
+                self._waiter.shutdown(wait=False)
+                self._waiter = None
+
+    def _session_worker(self, session) -> int:
+        """返回会话绑定的工作进程序号，新会话分配给绑定会话最少的进程"""
+        now = time.monotonic()
+        if self.session_ttl:
+            expired = [key for key, entry in self._affinity.items() if now - entry[1] > self.session_ttl]
+            for key in expired:
+                del self._affinity[key]
+
+        entry = self._affinity.get(session)
+        if entry is None:
+            counts = collections.Counter(entry[0] for entry in self._affinity.values())
+            entry = self._affinity[session] = [min(range(len(self._workers)), key=lambda i: counts[i]), now]
+        entry[1] = now
+        self._affinity.move_to_end(session)
+        return entry[0]
+
+    def _pick_worker(self, session) -> Optional[int]:
+        if session is not None:
+            index = self._session_worker(session)
+            return None if index in self._busy else index
+
+        # 无会话的任务超时或崩溃时会替换进程，只要还有未绑定会话的进程，就只交给这些进程执行，
+        # 避免清空其他用户的会话；所有进程都已绑定会话时交给绑定会话最少的空闲进程
+        counts = collections.Counter(entry[0] for entry in self._affinity.values())
+        unbound = [i for i in range(len(self._workers)) if not counts[i]]
+        free = [i for i in unbound or range(len(self._workers)) if i not in self._busy]
+        if not free:
+            return None
+        return min(free, key=lambda i: counts[i])
+
+    async def _acquire(self, session) -> int:
+        loop = asyncio.get_running_loop()
+        while True:
+            index = self._pick_worker(session)
+            if index is not None:
+                self._busy.add(index)
+                return index
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(waiter)
+
+    def _release(self, index: int, restarts: int):
+        if self._workers[index].restarts != restarts:
+            self._drop_sessions(index)
+        self._busy.discard(index)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _drop_sessions(self, index: int):
+        """工作进程被替换后解除其会话绑定，记录下来以便通知这些会话"""
+        lost = [key for key, entry in self._affinity.items() if entry[0] == index]
+        for key in lost:
+            del self._affinity[key]
+        self._lost_sessions.update(lost)
+        self._session_resets += len(lost)
+        if lost:
+            logger.warning("代码执行进程 %d 已被替换，%d 个会话的命名空间丢失", index, len(lost))
+
+    def _take_lost(self, session, reset_session: bool) -> bool:
+        """返回该会话的命名空间是否在用户不知情的情况下丢失（主动重置的会话无需通知）"""
+        if session is None or session not in self._lost_sessions:
+            return False
+        self._lost_sessions.discard(session)
+        return not reset_session
+
+    async def run(self, code: str, capture: str = "all", session: Optional[Any] = None,
+                  reset_session: bool = False, prelude: Optional[List[str]] = None) -> Dict[str, Any]:
+        """在进程池中执行代码
+
+        Args:
+            code: 待执行的Python代码
+            capture: 图表捕获方式，见 :func:`run_code`
+            session: 会话键（如 (用户ID, 实验ID)），为空时每次使用新的命名空间
+            reset_session: 是否先清空该会话已有的命名空间
+            prelude: 执行前先在会话命名空间中补执行的代码（不返回输出）
+
+        Returns:
+            包含 output、charts、success、data_files、side_effects 的字典，charts 为图表ID列表；
+            会话的命名空间因进程被替换而丢失时 session_reset 为 True
+        """
+        loop = asyncio.get_running_loop()
+        if not self.started:
+            await loop.run_in_executor(None, self.start)
+
+        index = await self._acquire(session)
+        worker = self._workers[index]
+        session_reset = self._take_lost(session, reset_session)
+        job = {"code": code, "capture": capture, "session": session, "reset_session": reset_session,
+               "prelude": prelude}
+        restarts = worker.restarts
+        future = loop.run_in_executor(self._waiter, worker.run, job, self.timeout)
+        # 客户端断开导致请求被取消时，进程仍在执行，需等任务真正结束后再归还
+        future.add_done_callback(lambda _: self._release(index, restarts))
+        result = _publish_charts(self._stats.record(await asyncio.shield(future)))
+        if session_reset:
+            result["session_reset"] = True
+        return result
+
+    async def stream(self, code: str, session: Optional[Any] = None, reset_session: bool = False,
+                     prelude: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """在进程池中执行代码，执行过程中逐步返回输出和图表事件
+
+        事件格式见 :func:`stream_code`，最后一个事件为
+        ``{"type": "done", "success": ..., "data_files": ..., "side_effects": ...}``，
+        长时间没有输出时返回 ``{"type": "ping"}``。读取过慢时缓冲区写满，工作进程的输出随之阻塞。
+
+        Args:
+            code: 待执行的Python代码
+            session: 会话键（如 (用户ID, 实验ID)），为空时每次使用新的命名空间
+            reset_session: 是否先清空该会话已有的命名空间
+            prelude: 执行前先在会话命名空间中补执行的代码（不返回输出）
+        """
+        loop = asyncio.get_running_loop()
+        if not self.started:
+            await loop.run_in_executor(None, self.start)
+
+        index = await self._acquire(session)
+        worker = self._workers[index]
+        session_reset = self._take_lost(session, reset_session)
+        restarts = worker.restarts
+        channel = _EventChannel(loop, STREAM_BUFFER_EVENTS)
+        job = {"code": code, "session": session, "reset_session": reset_session, "prelude": prelude,
+               "stream": True}
+
+        def run_job():
+            try:
+                result = worker.run(job, self.timeout, lambda event: channel.put(("event", event)))
+            except Exception as e:
+                result = _error_result(str(e))
+            channel.put(("result", result), block=False)
+
+        future = loop.run_in_executor(self._waiter, run_job)
+        # 客户端断开后缓冲区被关闭，剩余事件直接丢弃，任务结束后再归还进程
+        future.add_done_callback(lambda _: self._release(index, restarts))
+        if session_reset:
+            yield {"type": "session_reset"}
+        async for event in _iter_events(channel, self._stats):
+            yield event
+
+    def stats(self) -> Dict[str, Any]:
+        """执行器运行统计"""
+        return {
+            "mode": "pool",
+            "workers": self.max_workers,
+            "busy_workers": len(self._busy),
+            "sessions": len(self._affinity),
+            "session_resets": self._session_resets,
+            "startup_latency": self._stats.snapshot(),
+        }
+
+
+def _preload():
+    """导入常用科学计算库并预热字体缓存和Agg渲染器"""
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.warning(f"预加载模块 {name} 失败，已跳过")
+
+    import matplotlib.font_manager
+    matplotlib.font_manager.findfont(matplotlib.rcParams['font.family'][0])
+    fig = plt.figure(figsize=(1, 1))
+    fig.savefig(io.BytesIO(), format='png')
+    plt.close('all')
+
+
+def _fork_job(job: Dict[str, Any], memory_limit_mb: int, inherited_fds: List[int]):
+    """从 zygote 进程 fork 子进程执行任务
+
+    Returns:
+        (子进程pid, 读取子进程消息的连接)
+    """
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    forked_at = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        # 子进程：关闭不属于自己的描述符，执行完毕后直接退出
+        try:
+            startup_ms = (time.perf_counter() - forked_at) * 1000
+            reader.close()
+            for fd in inherited_fds:
+                with contextlib.suppress(OSError):
+                    os.close(fd)
+            send = _make_sender(writer)
+            with _memory_limit(memory_limit_mb):
+                result = _execute(job, None, send)
+            result["startup_ms"] = startup_ms
+            send("result", result)
+        finally:
+            os._exit(0)
+
+    writer.close()
+    return pid, reader
+
+
+def _fork_session_process(memory_limit_mb: int, inherited_fds: List[int]):
+    """从 zygote 进程 fork 一个常驻的会话进程，会话命名空间保存在该进程中
+
+    Returns:
+        (子进程pid, 与子进程通信的连接)
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            parent_conn.close()
+            for fd in inherited_fds:
+                with contextlib.suppress(OSError):
+                    os.close(fd)
+            # 会话的过期和内存淘汰由 zygote 按进程统一管理
+            _serve(child_conn, memory_limit_mb, SessionNamespaceStore(0, 0, new_namespace))
+        finally:
+            os._exit(0)
+
+    child_conn.close()
+    return pid, parent_conn
+
+
+def _private_bytes(pid: int) -> int:
+    """读取进程独占的内存（不含与 zygote 共享的写时复制页面）"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            return sum(int(line.split()[1]) * 1024 for line in f
+                       if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _reap(pid: int, kill: bool = False):
+    if kill:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGKILL)
+    with contextlib.suppress(ChildProcessError):
+        os.waitpid(pid, 0)
+
+
+class _SessionProcess:
+    """zygote 中一个会话对应的常驻子进程"""
+
+    def __init__(self, pid: int, conn):
+        self.pid = pid
+        self.conn = conn
+        self.last_used = time.monotonic()
+        # 正在执行的任务：(任务ID, 截止时间)
+        self.current: Optional[tuple] = None
+
+
+def _zygote_main(conn, max_children: int, timeout: float, memory_limit_mb: int,
+                 session_max_bytes: int = 0, session_ttl: float = 0):
+    """zygote 进程主循环
+
+    预先导入科学计算库后，对每个任务 fork 一个子进程执行；同时最多运行 max_children 个任务，
+    其余任务排队。子进程通过管道返回结果，超时的子进程会被直接杀掉。流式任务的事件随时转发给父进程，
+    父进程的缓冲区写满时发送 ("pause", 任务ID)，此后暂停读取该任务的输出，直到收到 ("resume", 任务ID)。
+    带会话键的任务交给该会话的常驻子进程执行，同一会话的任务依次执行；空闲超过 session_ttl
+    的会话进程会被回收，会话进程独占内存总和超过 session_max_bytes 时按最近最少使用回收空闲会话。
+    """
+    _init_worker()
+    _preload()
+    # 冻结已有对象，避免子进程中的垃圾回收触碰共享页面导致写时复制
+    gc.freeze()
+
+    pending = collections.deque()
+    # 子进程连接 -> [任务ID, 子进程pid, 截止时间]
+    children: Dict[Any, list] = {}
+    sessions: "collections.OrderedDict[Any, _SessionProcess]" = collections.OrderedDict()
+    # 流式响应缓冲区已满、暂停读取其输出的任务
+    paused: set = set()
+
+    def inherited_fds() -> List[int]:
+        return ([conn.fileno()] + [child_conn.fileno() for child_conn in children]
+                + [session.conn.fileno() for session in sessions.values()])
+
+    def running() -> int:
+        return len(children) + sum(1 for session in sessions.values() if session.current)
+
+    def is_running(job_id: int) -> bool:
+        return (any(child[0] == job_id for child in children.values())
+                or any(session.current and session.current[0] == job_id for session in sessions.values()))
+
+    def finish(child_conn, result: Dict[str, Any]):
+        job_id = children.pop(child_conn)[0]
+        child_conn.close()
+        paused.discard(job_id)
+        conn.send((job_id, "result", result))
+
+    def drop_session(key, error: Optional[str] = None):
+        session = sessions.pop(key)
+        _reap(session.pid, kill=True)
+        session.conn.close()
+        if session.current:
+            paused.discard(session.current[0])
+            if error:
+                conn.send((session.current[0], "result", _error_result(error)))
+
+    def start_session_job(job_id: int, job: Dict[str, Any]):
+        key = job["session"]
+        session = sessions.get(key)
+        if session is None:
+            session = sessions[key] = _SessionProcess(*_fork_session_process(memory_limit_mb, inherited_fds()))
+        sessions.move_to_end(key)
+        job["dispatched_at"] = time.perf_counter()
+        session.current = (job_id, time.monotonic() + timeout)
+        try:
+            session.conn.send(job)
+        except OSError:
+            drop_session(key, "会话执行进程异常退出，会话状态已重置，请重新运行")
+
+    def enforce_session_budget():
+        if not session_max_bytes:
+            return
+        usage = {key: _private_bytes(session.pid) for key, session in sessions.items()}
+        total = sum(usage.values())
+        for key in [key for key, session in sessions.items() if not session.current]:
+            if total <= session_max_bytes:
+                break
+            total -= usage[key]
+            drop_session(key)
+
+    while True:
+        # 启动排队中的任务，同一会话的任务需等前一个完成
+        for _ in range(len(pending)):
+            if running() >= max_children:
+                break
+            job_id, job = pending.popleft()
+            key = job.get("session")
+            if key is None:
+                pid, child_conn = _fork_job(job, memory_limit_mb, inherited_fds())
+                children[child_conn] = [job_id, pid, time.monotonic() + timeout]
+            elif key in sessions and sessions[key].current:
+                pending.append((job_id, job))
+            else:
+                start_session_job(job_id, job)
+
+        deadlines = [child[2] for child in children.values()]
+        deadlines += [session.current[1] for session in sessions.values() if session.current]
+        if session_ttl and sessions:
+            deadlines.append(time.monotonic() + SESSION_SWEEP_INTERVAL)
+        wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+        # 暂停的任务不读取其输出，子进程写满管道后会阻塞在输出上
+        session_conns = {session.conn: key for key, session in sessions.items()
+                         if not (session.current and session.current[0] in paused)}
+        child_conns = [child_conn for child_conn, child in children.items() if child[0] not in paused]
+        readable, _, _ = select.select([conn] + child_conns + list(session_conns), [], [], wait)
+
+        for r in readable:
+            if r is conn:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    message = None
+                if message is None:
+                    for child in children.values():
+                        _reap(child[1], kill=True)
+                    for key in list(sessions):
+                        drop_session(key)
+                    return
+                action, job_id = message[0], message[1]
+                if action == "pause":
+                    if is_running(job_id):
+                        paused.add(job_id)
+                elif action == "resume":
+                    paused.discard(job_id)
+                else:
+                    pending.append(message)
+                continue
+
+            if r in session_conns:
+                key = session_conns[r]
+                session = sessions[key]
+                try:
+                    kind, payload = r.recv()
+                except (EOFError, OSError):
+                    drop_session(key, "会话执行进程异常退出（可能超出了内存限制），会话状态已重置")
+                    continue
+                conn.send((session.current[0], kind, payload))
+                if kind == "event":
+                    continue
+                paused.discard(session.current[0])
+                session.current = None
+                session.last_used = time.monotonic()
+                enforce_session_budget()
+                continue
+
+            try:
+                kind, payload = r.recv()
+            except (EOFError, OSError):
+                _reap(children[r][1])
+                finish(r, _error_result("代码执行进程异常退出，可能超出了内存限制"))
+                continue
+            if kind == "event":
+                conn.send((children[r][0], kind, payload))
+                continue
+            _reap(children[r][1])
+            finish(r, payload)
+
+        now = time.monotonic()
+        for child_conn in [child_conn for child_conn, child in children.items() if child[2] <= now]:
+            _reap(children[child_conn][1], kill=True)
+            finish(child_conn, _error_result(f"代码执行超时（超过 {timeout} 秒），已被终止"))
+        for key in [key for key, session in sessions.items() if session.current and session.current[1] <= now]:
+            drop_session(key, f"代码执行超时（超过 {timeout} 秒），已被终止，会话状态已重置")
+        if session_ttl:
+            for key in [key for key, session in sessions.items()
+                        if not session.current and now - session.last_used > session_ttl]:
+                drop_session(key)
+
+
+class ZygoteExecutor:
+    """zygote 模式的代码执行器
+
+    只启动一个预先导入了 pandas/numpy/matplotlib/sklearn 并配置好字体的 zygote 进程，
+    每个任务由它 fork 出子进程执行。子进程毫秒级启动，并以写时复制方式共享已导入模块的内存，
+    任务之间不会互相影响。会话任务由每个会话独占的常驻子进程执行。接口与 :class:`CodeExecutorPool` 相同。
+    """
+
+    def __init__(self, max_workers: int, timeout: float, memory_limit_mb: int,
+                 start_method: Optional[str] = None, session_memory_mb: int = 0,
+                 session_ttl: float = 0):
+        """初始化执行器（不会立即启动 zygote 进程）
+
+        Args:
+            max_workers: 同时执行的任务数量上限
+            timeout: 单个任务的最长运行时间（秒）
+            memory_limit_mb: 单个任务可额外使用的内存（MB），0 表示不限制
+            start_method: 启动 zygote 进程的 multiprocessing 启动方式
+            session_memory_mb: 所有会话进程独占内存的总预算（MB），0 表示不限制
+            session_ttl: 会话空闲多久后被清理（秒），0 表示不清理
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.start_method = start_method
+        self.session_memory_mb = session_memory_mb
+        self.session_ttl = session_ttl
+
+        self._process = None
+        self._conn = None
+        self._reader: Optional[threading.Thread] = None
+        self._job_ids = itertools.count()
+        # 任务ID -> (事件循环, 结果 future 或流式缓冲区, 提交任务时的连接)
+        self._futures: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._stats = _LatencyStats()
+
+    @property
+    def started(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """启动 zygote 进程和结果读取线程"""
+        with self._lock:
+            if self.started:
+                return
+            ctx = multiprocessing.get_context(self.start_method)
+            parent_conn, child_conn = ctx.Pipe()
+            self._process = ctx.Process(
+                target=_zygote_main,
+                args=(child_conn, self.max_workers, self.timeout, self.memory_limit_mb,
+                      self.session_memory_mb * 1024 * 1024, self.session_ttl),
+                name="code-executor-zygote",
+            )
+            self._process.start()
+            child_conn.close()
+            self._conn = parent_conn
+            self._reader = threading.Thread(target=self._read_results, args=(parent_conn,),
+                                            name="code-executor-zygote-reader", daemon=True)
+            self._reader.start()
+
+    def shutdown(self):
+        """关闭 zygote 进程，正在执行的子进程会被终止"""
+        with self._lock:
+            if self._process is None:
+                return
+            with contextlib.suppress(OSError):
+                self._conn.send(None)
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join(5)
+            self._conn.close()
+            self._process = None
+
+    def _read_results(self, conn):
+        while True:
+            try:
+                job_id, kind, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "result":
+                self._resolve(job_id, payload)
+                continue
+            entry = self._futures.get(job_id)
+            if entry is not None:
+                # 缓冲区满时通知 zygote 暂停该任务，读取线程本身不阻塞，以免影响其他任务
+                entry[1].put(("event", payload), block=False)
+
+        # zygote 进程退出，由它执行的未完成任务全部返回错误
+        for job_id, entry in list(self._futures.items()):
+            if entry[2] is conn:
+                self._resolve(job_id, _error_result("代码执行服务异常退出，请重试"))
+
+    def _resolve(self, job_id: int, result: Dict[str, Any]):
+        entry = self._futures.pop(job_id, None)
+        if entry is None:
+            return
+        loop, future, _ = entry
+        if isinstance(future, _EventChannel):
+            future.put(("result", result), block=False)
+            return
+
+        def set_result():
+            if not future.done():
+                future.set_result(result)
+
+        loop.call_soon_threadsafe(set_result)
+
+    async def run(self, code: str, capture: str = "all", session: Optional[Any] = None,
+                  reset_session: bool = False, prelude: Optional[List[str]] = None) -> Dict[str, Any]:
+        """交给 zygote fork 的子进程执行代码
+
+        Args:
+            code: 待执行的Python代码
+            capture: 图表捕获方式，见 :func:`run_code`
+            session: 会话键（如 (用户ID, 实验ID)），为空时每次使用新的命名空间
+            reset_session: 是否先清空该会话已有的命名空间
+            prelude: 执行前先在会话命名空间中补执行的代码（不返回输出）
+
+        Returns:
+            包含 output、charts、success、data_files、side_effects 的字典，charts 为图表ID列表
+        """
+        loop = asyncio.get_running_loop()
+        if not self.started:
+            await loop.run_in_executor(None, self.start)
+
+        future = loop.create_future()
+        job = {"code": code, "capture": capture, "session": session, "reset_session": reset_session,
+               "prelude": prelude}
+        if not self._submit(next(self._job_ids), job, loop, future):
+            return _error_result("代码执行服务异常退出，请重试")
+        return _publish_charts(self._stats.record(await future))
+
+    async def stream(self, code: str, session: Optional[Any] = None, reset_session: bool = False,
+                     prelude: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """交给 zygote fork 的子进程执行代码，执行过程中逐步返回输出和图表事件
+
+        事件格式与 :meth:`CodeExecutorPool.stream` 相同。读取过慢时 zygote 暂停读取该任务的输出，
+        子进程随之阻塞，其他任务不受影响。
+
+        Args:
+            code: 待执行的Python代码
+            session: 会话键（如 (用户ID, 实验ID)），为空时每次使用新的命名空间
+            reset_session: 是否先清空该会话已有的命名空间
+            prelude: 执行前先在会话命名空间中补执行的代码（不返回输出）
+        """
+        loop = asyncio.get_running_loop()
+        if not self.started:
+            await loop.run_in_executor(None, self.start)
+
+        job_id = next(self._job_ids)
+        channel = _EventChannel(loop, STREAM_BUFFER_EVENTS,
+                                on_full=lambda: self._control("pause", job_id),
+                                on_drain=lambda: self._control("resume", job_id))
+        job = {"code": code, "session": session, "reset_session": reset_session, "prelude": prelude,
+               "stream": True}
+        if not self._submit(job_id, job, loop, channel):
+            channel.put(("result", _error_result("代码执行服务异常退出，请重试")), block=False)
+        async for event in _iter_events(channel, self._stats):
+            yield event
+
+    def _submit(self, job_id: int, job: Dict[str, Any], loop, sink) -> bool:
+        """登记结果的接收方（future 或流式缓冲区）并把任务发送给 zygote"""
+        try:
+            with self._lock:
+                self._futures[job_id] = (loop, sink, self._conn)
+                self._conn.send((job_id, job))
+        except OSError:
+            self._futures.pop(job_id, None)
+            return False
+        return True
+
+    def _control(self, action: str, job_id: int):
+        """通知 zygote 暂停或恢复读取某个任务的输出"""
+        with contextlib.suppress(OSError):
+            with self._lock:
+                self._conn.send((action, job_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """执行器运行统计，startup_latency 即每个任务的 fork 延迟"""
+        return {
+            "mode": "zygote",
+            "workers": self.max_workers,
+            "running_jobs": len(self._futures),
+            "startup_latency": self._stats.snapshot(),
+        }
+
+
+def create_code_executor():
+    """根据配置创建代码执行器"""
+    executor_class = ZygoteExecutor if settings.CODE_EXECUTOR_MODE == "zygote" else CodeExecutorPool
+    return executor_class(
+        max_workers=settings.CODE_EXECUTOR_WORKERS,
+        timeout=settings.CODE_EXECUTION_TIMEOUT,
+        memory_limit_mb=settings.CODE_EXECUTION_MEMORY_LIMIT_MB,
+        start_method=settings.CODE_EXECUTOR_START_METHOD,
+        session_memory_mb=settings.CODE_SESSION_MEMORY_MB,
+        session_ttl=settings.CODE_SESSION_TTL,
+    )
+
+
+# 创建执行器实例
+code_executor = create_code_executor()
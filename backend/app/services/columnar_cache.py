@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # 没有安装 pyarrow 时直接解析 CSV
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+# 列式副本保存在数据文件所在目录下的子目录中
+SIDECAR_DIR = ".columnar"
+
+
+def available() -> bool:
+    return feather is not None
+
+
+def sidecar_path(path: str, read_kwargs: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """CSV 文件对应的 Feather 副本路径，文件名包含读取参数的哈希和源文件的修改时间、大小
+
+    源文件变化后路径随之变化，旧副本在下次生成时删除。源文件不存在时返回 None
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    directory, name = os.path.split(os.path.abspath(path))
+    options = hashlib.sha256(
+        json.dumps(sorted((read_kwargs or {}).items()), default=str).encode("utf-8")
+    ).hexdigest()[:12]
+    return os.path.join(directory, SIDECAR_DIR, f"{name}.{options}.{stat.st_mtime_ns}-{stat.st_size}.feather")
+
+
+def _write_sidecar(df: pd.DataFrame, target: str):
+    """写入 Feather 副本：先写临时文件再改名，并删除同一数据集的旧副本"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    prefix = target.rsplit(".", 2)[0]
+    tmp = f"{target}.{os.getpid()}.tmp"
+    # 非默认索引（如日期索引）以列的形式保存，pandas 元数据记录如何还原
+    feather.write_feather(df, tmp)
+    os.replace(tmp, target)
+    for stale in glob.glob(glob.escape(prefix) + ".*.feather"):
+        if stale != target:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def _index_columns(source: str) -> List[str]:
+    """Feather 副本中保存索引的列"""
+    schema = feather.read_table(source, columns=[], memory_map=True).schema
+    metadata = schema.pandas_metadata or {}
+    return [c for c in metadata.get("index_columns", []) if isinstance(c, str)]
+
+
+def read_csv(path: str, columns: Optional[Sequence[str]] = None, **read_kwargs) -> pd.DataFrame:
+    """读取 CSV 数据集，优先读取带类型的列式副本
+
+    第一次读取时按 read_kwargs 解析 CSV 并保存为 Feather 副本，保留解析得到的列类型和索引；
+    之后直接读取副本，不再做类型推断。副本按列存储，指定 columns 时只读取这些列（以及索引）。
+    没有安装 pyarrow 或副本无法写入时退回解析 CSV。
+
+    Args:
+        path: CSV 文件路径
+        columns: 只读取这些列，默认读取全部
+        read_kwargs: 传给 pd.read_csv 的参数
+
+    Raises:
+        FileNotFoundError: 文件不存在
+    """
+    target = sidecar_path(path, read_kwargs)
+    if target is None:
+        raise FileNotFoundError(path)
+    if feather is None:
+        return _project(pd.read_csv(path, **read_kwargs), columns)
+
+    if os.path.exists(target):
+        try:
+            return _read_sidecar(target, columns)
+        except Exception as e:
+            logger.warning(f"读取列式副本 {target} 失败，重新生成: {str(e)}")
+
+    df = pd.read_csv(path, **read_kwargs)
+    try:
+        _write_sidecar(df, target)
+    except Exception as e:
+        logger.warning(f"写入列式副本 {target} 失败: {str(e)}")
+    return _project(df, columns)
+
+
+def _read_sidecar(target: str, columns: Optional[Sequence[str]]) -> pd.DataFrame:
+    if columns is None:
+        return feather.read_table(target, memory_map=True).to_pandas()
+    wanted = list(columns) + [c for c in _index_columns(target) if c not in columns]
+    return feather.read_table(target, columns=wanted, memory_map=True).to_pandas()[list(columns)]
+
+
+def _project(df: pd.DataFrame, columns: Optional[Sequence[str]]) -> pd.DataFrame:
+    return df if columns is None else df[list(columns)]
+
+
+def benchmark(path: str, columns: Optional[Sequence[str]] = None, repeat: int = 5,
+              **read_kwargs) -> Dict[str, Any]:
+    """比较解析 CSV 与读取列式副本的耗时（各取 repeat 次中的最小值，单位毫秒）"""
+    def best(load) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            timings.append(time.perf_counter() - start)
+        return round(min(timings) * 1000, 2)
+
+    read_csv(path, **read_kwargs)
+    result = {
+        "dataset": os.path.basename(path),
+        "csv_ms": best(lambda: pd.read_csv(path, **read_kwargs)),
+        "columnar_ms": best(lambda: read_csv(path, **read_kwargs)),
+    }
+    result["speedup"] = round(result["csv_ms"] / max(result["columnar_ms"], 1e-3), 1)
+    if columns is not None:
+        result["projected_ms"] = best(lambda: read_csv(path, columns=columns, **read_kwargs))
+    return result
+
+
+if __name__ == "__main__":
+    # 对数据目录下的每个 CSV 数据集做读取基准测试：python -m app.services.columnar_cache [数据目录]
+    import sys
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("DATA_DIR", "./data")
+    print(f"{'数据集':<40}{'CSV(ms)':>10}{'列式(ms)':>10}{'加速比':>8}{'两列(ms)':>10}")
+    for csv_path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+        header = pd.read_csv(csv_path, nrows=0).columns[:2].tolist()
+        r = benchmark(csv_path, columns=header)
+        print(f"{r['dataset']:<40}{r['csv_ms']:>10}{r['columnar_ms']:>10}{r['speedup']:>8}{r['projected_ms']:>10}")
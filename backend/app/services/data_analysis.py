@@ -2,8 +2,6 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import io
-import base64
 import warnings
 from typing import Dict, List, Tuple, Optional, Any, Union
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler, LabelEncoder, OneHotEncoder
@@ -18,6 +16,8 @@ from sklearn.metrics import (
 )
 import matplotlib
 from .docker_matplotlib_fix import configure_matplotlib_fonts
+from .chart_store import chart_store
+from .execution_capture import capture_scope
 
 # 设置matplotlib字体，使用我们的配置函数
 configure_matplotlib_fonts()
@@ -125,83 +125,80 @@ class DataAnalysisService:
             params: 可视化参数
             
         Returns:
-            Base64编码的图像
+            图表ID，图片通过 /charts/{id} 获取
         """
         if params is None:
             params = {}
         
-        plt.figure(figsize=(10, 6))
-        
-        if viz_type == 'histogram':
-            column = params.get('column')
-            if column is None or column not in data.columns:
-                return {"error": "必须提供有效的列名"}
-            
-            bins = params.get('bins', 30)
-            sns.histplot(data[column], bins=bins, kde=params.get('kde', True))
-            plt.title(f"{column} 的分布")
-            plt.xlabel(column)
-            plt.ylabel("频率")
-            
-        elif viz_type == 'boxplot':
-            column = params.get('column')
-            if column is None or column not in data.columns:
-                return {"error": "必须提供有效的列名"}
-            
-            group_by = params.get('group_by')
-            if group_by is not None and group_by in data.columns:
-                sns.boxplot(x=group_by, y=column, data=data)
-                plt.title(f"{column} 按 {group_by} 分组的箱线图")
-            else:
-                sns.boxplot(y=column, data=data)
-                plt.title(f"{column} 的箱线图")
+        # 在独立的图形范围内绘图，并发请求之间不会共享或关闭对方的图形
+        with capture_scope():
+            plt.figure(figsize=(10, 6))
+        
+            if viz_type == 'histogram':
+                column = params.get('column')
+                if column is None or column not in data.columns:
+                    return {"error": "必须提供有效的列名"}
+            
+                bins = params.get('bins', 30)
+                sns.histplot(data[column], bins=bins, kde=params.get('kde', True))
+                plt.title(f"{column} 的分布")
+                plt.xlabel(column)
+                plt.ylabel("频率")
+            
+            elif viz_type == 'boxplot':
+                column = params.get('column')
+                if column is None or column not in data.columns:
+                    return {"error": "必须提供有效的列名"}
+            
+                group_by = params.get('group_by')
+                if group_by is not None and group_by in data.columns:
+                    sns.boxplot(x=group_by, y=column, data=data)
+                    plt.title(f"{column} 按 {group_by} 分组的箱线图")
+                else:
+                    sns.boxplot(y=column, data=data)
+                    plt.title(f"{column} 的箱线图")
                 
-        elif viz_type == 'scatter':
-            x = params.get('x')
-            y = params.get('y')
-            if x is None or x not in data.columns or y is None or y not in data.columns:
-                return {"error": "必须提供有效的 x 和 y 列名"}
-            
-            hue = params.get('hue')
-            if hue is not None and hue in data.columns:
-                sns.scatterplot(x=x, y=y, hue=hue, data=data)
-            else:
-                sns.scatterplot(x=x, y=y, data=data)
-            plt.title(f"{x} vs {y} 散点图")
-            
-        elif viz_type == 'correlation_heatmap':
-            numeric_data = data.select_dtypes(include=['number'])
-            sns.heatmap(numeric_data.corr(), annot=params.get('annot', True), cmap='coolwarm', vmin=-1, vmax=1)
-            plt.title("相关性热力图")
+            elif viz_type == 'scatter':
+                x = params.get('x')
+                y = params.get('y')
+                if x is None or x not in data.columns or y is None or y not in data.columns:
+                    return {"error": "必须提供有效的 x 和 y 列名"}
+            
+                hue = params.get('hue')
+                if hue is not None and hue in data.columns:
+                    sns.scatterplot(x=x, y=y, hue=hue, data=data)
+                else:
+                    sns.scatterplot(x=x, y=y, data=data)
+                plt.title(f"{x} vs {y} 散点图")
+            
+            elif viz_type == 'correlation_heatmap':
+                numeric_data = data.select_dtypes(include=['number'])
+                sns.heatmap(numeric_data.corr(), annot=params.get('annot', True), cmap='coolwarm', vmin=-1, vmax=1)
+                plt.title("相关性热力图")
+            
+            elif viz_type == 'pairplot':
+                columns = params.get('columns', data.select_dtypes(include=['number']).columns[:5].tolist())
+                hue = params.get('hue')
+                plot_data = data[columns] if hue is None else data[columns + [hue]]
+                sns.pairplot(plot_data, hue=hue)
+                plt.suptitle("特征对图", y=1.02)
+            
+            elif viz_type == 'count':
+                column = params.get('column')
+                if column is None or column not in data.columns:
+                    return {"error": "必须提供有效的列名"}
+            
+                sns.countplot(y=column, data=data, order=data[column].value_counts().index)
+                plt.title(f"{column} 的计数")
             
-        elif viz_type == 'pairplot':
-            columns = params.get('columns', data.select_dtypes(include=['number']).columns[:5].tolist())
-            hue = params.get('hue')
-            plot_data = data[columns] if hue is None else data[columns + [hue]]
-            sns.pairplot(plot_data, hue=hue)
-            plt.suptitle("特征对图", y=1.02)
-            
-        elif viz_type == 'count':
-            column = params.get('column')
-            if column is None or column not in data.columns:
-                return {"error": "必须提供有效的列名"}
-            
-            sns.countplot(y=column, data=data, order=data[column].value_counts().index)
-            plt.title(f"{column} 的计数")
-            
-        else:
-            return {"error": f"不支持的可视化类型: {viz_type}"}
-        
-        # 保存图像到内存
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
+            else:
+                return {"error": f"不支持的可视化类型: {viz_type}"}
         
-        # 转换为base64字符串
-        img_str = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close()
+            # 存入图表缓存，相同的图表只保存一份
+            chart_id = chart_store.put_figure(plt.gcf(), bbox_inches='tight')
+            plt.close()
         
-        return img_str
+            return chart_id
     
     # 2. 数据清洗和集成
     def handle_missing_values(self, data: pd.DataFrame, strategy: Dict[str, str]) -> pd.DataFrame:
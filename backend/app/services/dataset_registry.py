@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from . import columnar_cache
+from .execution_capture import record_read
+
+
+def _freeze(df: pd.DataFrame) -> pd.DataFrame:
+    """把 DataFrame 的数据块设为只读，原地修改共享数据时抛出 ValueError"""
+    df = df.copy()
+    for block in df._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values.flags.writeable = False
+    if isinstance(df.index.values, np.ndarray):
+        df.index.values.flags.writeable = False
+    return df
+
+
+def dataset_fingerprint(data: pd.DataFrame) -> str:
+    """数据内容的指纹，由列名、列类型和每行内容的哈希计算，数据不变时指纹不变"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(c), str(t)] for c, t in data.dtypes.items()]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    return digest.hexdigest()[:32]
+
+
+class DatasetRegistry:
+    """进程内共享的数据集
+
+    分析接口每次请求都会读取同一批 CSV 文件，解析 1~3 MB 的 CSV 比后续的计算还慢。
+    注册表对每个文件只加载一次，以文件的修改时间和大小判断是否需要重新读取；加载时优先读取
+    带类型的列式副本（见 columnar_cache），只需要部分列时可以只读取这些列。
+    默认返回共享数据的浅拷贝，数据块只读（增加或替换列不受影响），需要原地修改时传入 copy=True
+    获得独立的深拷贝。
+    """
+
+    def __init__(self, max_entries: int):
+        """初始化数据集注册表
+
+        Args:
+            max_entries: 最多缓存的数据集数，0 表示不缓存
+        """
+        self.max_entries = max_entries
+        # (路径, 读取参数, 列) -> {"frame": 只读数据, "signature": (修改时间, 大小), "bytes": 内存占用,
+        #                        "fingerprint": 内容指纹（按需计算）}
+        self._entries: "collections.OrderedDict[Tuple, Dict[str, Any]]" = collections.OrderedDict()
+        # 同一数据集只由一个线程加载
+        self._loading: Dict[Tuple, threading.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path: str, copy: bool = False, columns: Optional[Sequence[str]] = None,
+            **read_kwargs) -> pd.DataFrame:
+        """读取 CSV 数据集，文件未变化时直接返回缓存
+
+        Args:
+            path: CSV 文件路径
+            copy: 是否返回可修改的深拷贝，默认返回只读的共享数据
+            columns: 只读取这些列，默认读取全部
+            read_kwargs: 传给 pd.read_csv 的参数
+
+        Raises:
+            FileNotFoundError: 文件不存在
+        """
+        path = os.path.abspath(path)
+        # 数据来自内存，没有经过 open，需显式记录读取，示例代码结果缓存才能在文件变化后失效
+        record_read(path)
+        key = (path, tuple(sorted(read_kwargs.items())), None if columns is None else tuple(columns))
+        signature = self._signature(path)
+        if signature is None:
+            raise FileNotFoundError(path)
+
+        frame = self._lookup(key, signature)
+        if frame is None:
+            with self._lock:
+                loading = self._loading.setdefault(key, threading.Lock())
+            with loading:
+                # 等待期间其他线程可能已经加载
+                frame = self._lookup(key, signature, count=False)
+                if frame is None:
+                    frame = self._load(key, path, columns, read_kwargs)
+        return frame.copy() if copy else frame.copy(deep=False)
+
+    def get_or_create(self, path: str, create: Callable[[], pd.DataFrame], copy: bool = False,
+                      columns: Optional[Sequence[str]] = None,
+                      write_kwargs: Optional[Dict[str, Any]] = None, **read_kwargs) -> pd.DataFrame:
+        """读取数据集，文件不存在时调用 create 生成并保存为 CSV
+
+        Args:
+            path: CSV 文件路径
+            create: 生成数据的函数
+            copy: 是否返回可修改的深拷贝
+            columns: 只读取这些列，默认读取全部
+            write_kwargs: 传给 DataFrame.to_csv 的参数
+            read_kwargs: 传给 pd.read_csv 的参数
+        """
+        with self._lock:
+            loading = self._loading.setdefault((os.path.abspath(path), ()), threading.Lock())
+        with loading:
+            if not os.path.exists(path):
+                create().to_csv(path, **(write_kwargs or {}))
+        # 从文件读取，首次请求与后续请求得到的数据类型一致
+        return self.get(path, copy=copy, columns=columns, **read_kwargs)
+
+    def _lookup(self, key: Tuple, signature: Tuple[int, int],
+                count: bool = True) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] == signature:
+                self._entries.move_to_end(key)
+                if count:
+                    self._hits += 1
+                return entry["frame"]
+            if count:
+                self._misses += 1
+            return None
+
+    def _load(self, key: Tuple, path: str, columns: Optional[Sequence[str]],
+              read_kwargs: Dict[str, Any]) -> pd.DataFrame:
+        # 读取前取签名，读取期间文件被修改时下次请求会重新读取
+        signature = self._signature(path)
+        frame = _freeze(columnar_cache.read_csv(path, columns=columns, **read_kwargs))
+        if self.max_entries <= 0:
+            return frame
+        with self._lock:
+            if key in self._entries:
+                self._reloads += 1
+            self._entries[key] = {
+                "frame": frame,
+                "signature": signature,
+                "bytes": int(frame.memory_usage(deep=True).sum()),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return frame
+
+    def fingerprint(self, path: str, columns: Optional[Sequence[str]] = None, **read_kwargs) -> str:
+        """数据集内容的指纹，与对 get 返回的数据调用 dataset_fingerprint 的结果相同，数据未变化时不重新计算"""
+        frame = self.get(path, columns=columns, **read_kwargs)
+        key = (os.path.abspath(path), tuple(sorted(read_kwargs.items())),
+               None if columns is None else tuple(columns))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.get("fingerprint") is not None:
+                return entry["fingerprint"]
+        fingerprint = dataset_fingerprint(frame)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] == self._signature(key[0]):
+                entry["fingerprint"] = fingerprint
+        return fingerprint
+
+    def invalidate(self, path: Optional[str] = None):
+        """删除某个文件（默认全部）的缓存"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                return
+            path = os.path.abspath(path)
+            for key in [key for key in self._entries if key[0] == path]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """注册表统计"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "total_bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+                "reloads": self._reloads,
+                "hit_rate": round(self._hits / total, 3) if total else None,
+            }
+
+
+# 创建数据集注册表实例
+dataset_registry = DatasetRegistry(settings.DATASET_CACHE_ENTRIES)
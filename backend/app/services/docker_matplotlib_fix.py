@@ -16,8 +16,9 @@ def configure_matplotlib_fonts():
     font_dir = "/tmp/font-cache"
     os.makedirs(font_dir, exist_ok=True)
     
-    # 设置字体缓存目录
-    matplotlib.rcParams['font.cachedir'] = font_dir
+    # 设置字体缓存目录（新版本 matplotlib 没有该配置项，字体缓存位于 MPLCONFIGDIR）
+    if 'font.cachedir' in matplotlib.rcParams.validate:
+        matplotlib.rcParams['font.cachedir'] = font_dir
     
     # 尝试设置中文字体
     # 先尝试使用系统中可能存在的中文字体列表
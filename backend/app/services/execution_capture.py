@@ -0,0 +1,281 @@
+import contextlib
+import contextvars
+import io
+import os
+import site
+import sys
+import sysconfig
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Set, TextIO, Tuple
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import _pylab_helpers
+from matplotlib.figure import Figure
+
+# 当前执行上下文的捕获范围，未进入捕获范围时为 None（使用进程全局状态）
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("current_scope", default=None)
+
+# 当前执行上下文的文件读写和网络访问记录（IOTrace），未跟踪时为 None
+_tracked_reads: contextvars.ContextVar = contextvars.ContextVar("tracked_reads", default=None)
+
+_install_lock = threading.Lock()
+_original_show: Optional[Callable] = None
+_audit_hook_installed = False
+_ignored: Optional[Tuple[str, ...]] = None
+
+
+class _ScopedFigureRegistry:
+    """替换 pyplot 的全局图形登记表 ``Gcf.figs``
+
+    按执行上下文（线程/协程）返回各自的登记表，使 ``plt.figure()``、``plt.gcf()``、
+    ``plt.get_fignums()``、``plt.close('all')`` 等只作用于当前执行创建的图形。
+    """
+
+    def __init__(self, global_figs: OrderedDict):
+        self._global = global_figs
+
+    def _current(self) -> OrderedDict:
+        scope = _current_scope.get()
+        return scope.registry if scope is not None else self._global
+
+    def __getattr__(self, name):
+        return getattr(self._current(), name)
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __setitem__(self, key, value):
+        self._current()[key] = value
+
+    def __delitem__(self, key):
+        del self._current()[key]
+
+    def __contains__(self, key):
+        return key in self._current()
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __reversed__(self):
+        return reversed(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+    def __bool__(self):
+        return bool(self._current())
+
+    def __repr__(self):
+        return repr(self._current())
+
+
+class _ScopedStream:
+    """替换 sys.stdout/sys.stderr，在捕获范围内写入当前执行自己的缓冲区"""
+
+    def __init__(self, index: int, fallback):
+        self._index = index
+        self._fallback = fallback
+
+    def _target(self):
+        scope = _current_scope.get()
+        if scope is None:
+            return self._fallback
+        return scope.stdout if self._index == 0 else scope.stderr
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def _scoped_show(*args, **kwargs):
+    """替换 ``plt.show``：捕获范围设置了 on_show 时交给它处理，否则使用原始实现"""
+    scope = _current_scope.get()
+    if scope is not None and scope.on_show is not None:
+        return scope.on_show()
+    return _original_show(*args, **kwargs)
+
+
+def _install():
+    """安装按上下文隔离的图形登记表、输出流和 plt.show（幂等）"""
+    global _original_show
+    with _install_lock:
+        if plt.show is not _scoped_show:
+            _original_show = plt.show
+            plt.show = _scoped_show
+        if not isinstance(_pylab_helpers.Gcf.figs, _ScopedFigureRegistry):
+            _pylab_helpers.Gcf.figs = _ScopedFigureRegistry(_pylab_helpers.Gcf.figs)
+        if not isinstance(sys.stdout, _ScopedStream):
+            sys.stdout = _ScopedStream(0, sys.stdout)
+        if not isinstance(sys.stderr, _ScopedStream):
+            sys.stderr = _ScopedStream(1, sys.stderr)
+
+
+class CaptureScope:
+    """一次代码执行的捕获范围：独立的输出缓冲区和图形登记表
+
+    on_show 不为空时，范围内调用 ``plt.show()`` 会改为调用它（如流式执行时立即发送图表）。
+    """
+
+    def __init__(self, stdout: Optional[TextIO] = None, stderr: Optional[TextIO] = None):
+        self.stdout = stdout if stdout is not None else io.StringIO()
+        self.stderr = stderr if stderr is not None else io.StringIO()
+        self.registry: OrderedDict = OrderedDict()
+        self.on_show: Optional[Callable[[], None]] = None
+
+    def figures(self) -> List[Figure]:
+        """本次执行创建的所有图形，按编号排序"""
+        return [self.registry[num].canvas.figure for num in sorted(self.registry)]
+
+    def current_figure(self) -> Optional[Figure]:
+        """本次执行的当前图形（最近激活的图形）"""
+        if not self.registry:
+            return None
+        return next(reversed(self.registry.values())).canvas.figure
+
+
+def render_figure(fig: Figure, fmt: str = 'png', **savefig_kwargs) -> bytes:
+    """使用 Agg 后端将图形渲染为图片字节"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, **savefig_kwargs)
+    return buf.getvalue()
+
+
+@contextlib.contextmanager
+def capture_scope(stdout: Optional[TextIO] = None, stderr: Optional[TextIO] = None):
+    """进入隔离的捕获范围
+
+    范围内的 print 输出、错误输出以及通过 pyplot 创建的图形只属于当前线程/协程，
+    并发执行的代码不会互相读取或关闭对方的图形。退出时关闭本范围内的所有图形。
+
+    Args:
+        stdout: 接收标准输出的流，默认使用新的 StringIO
+        stderr: 接收错误输出的流，默认使用新的 StringIO
+
+    用法::
+
+        with capture_scope() as scope:
+            exec(code, namespace)
+            images = [render_figure(fig) for fig in scope.figures()]
+    """
+    _install()
+    scope = CaptureScope(stdout, stderr)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        plt.close('all')
+        _current_scope.reset(token)
+
+
+# 修改文件系统的审计事件，第一个参数为路径
+_WRITE_EVENTS = {"os.remove", "os.rename", "os.mkdir", "os.rmdir", "os.truncate", "os.link", "os.symlink",
+                 "shutil.rmtree", "shutil.move", "shutil.copyfile"}
+# 访问网络的审计事件
+_NETWORK_EVENTS = {"socket.connect", "socket.getaddrinfo", "socket.sendto", "http.client.connect", "urllib.Request"}
+# 以写方式打开文件的标志
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+
+
+def _ignored_prefixes() -> Tuple[str, ...]:
+    """不记录读写的目录：解释器的标准库和第三方包（导入模块时读取）、matplotlib 的配置和字体缓存、系统伪文件"""
+    paths = sysconfig.get_paths()
+    prefixes = {paths[name] for name in ("stdlib", "platstdlib", "purelib", "platlib") if name in paths}
+    prefixes.update(site.getsitepackages() if hasattr(site, "getsitepackages") else [])
+    prefixes.update([site.getusersitepackages(), matplotlib.get_cachedir(), matplotlib.get_configdir(),
+                     "/proc", "/sys", "/dev"])
+    return tuple(os.path.join(os.path.realpath(prefix), "") for prefix in prefixes if prefix)
+
+
+class IOTrace:
+    """一次执行读取的文件、修改的文件以及是否访问了网络"""
+
+    def __init__(self, ignored: Tuple[str, ...]):
+        self.ignored = ignored
+        self.reads: Set[str] = set()
+        self.writes: Set[str] = set()
+        self.network = False
+
+    def _path(self, path) -> Optional[str]:
+        try:
+            path = os.path.abspath(os.fsdecode(path))
+        except TypeError:
+            return None
+        return None if os.path.realpath(path).startswith(self.ignored) else path
+
+    def side_effects(self) -> List[str]:
+        """执行的副作用：修改的文件（"write:路径"）和网络访问（"network"），没有副作用时为空"""
+        return sorted(f"write:{path}" for path in self.writes) + (["network"] if self.network else [])
+
+
+def record_read(path) -> None:
+    """记录当前执行读取了某个文件（不记录标准库、第三方包等目录下的文件）
+
+    通过 open 读取的文件会被自动记录；不经过 open 读取数据的代码（如内存缓存）可显式调用。
+    """
+    trace = _tracked_reads.get()
+    if trace is None:
+        return
+    path = trace._path(path)
+    if path is not None:
+        trace.reads.add(path)
+
+
+def _audit_io(event: str, args: tuple):
+    trace = _tracked_reads.get()
+    if trace is None:
+        return
+    if event in _NETWORK_EVENTS:
+        trace.network = True
+    elif event in _WRITE_EVENTS:
+        path = trace._path(args[0]) if args and not isinstance(args[0], int) else None
+        if path is not None:
+            trace.writes.add(path)
+    elif event == "open":
+        path, mode, flags = args[0], args[1], args[2]
+        # 按文件描述符打开的文件无法得知路径
+        if path is None or isinstance(path, int):
+            return
+        if isinstance(mode, str):
+            writing = any(c in mode for c in "wax+")
+        else:
+            writing = bool(flags & _WRITE_FLAGS)
+        if writing:
+            path = trace._path(path)
+            if path is not None:
+                trace.writes.add(path)
+        else:
+            record_read(path)
+
+
+@contextlib.contextmanager
+def track_io():
+    """跟踪当前线程/协程在执行期间读取和修改了哪些文件、是否访问了网络
+
+    用法::
+
+        with track_io() as trace:
+            exec(code, namespace)
+        print(sorted(trace.reads), trace.side_effects())
+    """
+    global _audit_hook_installed, _ignored
+    with _install_lock:
+        if not _audit_hook_installed:
+            # 审计钩子无法移除，未跟踪时直接返回
+            sys.addaudithook(_audit_io)
+            _audit_hook_installed = True
+        if _ignored is None:
+            _ignored = _ignored_prefixes()
+    trace = IOTrace(_ignored)
+    token = _tracked_reads.set(trace)
+    try:
+        yield trace
+    finally:
+        _tracked_reads.reset(token)
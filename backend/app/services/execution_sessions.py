@@ -0,0 +1,136 @@
+import collections
+import sys
+import time
+import types
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+# 估算对象内存时向下遍历属性的最大层数（如 sklearn 模型中的系数数组）
+_MAX_SIZE_DEPTH = 3
+
+
+def estimate_nbytes(value: Any, seen: Optional[Set[int]] = None, depth: int = 0) -> int:
+    """估算一个对象占用的内存字节数
+
+    DataFrame/Series/ndarray 按实际数据大小计算，容器和普通对象递归累加其元素和属性，
+    模块、函数、类不计入。同一对象只计算一次。
+
+    Args:
+        value: 待估算的对象
+        seen: 已计算过的对象 id 集合
+        depth: 当前递归深度
+
+    Returns:
+        估算的字节数
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, (types.ModuleType, type, types.FunctionType,
+                          types.BuiltinFunctionType, types.MethodType)):
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+
+    size = sys.getsizeof(value, 0)
+    if depth >= _MAX_SIZE_DEPTH:
+        return size
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_nbytes(k, seen, depth + 1) + estimate_nbytes(v, seen, depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += estimate_nbytes(item, seen, depth + 1)
+    elif hasattr(value, '__dict__') and not isinstance(value, (str, bytes)):
+        for attr in vars(value).values():
+            size += estimate_nbytes(attr, seen, depth + 1)
+    return size
+
+
+def estimate_namespace_nbytes(namespace: Dict[str, Any]) -> int:
+    """估算执行命名空间中用户变量占用的内存"""
+    seen: Set[int] = set()
+    return sum(estimate_nbytes(value, seen) for name, value in namespace.items()
+               if not name.startswith('__'))
+
+
+class SessionNamespaceStore:
+    """会话执行命名空间
+
+    以 (用户, 实验) 为键保存每次执行后的全局变量，后续步骤可直接使用前面步骤中加载的
+    DataFrame 和训练好的模型。总内存超出预算时按最近最少使用淘汰，空闲超过 ttl 的会话会被清理。
+    """
+
+    def __init__(self, max_bytes: int, ttl: float,
+                 namespace_factory: Callable[[], Dict[str, Any]]):
+        """初始化命名空间存储
+
+        Args:
+            max_bytes: 所有会话命名空间的内存预算（字节），0 表示不限制
+            ttl: 会话空闲多久后被清理（秒）
+            namespace_factory: 创建新命名空间的函数
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._factory = namespace_factory
+        # 会话键 -> [命名空间, 最近使用时间, 估算字节数]
+        self._entries: "collections.OrderedDict[Hashable, list]" = collections.OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry[2] for entry in self._entries.values())
+
+    def get(self, key: Hashable) -> Dict[str, Any]:
+        """获取会话的命名空间，不存在时创建新的"""
+        self.sweep()
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [self._factory(), time.monotonic(), 0]
+            self._entries[key] = entry
+        entry[1] = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def update(self, key: Hashable):
+        """执行结束后重新估算会话内存，并在超出预算时淘汰"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry[1] = time.monotonic()
+        entry[2] = estimate_namespace_nbytes(entry[0])
+        self._evict()
+
+    def reset(self, key: Hashable):
+        """丢弃会话的命名空间"""
+        self._entries.pop(key, None)
+
+    def sweep(self):
+        """清理空闲超时的会话"""
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry[1] < deadline]:
+            del self._entries[key]
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        total = self.total_bytes
+        while self._entries and total > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry[2]
@@ -0,0 +1,331 @@
+import collections
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import talib
+from scipy.signal import lfilter
+
+from app.core.config import settings
+from .dataset_registry import _freeze
+
+# 行情列，缓存的指标只在这些列的历史数据不变时复用
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+def _smooth(values: np.ndarray, previous: float, alpha: float) -> np.ndarray:
+    """指数平滑 y[t] = y[t-1] + alpha * (x[t] - y[t-1])，从上一个值 previous 开始，对整个数组一次计算"""
+    return lfilter([alpha], [1, alpha - 1], values, zi=[(1 - alpha) * previous])[0]
+
+
+def _last(values: np.ndarray) -> Optional[float]:
+    """最后一个值，序列太短、指标尚未产生值时为 None"""
+    return None if len(values) == 0 or np.isnan(values[-1]) else float(values[-1])
+
+
+class _Indicator:
+    """技术指标
+
+    窗口类指标（均线、布林带、KDJ）只依赖最近 lookback 根 K 线，追加新 K 线时对末尾一段重新计算；
+    递推类指标（EMA、MACD、RSI、ATR、OBV）保存最后一根 K 线处的状态，新 K 线从状态继续递推。
+    """
+
+    def __init__(self, columns: Sequence[str], compute: Callable[[Dict[str, np.ndarray]], List[np.ndarray]],
+                 lookback: int = 0,
+                 state: Optional[Callable[[Dict[str, np.ndarray], List[np.ndarray]], Any]] = None,
+                 update: Optional[Callable[[Dict[str, np.ndarray], Any], Tuple[List[np.ndarray], Any]]] = None):
+        """
+        Args:
+            columns: 输出的列名
+            compute: 对完整序列计算指标，返回每列的数组
+            lookback: 窗口类指标计算一个值需要的之前的 K 线数
+            state: 递推类指标从完整计算的结果中取出最后一根 K 线处的状态，无法取得时返回 None
+            update: 递推类指标从状态出发计算新 K 线的指标，返回 (每列的数组, 新状态)
+        """
+        self.columns = tuple(columns)
+        self.compute = compute
+        self.lookback = lookback
+        self.state = state
+        self.update = update
+
+
+def _ma(period: int) -> _Indicator:
+    return _Indicator([f"MA{period}"], lambda p: [talib.MA(p["close"], timeperiod=period)], lookback=period - 1)
+
+
+def _ema(period: int) -> _Indicator:
+    alpha = 2 / (period + 1)
+
+    def update(p, state):
+        values = _smooth(p["close"], state, alpha)
+        return [values], float(values[-1])
+
+    return _Indicator(
+        [f"EMA{period}"], lambda p: [talib.EMA(p["close"], timeperiod=period)],
+        state=lambda p, out: _last(out[0]), update=update
+    )
+
+
+def _macd_state(p, out):
+    # TA-Lib 内部慢线与 EMA26 相同，快线 = MACD + 慢线
+    slow = _last(talib.EMA(p["close"], timeperiod=26))
+    macd, signal = _last(out[0]), _last(out[1])
+    if None in (slow, macd, signal):
+        return None
+    return macd + slow, slow, signal
+
+
+def _macd_update(p, state):
+    fast, slow, signal = state
+    fast = _smooth(p["close"], fast, 2 / 13)
+    slow = _smooth(p["close"], slow, 2 / 27)
+    macd = fast - slow
+    signal = _smooth(macd, signal, 2 / 10)
+    return [macd, signal, macd - signal], (float(fast[-1]), float(slow[-1]), float(signal[-1]))
+
+
+def _kdj(p):
+    k, d = talib.STOCH(p["high"], p["low"], p["close"], fastk_period=9, slowk_period=3, slowk_matype=0,
+                       slowd_period=3, slowd_matype=0)
+    return [k, d, 3 * k - 2 * d]
+
+
+def _rsi_state(p, out, period: int = 14):
+    # RSI 的值不足以还原平均涨幅和平均跌幅，按 TA-Lib 的方法（Wilder 平滑）重新计算
+    if _last(out[0]) is None:
+        return None
+    diff = np.diff(p["close"])
+    gains, losses = np.clip(diff, 0, None), np.clip(-diff, 0, None)
+    avg_gain = _smooth(gains[period:], gains[:period].mean(), 1 / period)
+    avg_loss = _smooth(losses[period:], losses[:period].mean(), 1 / period)
+    return (float(avg_gain[-1]) if len(avg_gain) else float(gains[:period].mean()),
+            float(avg_loss[-1]) if len(avg_loss) else float(losses[:period].mean()),
+            float(p["close"][-1]))
+
+
+def _rsi_update(p, state, period: int = 14):
+    avg_gain, avg_loss, last_close = state
+    diff = np.diff(p["close"], prepend=last_close)
+    avg_gain = _smooth(np.clip(diff, 0, None), avg_gain, 1 / period)
+    avg_loss = _smooth(np.clip(-diff, 0, None), avg_loss, 1 / period)
+    total = avg_gain + avg_loss
+    rsi = np.divide(100 * avg_gain, total, out=np.zeros_like(total), where=total != 0)
+    return [rsi], (float(avg_gain[-1]), float(avg_loss[-1]), float(p["close"][-1]))
+
+
+def _atr_update(p, state, period: int = 14):
+    atr, last_close = state
+    previous_close = np.concatenate([[last_close], p["close"][:-1]])
+    true_range = np.maximum.reduce([p["high"] - p["low"], np.abs(p["high"] - previous_close),
+                                    np.abs(p["low"] - previous_close)])
+    atr = _smooth(true_range, atr, 1 / period)
+    return [atr], (float(atr[-1]), float(p["close"][-1]))
+
+
+def _obv_update(p, state):
+    obv, last_close = state
+    obv = obv + np.cumsum(np.sign(np.diff(p["close"], prepend=last_close)) * p["volume"])
+    return [obv], (float(obv[-1]), float(p["close"][-1]))
+
+
+def _with_close(p, out):
+    value = _last(out[0])
+    return None if value is None else (value, float(p["close"][-1]))
+
+
+# 指标名称 -> 指标，名称用于选择要计算的指标
+INDICATORS: "collections.OrderedDict[str, _Indicator]" = collections.OrderedDict([
+    # 移动平均线 - 趋势类指标
+    ("MA5", _ma(5)),
+    ("MA10", _ma(10)),
+    ("MA20", _ma(20)),
+    ("MA60", _ma(60)),
+    # 指数移动平均线
+    ("EMA12", _ema(12)),
+    ("EMA26", _ema(26)),
+    # MACD - 趋势类指标
+    ("MACD", _Indicator(
+        ["MACD", "MACD_signal", "MACD_hist"],
+        lambda p: list(talib.MACD(p["close"], fastperiod=12, slowperiod=26, signalperiod=9)),
+        state=_macd_state, update=_macd_update
+    )),
+    # RSI - 摆动类指标
+    ("RSI14", _Indicator(
+        ["RSI14"], lambda p: [talib.RSI(p["close"], timeperiod=14)], state=_rsi_state, update=_rsi_update
+    )),
+    # 布林带 - 通道类指标
+    ("BOLL", _Indicator(
+        ["BOLL_upper", "BOLL_middle", "BOLL_lower"],
+        lambda p: list(talib.BBANDS(p["close"], timeperiod=20, nbdevup=2, nbdevdn=2, matype=0)), lookback=19
+    )),
+    # KDJ指标
+    ("KDJ", _Indicator(["K", "D", "J"], _kdj, lookback=12)),
+    # ATR - 波动性指标
+    ("ATR", _Indicator(
+        ["ATR"], lambda p: [talib.ATR(p["high"], p["low"], p["close"], timeperiod=14)],
+        state=_with_close, update=_atr_update
+    )),
+    # OBV - 成交量指标
+    ("OBV", _Indicator(
+        ["OBV"], lambda p: [talib.OBV(p["close"], p["volume"])], state=_with_close, update=_obv_update
+    )),
+])
+
+
+def resolve_indicators(names: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """把指标名称（不区分大小写）规范为 INDICATORS 中的名称，默认全部
+
+    Raises:
+        ValueError: 不支持的指标
+    """
+    if not names:
+        return tuple(INDICATORS)
+    lookup = {name.upper(): name for name in INDICATORS}
+    unknown = [name for name in names if name.strip().upper() not in lookup]
+    if unknown:
+        raise ValueError(f"不支持的指标: {', '.join(unknown)}，可选: {', '.join(INDICATORS)}")
+    selected = {lookup[name.strip().upper()] for name in names}
+    return tuple(name for name in INDICATORS if name in selected)
+
+
+def _prices(data: pd.DataFrame) -> Dict[str, np.ndarray]:
+    return {column: data[column].to_numpy(dtype=np.float64) for column in OHLCV_COLUMNS}
+
+
+def compute_indicators(data: pd.DataFrame, indicators: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """对完整序列计算技术指标
+
+    Args:
+        data: 股票OHLCV数据
+        indicators: 要计算的指标名称，默认全部
+
+    Returns:
+        添加了技术指标的DataFrame
+    """
+    frame, _ = _compute(data, resolve_indicators(indicators))
+    return frame
+
+
+def _compute(data: pd.DataFrame, names: Sequence[str]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    prices = _prices(data)
+    df = data.copy()
+    states = {}
+    for name in names:
+        indicator = INDICATORS[name]
+        values = indicator.compute(prices)
+        for column, column_values in zip(indicator.columns, values):
+            df[column] = column_values
+        if indicator.state is not None:
+            states[name] = indicator.state(prices, values)
+    return df, states
+
+
+def _extend(frame: pd.DataFrame, states: Dict[str, Any], data: pd.DataFrame,
+            names: Sequence[str]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """在已计算的指标后追加 data 中新增的 K 线"""
+    start = len(frame)
+    tail = data.iloc[start:].copy()
+    prices = _prices(data)
+    new_states = {}
+    for name in names:
+        indicator = INDICATORS[name]
+        if indicator.update is not None:
+            values, new_states[name] = indicator.update({k: v[start:] for k, v in prices.items()}, states[name])
+        else:
+            offset = max(start - indicator.lookback, 0)
+            values = [v[start - offset:] for v in indicator.compute({k: v[offset:] for k, v in prices.items()})]
+        for column, column_values in zip(indicator.columns, values):
+            tail[column] = column_values
+    return pd.concat([frame, tail]), new_states
+
+
+class IndicatorEngine:
+    """技术指标缓存
+
+    以（股票代码、开始日期、指标集合）为键缓存计算结果。某根 K 线的指标只取决于它及之前的数据，
+    因此同一开始日期下较短的结束日期直接截取已缓存的结果；结束日期更晚时只计算新增的 K 线：
+    窗口类指标对末尾一段重新计算，递推类指标从保存的状态继续递推，与全量计算的结果一致（浮点误差范围内）。
+    历史行情发生变化时重新全量计算。
+    """
+
+    def __init__(self, max_entries: int):
+        """初始化技术指标缓存
+
+        Args:
+            max_entries: 最多缓存的结果数，0 表示不缓存
+        """
+        self.max_entries = max_entries
+        # 缓存键 -> (只读的指标数据, 递推类指标的状态)
+        self._entries: "collections.OrderedDict[Hashable, Tuple[pd.DataFrame, Dict[str, Any]]]" = \
+            collections.OrderedDict()
+        self._hits = 0
+        self._extends = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, data: pd.DataFrame, indicators: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """获取 data 的技术指标，尽量复用缓存
+
+        Args:
+            key: 数据来源的标识，如 (股票代码, 开始日期)，同一标识的数据应只在末尾追加
+            data: 股票OHLCV数据
+            indicators: 要计算的指标名称，默认全部
+
+        Returns:
+            添加了技术指标的只读DataFrame
+
+        Raises:
+            ValueError: 不支持的指标
+        """
+        names = resolve_indicators(indicators)
+        key = (key, names)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            frame, states = entry
+            shared = min(len(frame), len(data))
+            if frame.index[:shared].equals(data.index[:shared]) and np.array_equal(
+                    frame[OHLCV_COLUMNS].to_numpy()[:shared], data[OHLCV_COLUMNS].to_numpy()[:shared]):
+                if len(data) <= len(frame):
+                    with self._lock:
+                        self._hits += 1
+                    return frame.iloc[:len(data)]
+                if all(states.get(name) is not None for name in names if INDICATORS[name].update is not None):
+                    frame, states = _extend(frame, states, data, names)
+                    with self._lock:
+                        self._extends += 1
+                    return self._store(key, frame, states)
+
+        frame, states = _compute(data, names)
+        with self._lock:
+            self._misses += 1
+        return self._store(key, frame, states)
+
+    def _store(self, key: Hashable, frame: pd.DataFrame, states: Dict[str, Any]) -> pd.DataFrame:
+        frame = _freeze(frame)
+        if self.max_entries <= 0:
+            return frame
+        with self._lock:
+            self._entries[key] = (frame, states)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return frame.copy(deep=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "incremental_updates": self._extends,
+                "misses": self._misses,
+            }
+
+
+# 创建技术指标缓存实例
+indicator_engine = IndicatorEngine(settings.INDICATOR_CACHE_ENTRIES)
@@ -11,6 +11,17 @@ from sklearn.ensemble import RandomForestRegressor, GradientBoostingClassifier
 from sklearn.metrics import mean_squared_error, r2_score, accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
 from sklearn.cluster import KMeans
 
+from .dataset_registry import dataset_fingerprint, dataset_registry
+from .model_registry import ModelNotTrained, model_registry
+
+# 影响训练结果的超参数，与训练数据的指纹一起组成模型键
+CAR_CLAIM_PARAMS = {"n_estimators": 100, "random_state": 42}
+HEALTH_PURCHASE_PARAMS = {"random_state": 42}
+
+# 预期索赔金额的风险等级：金额落在第 i 个区间时为 CAR_RISK_LEVELS[i]
+CAR_RISK_BINS = np.array([1000, 3000, 6000, 10000])
+CAR_RISK_LEVELS = np.array(["低风险", "中低风险", "中风险", "中高风险", "高风险"])
+
 class InsuranceAnalysisService:
     """保险分析服务，提供车险索赔率和医疗保险营销分析功能"""
     
@@ -22,29 +33,23 @@ class InsuranceAnalysisService:
         """
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        
-        # 预训练模型
-        self.models = {}
     
-    def load_car_insurance_data(self) -> pd.DataFrame:
+    def load_car_insurance_data(self, copy: bool = False, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """加载车险数据
         
+        Args:
+            copy: 是否返回可原地修改的副本，默认返回只读的共享数据
+            columns: 只读取这些列，默认读取全部
+            
         Returns:
             车险数据 DataFrame
         """
-        # 检查本地是否有缓存
+        # 本地没有数据文件时生成模拟数据并保存，之后从内存中的数据集注册表读取
         cache_file = os.path.join(self.data_dir, "car_insurance.csv")
-        
-        if os.path.exists(cache_file):
-            return pd.read_csv(cache_file)
-        
-        # 否则生成模拟数据
-        df = self._generate_mock_car_insurance_data(5000)
-        
-        # 保存到缓存
-        df.to_csv(cache_file, index=False)
-        
-        return df
+        return dataset_registry.get_or_create(
+            cache_file, lambda: self._generate_mock_car_insurance_data(5000),
+            copy=copy, columns=columns, write_kwargs={"index": False}
+        )
     
     def _generate_mock_car_insurance_data(self, n_samples: int) -> pd.DataFrame:
         """生成模拟车险数据
@@ -102,25 +107,22 @@ class InsuranceAnalysisService:
         
         return df
     
-    def load_health_insurance_data(self) -> pd.DataFrame:
+    def load_health_insurance_data(self, copy: bool = False, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """加载医疗保险数据
         
+        Args:
+            copy: 是否返回可原地修改的副本，默认返回只读的共享数据
+            columns: 只读取这些列，默认读取全部
+            
         Returns:
             医疗保险数据 DataFrame
         """
-        # 检查本地是否有缓存
+        # 本地没有数据文件时生成模拟数据并保存，之后从内存中的数据集注册表读取
         cache_file = os.path.join(self.data_dir, "health_insurance.csv")
-        
-        if os.path.exists(cache_file):
-            return pd.read_csv(cache_file)
-        
-        # 否则生成模拟数据
-        df = self._generate_mock_health_insurance_data(8000)
-        
-        # 保存到缓存
-        df.to_csv(cache_file, index=False)
-        
-        return df
+        return dataset_registry.get_or_create(
+            cache_file, lambda: self._generate_mock_health_insurance_data(8000),
+            copy=copy, columns=columns, write_kwargs={"index": False}
+        )
     
     def _generate_mock_health_insurance_data(self, n_samples: int) -> pd.DataFrame:
         """生成模拟医疗保险数据
@@ -226,33 +228,43 @@ class InsuranceAnalysisService:
             'total': data['claim_amount'].sum()
         }
         
-        # 训练一个简单的回归模型预测索赔金额
+        # 训练一个简单的回归模型预测索赔金额，用同样的数据训练过时直接使用保存的模型
+        _, model_info = model_registry.get_or_train(
+            "car_claim_amount", dataset_fingerprint(data), CAR_CLAIM_PARAMS,
+            lambda: self._fit_car_claim_model(data)
+        )
+        
+        return {
+            'total_claim_rate': total_claim_rate,
+            'age_claim_rates': dict(age_claim_rates),
+            'gender_claim_rates': dict(gender_claim_rates),
+            'experience_claim_rates': dict(experience_claim_rates),
+            'violation_claim_rates': dict(violation_claim_rates),
+            'car_category_claim_rates': dict(car_category_claim_rates),
+            'claim_amount_stats': claim_amount_stats,
+            'model_metrics': model_info['model_metrics'],
+            'feature_importance': model_info['feature_importance']
+        }
+    
+    def _fit_car_claim_model(self, data: pd.DataFrame) -> Tuple[RandomForestRegressor, Dict[str, Any]]:
+        """拟合索赔金额回归模型，返回 (模型, 评估结果)"""
         X = data.drop(['claim_occurred', 'claim_amount'], axis=1)
         X = pd.get_dummies(X, drop_first=True)
         y = data['claim_amount']
         
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        model = RandomForestRegressor(**CAR_CLAIM_PARAMS)
         model.fit(X_train, y_train)
         
         y_pred = model.predict(X_test)
         
-        self.models['car_claim_amount'] = model
-        
         # 获取特征重要性
         importances = model.feature_importances_
         indices = np.argsort(importances)[::-1][:10]
         feature_importance = {X.columns[i]: float(importances[i]) for i in indices}
         
-        return {
-            'total_claim_rate': total_claim_rate,
-            'age_claim_rates': dict(age_claim_rates),
-            'gender_claim_rates': dict(gender_claim_rates),
-            'experience_claim_rates': dict(experience_claim_rates),
-            'violation_claim_rates': dict(violation_claim_rates),
-            'car_category_claim_rates': dict(car_category_claim_rates),
-            'claim_amount_stats': claim_amount_stats,
+        return model, {
             'model_metrics': {
                 'r2': r2_score(y_test, y_pred),
                 'rmse': np.sqrt(mean_squared_error(y_test, y_pred))
@@ -260,43 +272,73 @@ class InsuranceAnalysisService:
             'feature_importance': feature_importance
         }
     
+    def _trained_model(self, name: str, filename: str, params: Dict[str, Any]) -> Any:
+        """获取以当前数据文件训练并保存的模型
+        
+        Raises:
+            ModelNotTrained: 模型尚未训练
+        """
+        cache_file = os.path.join(self.data_dir, filename)
+        if not os.path.exists(cache_file):
+            raise ModelNotTrained(f"模型 {name} 尚未训练")
+        model, _ = model_registry.get(name, dataset_registry.fingerprint(cache_file), params)
+        return model
+    
     def predict_car_claim_amount(self, customer_data: Dict[str, Any]) -> Dict[str, Any]:
-        """预测车险客户的预期索赔金额
+        """预测车险客户的预期索赔金额，使用以当前车险数据训练并保存的模型，不会训练
         
         Args:
             customer_data: 客户数据字典
             
         Returns:
             包含预测结果的字典
+            
+        Raises:
+            ModelNotTrained: 模型尚未训练，需先调用 analyze_car_insurance_claims
         """
-        if 'car_claim_amount' not in self.models:
-            raise ValueError("Model not trained. Call analyze_car_insurance_claims first.")
-        
-        # 将输入转换为DataFrame并进行编码
-        df = pd.DataFrame([customer_data])
-        df = pd.get_dummies(df, drop_first=True)
-        
-        # 确保与训练数据有相同的列
-        model = self.models['car_claim_amount']
-        expected_features = model.feature_names_in_
-        
-        # 处理缺失特征
-        for feature in expected_features:
-            if feature not in df.columns:
-                df[feature] = 0
-        
-        # 只保留模型期望的特征，并按照正确顺序排列
-        df = df[expected_features]
-        
-        # 预测
-        predicted_amount = model.predict(df)[0]
+        model = self.get_car_claim_model()
         
+        # 将输入转换为DataFrame并预测
+        scored = self.score_car_claim_amount(pd.DataFrame([customer_data]), model).iloc[0]
+        return self.format_car_claim_prediction(customer_data, scored)
+    
+    def format_car_claim_prediction(self, customer_data: Dict[str, Any], scored: Dict[str, Any]) -> Dict[str, Any]:
+        """把一个客户的评分结果（score_car_claim_amount 的一行）转换为单条预测接口的返回值"""
         return {
             'customer_id': customer_data.get('id', 'unknown'),
-            'predicted_claim_amount': float(predicted_amount),
-            'risk_level': self._get_car_risk_level(predicted_amount)
+            'predicted_claim_amount': float(scored['predicted_claim_amount']),
+            'risk_level': str(scored['risk_level'])
         }
     
+    def get_car_claim_model(self) -> RandomForestRegressor:
+        """获取以当前车险数据训练的索赔金额模型
+        
+        Raises:
+            ModelNotTrained: 模型尚未训练
+        """
+        return self._trained_model("car_claim_amount", "car_insurance.csv", CAR_CLAIM_PARAMS)
+    
+    def score_car_claim_amount(self, customers: pd.DataFrame, model: RandomForestRegressor) -> pd.DataFrame:
+        """批量预测预期索赔金额，一次调用模型完成整批客户
+        
+        Args:
+            customers: 客户数据，每行一个客户，有 id 列时作为客户ID，否则使用行索引
+            model: 索赔金额模型，见 get_car_claim_model
+            
+        Returns:
+            customer_id、predicted_claim_amount、risk_level 三列
+        """
+        features = customers.drop(columns=['id', 'claim_occurred', 'claim_amount'], errors='ignore')
+        # 按模型的特征独热编码：每个类别对应训练时的同名列，训练时被丢弃的基准类别全为 0，
+        # 编码结果与同一批次中出现了哪些类别无关；缺失的特征按 0 处理
+        features = pd.get_dummies(features).reindex(columns=model.feature_names_in_, fill_value=0)
+        amounts = model.predict(features)
+        return pd.DataFrame({
+            'customer_id': customers['id'].values if 'id' in customers.columns else customers.index.values,
+            'predicted_claim_amount': amounts,
+            'risk_level': self._get_car_risk_levels(amounts)
+        })
+    
     def _get_car_risk_level(self, amount: float) -> str:
         """根据预期索赔金额确定风险等级
         
@@ -306,16 +348,11 @@ class InsuranceAnalysisService:
         Returns:
             风险等级
         """
-        if amount < 1000:
-            return "低风险"
-        elif amount < 3000:
-            return "中低风险"
-        elif amount < 6000:
-            return "中风险"
-        elif amount < 10000:
-            return "中高风险"
-        else:
-            return "高风险"
+        return str(self._get_car_risk_levels(np.array([amount]))[0])
+    
+    def _get_car_risk_levels(self, amounts: np.ndarray) -> np.ndarray:
+        """批量确定风险等级，区间左闭右开（如 1000 属于中低风险）"""
+        return CAR_RISK_LEVELS[np.digitize(amounts, CAR_RISK_BINS)]
     
     def health_insurance_customer_segmentation(self, data: pd.DataFrame, n_clusters: int = 5) -> Dict[str, Any]:
         """对医疗保险客户进行分群，用于精准营销
@@ -409,6 +446,19 @@ class InsuranceAnalysisService:
         Returns:
             包含预测结果的字典
         """
+        # 用同样的数据训练过时直接使用保存的模型
+        _, model_info = model_registry.get_or_train(
+            "health_purchase", dataset_fingerprint(data), HEALTH_PURCHASE_PARAMS,
+            lambda: self._fit_health_purchase_model(data)
+        )
+        return {
+            'model_metrics': model_info['model_metrics'],
+            'feature_importance': model_info['feature_importance'],
+            'test_predictions': model_info['test_predictions']
+        }
+    
+    def _fit_health_purchase_model(self, data: pd.DataFrame) -> Tuple[Pipeline, Dict[str, Any]]:
+        """拟合购买概率分类模型，返回 (模型管道, 评估结果)"""
         # 准备数据
         X = data.drop('purchased', axis=1)
         y = data['purchased']
@@ -438,7 +488,7 @@ class InsuranceAnalysisService:
         # 建立模型管道
         pipeline = Pipeline(steps=[
             ('preprocessor', preprocessor),
-            ('classifier', GradientBoostingClassifier(random_state=42))
+            ('classifier', GradientBoostingClassifier(**HEALTH_PURCHASE_PARAMS))
         ])
         
         # 分割数据
@@ -451,9 +501,6 @@ class InsuranceAnalysisService:
         y_pred = pipeline.predict(X_test)
         y_prob = pipeline.predict_proba(X_test)[:, 1]
         
-        # 保存模型
-        self.models['health_purchase'] = pipeline
-        
         # 评估模型
         metrics = {
             'accuracy': accuracy_score(y_test, y_pred),
@@ -467,29 +514,30 @@ class InsuranceAnalysisService:
         # 这里使用了一个简化方法，因为管道中的特征转换使得直接获取特征重要性变得复杂
         feature_importance = {}
         
-        return {
+        return pipeline, {
             'model_metrics': metrics,
             'feature_importance': feature_importance,
             'test_predictions': y_prob[:10].tolist()
         }
     
     def recommend_insurance_products(self, customer_data: Dict[str, Any]) -> Dict[str, Any]:
-        """根据客户特征推荐保险产品
+        """根据客户特征推荐保险产品，使用以当前医疗保险数据训练并保存的模型，不会训练
         
         Args:
             customer_data: 客户数据字典
             
         Returns:
             包含推荐结果的字典
+            
+        Raises:
+            ModelNotTrained: 模型尚未训练，需先调用 predict_health_insurance_purchase
         """
-        if 'health_purchase' not in self.models:
-            raise ValueError("Model not trained. Call predict_health_insurance_purchase first.")
+        pipeline = self._trained_model("health_purchase", "health_insurance.csv", HEALTH_PURCHASE_PARAMS)
         
         # 将输入转换为DataFrame
         df = pd.DataFrame([customer_data])
         
         # 预测购买概率
-        pipeline = self.models['health_purchase']
         purchase_prob = pipeline.predict_proba(df)[0, 1]
         
         # 根据客户特征和购买概率制定推荐
@@ -0,0 +1,155 @@
+import asyncio
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+import pandas as pd
+
+from app.core.config import settings
+
+# 直方图的桶上限：批大小（行）和排队延迟（毫秒），超过最后一个桶的计入 "+inf"
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_DELAY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class _Histogram:
+    """固定桶的直方图，每个桶记录不超过该上限（且超过上一个上限）的样本数"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._max = value if self._max is None else max(self._max, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [str(b) for b in self.buckets] + ["+inf"]
+            return {
+                "buckets": dict(zip(labels, self._counts)),
+                "count": self._count,
+                "avg": round(self._sum / self._count, 3) if self._count else None,
+                "max": None if self._max is None else round(self._max, 3),
+            }
+
+
+class _Batch:
+    def __init__(self, score: Callable[[pd.DataFrame], pd.DataFrame]):
+        self.score = score
+        # (输入行, 等待结果的 future, 入队时间)
+        self.items: List[Tuple[Dict[str, Any], asyncio.Future, float]] = []
+        self.timer = None
+
+
+class MicroBatcher:
+    """单条预测请求的微批处理
+
+    学生逐个给客户评分时，前端对每个客户单独调用预测接口，每次调用模型都有固定开销。
+    微批处理把同一模型、同样字段的并发单条请求在 max_delay_ms 内收集起来（最多 max_batch_size 条），
+    合并成一个 DataFrame 调用一次模型，再把每行结果分发给各自的调用方。
+    批量评分失败时逐条重试，一条有问题的请求不会影响同批的其他请求。
+    """
+
+    def __init__(self, max_batch_size: int, max_delay_ms: float):
+        """初始化微批处理
+
+        Args:
+            max_batch_size: 每批最多合并的请求数，1 表示不合并
+            max_delay_ms: 第一条请求最多等待多少毫秒
+        """
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        # 批次键 -> 正在收集的批次
+        self._pending: Dict[Hashable, _Batch] = {}
+        self._batch_sizes = _Histogram(BATCH_SIZE_BUCKETS)
+        self._queue_delays = _Histogram(QUEUE_DELAY_BUCKETS_MS)
+        self._fallbacks = 0
+
+    async def submit(self, key: Hashable, row: Dict[str, Any],
+                     score: Callable[[pd.DataFrame], pd.DataFrame]) -> Dict[str, Any]:
+        """提交一条预测请求，等待所在批次评分完成
+
+        Args:
+            key: 批次键，只有键相同的请求才会合并（应包含模型和输入字段）
+            row: 输入数据
+            score: 批量评分函数，输入多行数据，按相同顺序返回每行的结果；同一批次使用第一条请求的函数
+
+        Returns:
+            该行的评分结果
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(score)
+            batch.timer = loop.call_later(self.max_delay, self._flush, key, batch)
+        batch.items.append((row, future, time.perf_counter()))
+        if len(batch.items) >= self.max_batch_size:
+            batch.timer.cancel()
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key: Hashable, batch: _Batch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: _Batch):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self._batch_sizes.observe(len(batch.items))
+        for _, _, enqueued in batch.items:
+            self._queue_delays.observe((started - enqueued) * 1000)
+
+        rows = [row for row, _, _ in batch.items]
+        try:
+            # 模型计算放到线程池中，不阻塞事件循环
+            scored = await loop.run_in_executor(None, batch.score, pd.DataFrame(rows))
+            results = scored.to_dict("records")
+        except Exception as e:
+            if len(rows) == 1:
+                self._resolve(batch.items[0][1], exception=e)
+                return
+            self._fallbacks += 1
+            for row, future, _ in batch.items:
+                try:
+                    result = await loop.run_in_executor(None, batch.score, pd.DataFrame([row]))
+                    self._resolve(future, result.to_dict("records")[0])
+                except Exception as row_error:
+                    self._resolve(future, exception=row_error)
+            return
+        for (_, future, _), result in zip(batch.items, results):
+            self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any = None, exception: Exception = None):
+        # 调用方断开时 future 已被取消
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """批大小（行）和排队延迟（毫秒）的直方图"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_delay_ms": self.max_delay * 1000,
+            "batch_size": self._batch_sizes.snapshot(),
+            "queue_delay_ms": self._queue_delays.snapshot(),
+            "fallbacks": self._fallbacks,
+        }
+
+
+# 创建预测请求微批处理实例
+prediction_batcher = MicroBatcher(settings.MICRO_BATCH_MAX_SIZE, settings.MICRO_BATCH_MAX_DELAY_MS)
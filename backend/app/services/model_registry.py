@@ -0,0 +1,130 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import joblib
+
+from app.core.config import settings
+
+
+class ModelNotTrained(LookupError):
+    """模型尚未训练（或训练数据已变化），预测接口不会自行训练"""
+
+
+class ModelRegistry:
+    """训练好的模型
+
+    以模型名称、训练数据的指纹（见 dataset_registry.dataset_fingerprint）和超参数为键，用 joblib
+    把拟合好的管道连同评估指标保存在模型目录中，进程重启后以及多个 worker 之间都可以直接使用，
+    不需要重新训练。模型按需从磁盘加载（数组以内存映射方式读取），最近使用的模型保留在内存中。
+    """
+
+    def __init__(self, model_dir: str, max_loaded: int):
+        """初始化模型注册表
+
+        Args:
+            model_dir: 模型文件目录
+            max_loaded: 内存中最多保留的模型数
+        """
+        self.model_dir = model_dir
+        self.max_loaded = max_loaded
+        # 模型键 -> (模型, 训练信息)
+        self._loaded: "collections.OrderedDict[str, Tuple[Any, Dict[str, Any]]]" = collections.OrderedDict()
+        # 同一模型只由一个线程训练
+        self._training: Dict[str, threading.Lock] = {}
+        self._hits = 0
+        self._loads = 0
+        self._trainings = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, fingerprint: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """模型键：名称加上指纹和超参数的哈希"""
+        payload = json.dumps({"fingerprint": fingerprint, "params": params or {}}, sort_keys=True, default=str)
+        return f"{name}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.model_dir, f"{key}.joblib")
+
+    def get(self, name: str, fingerprint: str, params: Optional[Dict[str, Any]] = None) -> Tuple[Any, Dict[str, Any]]:
+        """获取已训练的模型，不会训练
+
+        Returns:
+            (模型, 训练信息)
+
+        Raises:
+            ModelNotTrained: 没有用该数据和超参数训练过的模型
+        """
+        key = self.key(name, fingerprint, params)
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                self._hits += 1
+                return self._loaded[key]
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise ModelNotTrained(f"模型 {name} 尚未训练")
+        entry = joblib.load(path, mmap_mode="r")
+        with self._lock:
+            self._loads += 1
+            self._remember(key, entry)
+        return entry
+
+    def get_or_train(self, name: str, fingerprint: str, params: Optional[Dict[str, Any]],
+                     train: Callable[[], Tuple[Any, Dict[str, Any]]]) -> Tuple[Any, Dict[str, Any]]:
+        """获取模型，不存在时调用 train 训练并保存
+
+        Args:
+            name: 模型名称
+            fingerprint: 训练数据的指纹
+            params: 影响训练结果的超参数
+            train: 训练函数，返回 (模型, 训练信息)，训练信息中保存评估指标等需要随模型返回的内容
+        """
+        key = self.key(name, fingerprint, params)
+        with self._lock:
+            training = self._training.setdefault(key, threading.Lock())
+        with training:
+            try:
+                return self.get(name, fingerprint, params)
+            except ModelNotTrained:
+                pass
+            model, info = train()
+            info = dict(info, name=name, params=params or {}, fingerprint=fingerprint, trained_at=time.time())
+            self._save(key, (model, info))
+            with self._lock:
+                self._trainings += 1
+                self._remember(key, (model, info))
+            return model, info
+
+    def _save(self, key: str, entry: Tuple[Any, Dict[str, Any]]):
+        """先写临时文件再改名，其他进程不会读到写了一半的文件"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        joblib.dump(entry, tmp)
+        os.replace(tmp, path)
+
+    def _remember(self, key: str, entry: Tuple[Any, Dict[str, Any]]):
+        """放入内存，调用时需持有锁"""
+        self._loaded[key] = entry
+        self._loaded.move_to_end(key)
+        while len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """注册表统计"""
+        with self._lock:
+            return {
+                "loaded": list(self._loaded),
+                "memory_hits": self._hits,
+                "disk_loads": self._loads,
+                "trainings": self._trainings,
+            }
+
+
+# 创建模型注册表实例
+model_registry = ModelRegistry(settings.MODEL_DIR, settings.MODEL_CACHE_ENTRIES)
@@ -0,0 +1,217 @@
+import glob
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dataset_registry import dataset_registry
+
+logger = logging.getLogger(__name__)
+
+# 旧版按查询缓存的文件名：{股票代码}_{开始日期}_{结束日期}.csv
+LEGACY_PATTERN = re.compile(r"^(?P<symbol>.+)_(?P<start>\d{4}-\d{2}-\d{2})_(?P<end>\d{4}-\d{2}-\d{2})\.csv$")
+
+ONE_DAY = pd.Timedelta(days=1)
+
+# 导入旧版缓存文件前，在文件开头和结尾各取多少行与重新获取的数据核对
+LEGACY_CHECK_ROWS = 5
+
+# 日期区间（含两端）
+DateRange = Tuple[pd.Timestamp, pd.Timestamp]
+
+
+def _missing_ranges(ranges: Sequence[DateRange], start: pd.Timestamp, end: pd.Timestamp) -> List[DateRange]:
+    """[start, end] 中未被已有区间覆盖的部分"""
+    missing = []
+    current = start
+    for covered_start, covered_end in ranges:
+        if covered_end < current:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > current:
+            missing.append((current, covered_start - ONE_DAY))
+        current = max(current, covered_end + ONE_DAY)
+    if current <= end:
+        missing.append((current, end))
+    return missing
+
+
+def _merge_ranges(ranges: Sequence[DateRange]) -> List[DateRange]:
+    """合并重叠或相邻的区间"""
+    merged: List[DateRange] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class OHLCVStore:
+    """按股票代码保存的日线行情
+
+    每只股票一个以日期为索引的文件，另有一个文件记录已经获取过的日期区间。查询时只获取未覆盖的
+    日期并合并进文件，重叠的查询共享数据，任意子区间直接从内存中的数据按索引切片返回。
+    文件通过数据集注册表读取，加载时使用带类型的列式副本，未变化时不重新读取。
+    """
+
+    def __init__(self, store_dir: str, legacy_dir: Optional[str] = None, max_workers: int = 8):
+        """初始化行情存储
+
+        Args:
+            store_dir: 行情文件目录
+            legacy_dir: 旧版按查询缓存的行情文件所在目录，股票首次访问时导入其中与 fetch 一致的数据
+            max_workers: 批量加载多只股票时的线程数
+        """
+        self.store_dir = store_dir
+        self.legacy_dir = legacy_dir
+        self.max_workers = max_workers
+        # 同一股票只由一个线程获取和写入
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, symbol: str) -> Tuple[str, str]:
+        """(行情文件, 日期区间文件) 的路径"""
+        if os.sep in symbol or (os.altsep and os.altsep in symbol):
+            raise ValueError(f"无效的股票代码: {symbol}")
+        return (os.path.join(self.store_dir, f"{symbol}.csv"),
+                os.path.join(self.store_dir, f"{symbol}.ranges.json"))
+
+    def _ranges(self, symbol: str) -> List[DateRange]:
+        _, ranges_path = self._paths(symbol)
+        try:
+            with open(ranges_path, encoding="utf-8") as f:
+                return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def _read(self, symbol: str, copy: bool = False) -> Optional[pd.DataFrame]:
+        path, _ = self._paths(symbol)
+        if not os.path.exists(path):
+            return None
+        return dataset_registry.get(path, copy=copy, index_col=0, parse_dates=True)
+
+    def _write(self, symbol: str, frame: pd.DataFrame, ranges: Sequence[DateRange]):
+        """先写临时文件再改名；行情文件写完后才更新区间文件，中途失败时下次会重新获取"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        path, ranges_path = self._paths(symbol)
+        for target, write in (
+            (path, lambda tmp: frame.to_csv(tmp)),
+            (ranges_path, lambda tmp: self._dump_ranges(tmp, ranges)),
+        ):
+            tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            write(tmp)
+            os.replace(tmp, target)
+
+    @staticmethod
+    def _dump_ranges(path: str, ranges: Sequence[DateRange]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([[start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")] for start, end in ranges], f)
+
+    @staticmethod
+    def _consistent(symbol: str, frame: pd.DataFrame,
+                    fetch: Callable[[str, pd.Timestamp, pd.Timestamp], pd.DataFrame]) -> bool:
+        """旧版数据开头和结尾的若干行与 fetch 返回的数据一致
+
+        旧版文件可能由不同的数据源或生成方式得到，与新获取的数据直接拼接会在区间边界处出现跳变
+        """
+        for index in (frame.index[:LEGACY_CHECK_ROWS], frame.index[-LEGACY_CHECK_ROWS:]):
+            fetched = fetch(symbol, index[0], index[-1])
+            dates = index.intersection(fetched.index) if fetched is not None else index[:0]
+            columns = frame.columns.intersection(fetched.columns) if fetched is not None else frame.columns[:0]
+            # 没有共同的日期或列时无法核对，不导入
+            if dates.empty or columns.empty:
+                return False
+            expected = fetched.loc[dates, columns].to_numpy(dtype=float)
+            if not np.allclose(frame.loc[dates, columns].to_numpy(dtype=float), expected, rtol=1e-6, equal_nan=True):
+                return False
+        return True
+
+    def _legacy(self, symbol: str, fetch: Callable[[str, pd.Timestamp, pd.Timestamp], pd.DataFrame]
+                ) -> Tuple[List[pd.DataFrame], List[DateRange]]:
+        """旧版缓存文件中该股票的数据和日期区间，只导入与 fetch 的数据一致的文件"""
+        frames, ranges = [], []
+        if not self.legacy_dir:
+            return frames, ranges
+        for path in sorted(glob.glob(os.path.join(glob.escape(self.legacy_dir), f"{glob.escape(symbol)}_*_*.csv"))):
+            match = LEGACY_PATTERN.match(os.path.basename(path))
+            if match is None or match.group("symbol") != symbol:
+                continue
+            frame = pd.read_csv(path, index_col=0, parse_dates=True).sort_index()
+            if frame.empty or not self._consistent(symbol, frame, fetch):
+                logger.info(f"旧版行情文件与当前数据源不一致，不导入: {path}")
+                continue
+            frames.append(frame)
+            ranges.append((pd.Timestamp(match.group("start")), pd.Timestamp(match.group("end"))))
+        return frames, ranges
+
+    def get(self, symbol: str, start_date: str, end_date: str,
+            fetch: Callable[[str, pd.Timestamp, pd.Timestamp], pd.DataFrame],
+            copy: bool = False) -> pd.DataFrame:
+        """获取股票在 [start_date, end_date] 内的行情，只对未获取过的日期调用 fetch
+
+        Args:
+            symbol: 股票代码
+            start_date: 开始日期
+            end_date: 结束日期
+            fetch: 获取行情的函数，参数为 (股票代码, 开始日期, 结束日期)，返回以日期为索引的 DataFrame
+            copy: 是否返回可原地修改的副本，默认返回只读的共享数据
+
+        Returns:
+            以日期为索引的行情 DataFrame
+        """
+        start, end = pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize()
+        ranges = self._ranges(symbol)
+        if _missing_ranges(ranges, start, end):
+            with self._lock:
+                lock = self._locks.setdefault(symbol, threading.Lock())
+            with lock:
+                # 等待期间其他线程可能已经获取
+                ranges = self._ranges(symbol)
+                frames = [self._read(symbol)]
+                if not ranges:
+                    # 首次访问，导入旧版缓存文件
+                    legacy_frames, ranges = self._legacy(symbol, fetch)
+                    frames += legacy_frames
+                missing = _missing_ranges(_merge_ranges(ranges), start, end)
+                # 有未获取的日期，或导入了旧版数据
+                if missing or len(frames) > 1:
+                    frames += [fetch(symbol, missing_start, missing_end) for missing_start, missing_end in missing]
+                    frame = pd.concat([f for f in frames if f is not None])
+                    # 已保存的数据优先
+                    frame = frame[~frame.index.duplicated(keep="first")].sort_index()
+                    self._write(symbol, frame, _merge_ranges(list(ranges) + [(start, end)]))
+
+        frame = self._read(symbol, copy=copy)
+        return frame.loc[start:end]
+
+    def get_many(self, symbols: Sequence[str], start_date: str, end_date: str,
+                 fetch: Callable[[str, pd.Timestamp, pd.Timestamp], pd.DataFrame],
+                 copy: bool = False) -> Dict[str, pd.DataFrame]:
+        """并行获取多只股票的行情，参数同 get
+
+        Returns:
+            股票代码 -> 行情 DataFrame，顺序与 symbols 相同
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if len(symbols) <= 1:
+            return {symbol: self.get(symbol, start_date, end_date, fetch, copy) for symbol in symbols}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(symbols))) as executor:
+            frames = executor.map(lambda symbol: self.get(symbol, start_date, end_date, fetch, copy), symbols)
+            return dict(zip(symbols, frames))
+
+    def invalidate(self, symbol: str):
+        """删除股票的行情文件，下次查询时重新获取"""
+        for path in self._paths(symbol):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        dataset_registry.invalidate(self._paths(symbol)[0])
@@ -0,0 +1,301 @@
+import ast
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+from app.core.config import settings
+from .chart_store import chart_store
+
+# 会话最多记录多少段待补执行的代码
+MAX_DEFERRED_CODES = 20
+# 最多为多少个会话记录待补执行的代码
+MAX_DEFERRED_SESSIONS = 10000
+# 流式执行时最多记录多少字符的输出用于缓存，超出则不缓存
+MAX_CACHED_OUTPUT_CHARS = 1024 * 1024
+
+EXAMPLES_PATH = Path(__file__).parent.parent / "db" / "experiments_data.json"
+
+# 结果随时间或外部数据变化的代码：调用这些方法读取当前时间，或导入这些访问网络的模块
+CLOCK_CALLS = {"now", "utcnow", "today", "time", "time_ns", "monotonic", "perf_counter", "process_time"}
+NETWORK_MODULES = {"yfinance", "requests", "urllib", "urllib3", "http", "socket", "aiohttp", "httpx", "pandas_datareader"}
+
+
+def normalize_code(code: str) -> Optional[str]:
+    """返回代码的规范化形式（语法树），忽略注释、空行和格式差异；语法错误时返回 None"""
+    try:
+        return ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        return None
+
+
+def code_hash(code: str) -> Optional[str]:
+    normalized = normalize_code(code)
+    if normalized is None:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(code: str) -> bool:
+    """代码是否不读取当前时间、不访问网络（静态检查，语法错误时返回 False）"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in CLOCK_CALLS:
+                return False
+            continue
+        else:
+            continue
+        if any(module.split(".")[0] in NETWORK_MODULES for module in modules):
+            return False
+    return True
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExecutionResultCache:
+    """实验示例代码的执行结果缓存
+
+    几乎每个学生都会原样运行 experiments_data.json 中的示例代码，这些代码的结果只取决于代码本身
+    和它读取的文件。缓存以规范化代码的哈希为键，保存输出、图表ID以及执行时读取的所有文件（标准库和
+    第三方包除外）的指纹（大小、修改时间和内容哈希）；文件变化或超过有效期后缓存失效。
+
+    只缓存示例代码的成功结果，并且排除结果不只取决于读取的文件的代码：静态检查发现读取当前时间或
+    访问网络的示例不缓存，执行期间修改了文件或访问了网络的结果也不缓存。
+
+    带会话的执行命中缓存时并没有真正执行代码，会话命名空间中缺少这段代码定义的变量，
+    因此记录下来，在该会话下次真正执行前先补执行。
+    """
+
+    def __init__(self, max_entries: int, examples_path: Path = EXAMPLES_PATH, ttl: float = 0):
+        """初始化结果缓存
+
+        Args:
+            max_entries: 最多缓存的结果数，0 表示不缓存
+            examples_path: 示例代码所在的实验数据文件
+            ttl: 缓存结果的有效期（秒），0 表示不过期
+        """
+        self.max_entries = max_entries
+        self.examples_path = examples_path
+        self.ttl = ttl
+        # (代码哈希, 执行模式) -> {"result": 结果, "files": {路径: 内容哈希}, "expires": 过期时间}
+        self._entries: "collections.OrderedDict[Tuple[str, str], Dict[str, Any]]" = collections.OrderedDict()
+        # 文件路径 -> (大小, 修改时间, 内容哈希)，文件未变化时不重新计算哈希
+        self._file_digests: Dict[str, Tuple[int, int, str]] = {}
+        # 会话键 -> {"reset": 补执行前是否重置会话, "codes": 待补执行的代码}
+        self._deferred: "collections.OrderedDict[Hashable, Dict[str, Any]]" = collections.OrderedDict()
+        self._examples: Set[str] = set()
+        self._examples_mtime: Optional[int] = None
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._uncacheable = 0
+        self._lock = threading.Lock()
+
+    def _example_hashes(self) -> Set[str]:
+        """可缓存的示例代码的哈希集合，实验数据文件修改后重新加载"""
+        try:
+            mtime = os.stat(self.examples_path).st_mtime_ns
+        except OSError:
+            return self._examples
+        if mtime != self._examples_mtime:
+            hashes = set()
+            try:
+                with open(self.examples_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for experiment in data.get("experiments", []):
+                    for step in experiment.get("steps", []):
+                        code = step.get("example_code") or ""
+                        digest = code_hash(code)
+                        if digest is not None and is_deterministic(code):
+                            hashes.add(digest)
+            except (OSError, ValueError):
+                return self._examples
+            self._examples, self._examples_mtime = hashes, mtime
+        return self._examples
+
+    def _key(self, code: str, mode: str) -> Optional[Tuple[str, str]]:
+        if not self.max_entries:
+            return None
+        digest = code_hash(code)
+        if digest is None or digest not in self._example_hashes():
+            return None
+        return digest, mode
+
+    def _file_digest(self, path: str) -> Optional[str]:
+        """文件的内容哈希，大小和修改时间未变时直接使用上次的结果"""
+        try:
+            stat = os.stat(path)
+            cached = self._file_digests.get(path)
+            if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                return cached[2]
+            digest = _hash_file(path)
+        except OSError:
+            self._file_digests.pop(path, None)
+            return None
+        self._file_digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def get(self, code: str, mode: str = "all") -> Optional[Dict[str, Any]]:
+        """查找缓存的执行结果
+
+        Args:
+            code: 待执行的代码
+            mode: 执行模式（"all" 普通执行 / "stream" 流式执行），两种模式的图表不同
+
+        Returns:
+            包含 output、charts、success 的字典，未命中时返回 None
+        """
+        key = self._key(code, mode)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            # 已过期、读取的文件有变化，或图表已被图表缓存淘汰
+            if (entry["expires"] is not None and time.monotonic() >= entry["expires"]
+                    or any(self._file_digest(path) != digest for path, digest in entry["files"].items())
+                    or any(chart_id not in chart_store for chart_id in entry["result"]["charts"])):
+                del self._entries[key]
+                self._invalidations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            result = entry["result"]
+        return {"output": result["output"], "charts": list(result["charts"]), "success": True}
+
+    def put(self, code: str, result: Dict[str, Any], data_files: List[str], mode: str = "all",
+            side_effects: Sequence[str] = ()):
+        """缓存一次成功的执行结果
+
+        Args:
+            code: 执行的代码
+            result: 执行结果，charts 为图表ID列表
+            data_files: 执行期间读取的文件
+            mode: 执行模式，见 :meth:`get`
+            side_effects: 执行期间修改的文件和网络访问，不为空时不缓存
+        """
+        if not result.get("success"):
+            return
+        key = self._key(code, mode)
+        if key is None:
+            return
+        with self._lock:
+            if side_effects:
+                self._entries.pop(key, None)
+                self._uncacheable += 1
+                return
+            files = {}
+            for path in data_files:
+                digest = self._file_digest(path)
+                if digest is None:
+                    return
+                files[path] = digest
+            self._entries[key] = {
+                "result": {"output": result["output"], "charts": list(result["charts"])},
+                "files": files,
+                "expires": time.monotonic() + self.ttl if self.ttl else None,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def defer(self, session: Hashable, code: str, reset_session: bool = False):
+        """会话执行命中缓存时，记录这段代码，在会话下次真正执行前补执行"""
+        with self._lock:
+            pending = self._deferred.pop(session, None)
+            if pending is None or reset_session:
+                pending = {"reset": reset_session, "codes": []}
+            pending["codes"] = (pending["codes"] + [code])[-MAX_DEFERRED_CODES:]
+            self._deferred[session] = pending
+            while len(self._deferred) > MAX_DEFERRED_SESSIONS:
+                self._deferred.popitem(last=False)
+
+    def take_deferred(self, session: Optional[Hashable],
+                      reset_session: bool = False) -> Tuple[bool, List[str]]:
+        """取出会话待补执行的代码
+
+        Args:
+            session: 会话键
+            reset_session: 本次执行是否要求重置会话（此时无需补执行）
+
+        Returns:
+            (是否重置会话, 执行前需要先补执行的代码)
+        """
+        if session is None:
+            return reset_session, []
+        with self._lock:
+            pending = self._deferred.pop(session, None)
+        if pending is None or reset_session:
+            return reset_session, []
+        return pending["reset"], pending["codes"]
+
+    async def record_stream(self, code: str,
+                            events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """原样转发流式执行事件，执行成功时缓存其结果"""
+        output: List[str] = []
+        size = 0
+        charts: List[str] = []
+        async for event in events:
+            kind = event.get("type")
+            if kind in ("stdout", "stderr"):
+                size += len(event["data"])
+                if size <= MAX_CACHED_OUTPUT_CHARS:
+                    output.append(event["data"])
+            elif kind == "chart":
+                charts.append(event["id"])
+            elif kind == "done":
+                data_files = event.pop("data_files", [])
+                side_effects = event.pop("side_effects", [])
+                if size <= MAX_CACHED_OUTPUT_CHARS:
+                    self.put(code, {"output": "".join(output), "charts": charts,
+                                    "success": event["success"]}, data_files, mode="stream",
+                             side_effects=side_effects)
+            yield event
+
+    @staticmethod
+    async def replay(result: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """把缓存的结果转换为流式执行事件"""
+        if result["output"]:
+            yield {"type": "stdout", "data": result["output"]}
+        for chart_id in result["charts"]:
+            yield {"type": "chart", "id": chart_id}
+        yield {"type": "done", "success": result["success"]}
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "uncacheable": self._uncacheable,
+                "deferred_sessions": len(self._deferred),
+            }
+
+
+# 创建结果缓存实例
+result_cache = ExecutionResultCache(settings.RESULT_CACHE_ENTRIES, ttl=settings.RESULT_CACHE_TTL)
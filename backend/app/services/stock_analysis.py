@@ -1,11 +1,19 @@
 import pandas as pd
 import numpy as np
-import talib
 import requests
 import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor
+from scipy.optimize import minimize
 from typing import Dict, List, Optional, Any, Union
 
+from app.core.config import settings
+from .indicator_engine import compute_indicators, indicator_engine
+from .ohlcv_store import OHLCVStore
+
+# 模拟行情的起始日期，更早的日期没有数据
+MOCK_ORIGIN = "1990-01-01"
+
 class StockAnalysisService:
     """股票分析服务，提供数据获取和技术指标计算"""
     
@@ -17,14 +25,19 @@ class StockAnalysisService:
         """
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
+        # 按股票代码保存的行情，首次访问时导入旧版按查询缓存的文件
+        self.ohlcv_store = OHLCVStore(
+            os.path.join(data_dir, "ohlcv"), legacy_dir=data_dir, max_workers=settings.OHLCV_LOAD_WORKERS
+        )
     
-    def get_stock_data(self, symbol: str, start_date: str, end_date: str = None) -> pd.DataFrame:
+    def get_stock_data(self, symbol: str, start_date: str, end_date: str = None, copy: bool = False) -> pd.DataFrame:
         """从网络获取股票数据或从本地缓存读取
         
         Args:
             symbol: 股票代码，如 '600000.SH'
             start_date: 开始日期，如 '2020-01-01'
             end_date: 结束日期，如 '2020-12-31'，默认为今天
+            copy: 是否返回可原地修改的副本，默认返回只读的共享数据
             
         Returns:
             股票数据 DataFrame，包含 OHLCV 数据
@@ -33,25 +46,27 @@ class StockAnalysisService:
         if end_date is None:
             end_date = datetime.datetime.now().strftime('%Y-%m-%d')
             
-        # 构建缓存文件路径
-        cache_file = os.path.join(self.data_dir, f"{symbol}_{start_date}_{end_date}.csv")
-        
-        # 如果缓存文件存在，直接读取
-        if os.path.exists(cache_file):
-            return pd.read_csv(cache_file, index_col=0, parse_dates=True)
-        
-        # 否则从网络获取数据
+        # 只从网络获取本地没有的日期，与已保存的数据合并
         # 这里使用模拟数据，实际项目中可以连接真实API
-        df = self._mock_stock_data(symbol, start_date, end_date)
-        
-        # 保存到缓存
-        df.to_csv(cache_file)
+        return self.ohlcv_store.get(symbol, start_date, end_date, self._mock_stock_data, copy=copy)
+    
+    def get_stocks_data(self, symbols: List[str], start_date: str, end_date: str = None,
+                        copy: bool = False) -> Dict[str, pd.DataFrame]:
+        """并行获取多只股票的数据，参数同 get_stock_data
         
-        return df
+        Returns:
+            股票代码 -> 股票数据 DataFrame
+        """
+        if end_date is None:
+            end_date = datetime.datetime.now().strftime('%Y-%m-%d')
+        return self.ohlcv_store.get_many(symbols, start_date, end_date, self._mock_stock_data, copy=copy)
     
     def _mock_stock_data(self, symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
         """生成模拟股票数据，用于演示和测试
         
+        与真实行情一样，同一日期的数据与查询的日期范围无关：价格从 MOCK_ORIGIN 开始生成后截取所需区间，
+        分段获取的数据可以直接拼接
+        
         Args:
             symbol: 股票代码
             start_date: 开始日期
@@ -61,24 +76,27 @@ class StockAnalysisService:
             模拟的股票数据 DataFrame
         """
         # 生成日期范围
-        start = pd.to_datetime(start_date)
+        start = max(pd.to_datetime(start_date), pd.Timestamp(MOCK_ORIGIN))
         end = pd.to_datetime(end_date)
-        dates = pd.date_range(start=start, end=end, freq='B')
+        dates = pd.date_range(start=MOCK_ORIGIN, end=end, freq='D')
+        # 工作日，与 freq='B' 相同，但不用逐日生成
+        dates = dates[dates.dayofweek < 5]
         
-        # 生成随机数据
-        np.random.seed(42)  # 设置随机种子，使结果可复现
+        # 生成随机数据，每个序列使用独立的随机数生成器（固定种子，使结果可复现），
+        # 第 i 天的数据只取决于种子，与生成的天数无关
+        rngs = [np.random.RandomState(42 + i) for i in range(5)]
         n = len(dates)
         
         # 模拟价格走势
-        close = np.random.randn(n).cumsum() + 100
+        close = rngs[0].randn(n).cumsum() + 100
         # 确保价格为正
         close = np.maximum(close, 1)
         
         # 生成其他价格数据
-        high = close * (1 + np.random.rand(n) * 0.03)
-        low = close * (1 - np.random.rand(n) * 0.03)
-        open_price = low + np.random.rand(n) * (high - low)
-        volume = np.random.randint(1000, 1000000, size=n)
+        high = close * (1 + rngs[1].rand(n) * 0.03)
+        low = close * (1 - rngs[2].rand(n) * 0.03)
+        open_price = low + rngs[3].rand(n) * (high - low)
+        volume = rngs[4].randint(1000, 1000000, size=n)
         
         # 创建 DataFrame
         df = pd.DataFrame({
@@ -89,57 +107,38 @@ class StockAnalysisService:
             'volume': volume
         }, index=dates)
         
-        return df
+        return df.loc[start:end]
     
-    def calculate_technical_indicators(self, data: pd.DataFrame) -> pd.DataFrame:
+    def calculate_technical_indicators(self, data: pd.DataFrame, indicators: Optional[List[str]] = None) -> pd.DataFrame:
         """计算常用技术指标
         
+        可选的指标见 indicator_engine.INDICATORS：MA5/MA10/MA20/MA60、EMA12/EMA26、MACD、RSI14、
+        BOLL（布林带）、KDJ、ATR、OBV
+        
         Args:
             data: 股票OHLCV数据
+            indicators: 要计算的指标名称，默认全部
             
         Returns:
             添加了技术指标的DataFrame
         """
-        df = data.copy()
-        
-        # 移动平均线 - 趋势类指标
-        df['MA5'] = talib.MA(df['close'], timeperiod=5)
-        df['MA10'] = talib.MA(df['close'], timeperiod=10)
-        df['MA20'] = talib.MA(df['close'], timeperiod=20)
-        df['MA60'] = talib.MA(df['close'], timeperiod=60)
-        
-        # 指数移动平均线
-        df['EMA12'] = talib.EMA(df['close'], timeperiod=12)
-        df['EMA26'] = talib.EMA(df['close'], timeperiod=26)
-        
-        # MACD - 趋势类指标
-        df['MACD'], df['MACD_signal'], df['MACD_hist'] = talib.MACD(
-            df['close'], fastperiod=12, slowperiod=26, signalperiod=9
-        )
-        
-        # RSI - 摆动类指标
-        df['RSI14'] = talib.RSI(df['close'], timeperiod=14)
-        
-        # 布林带 - 通道类指标
-        df['BOLL_upper'], df['BOLL_middle'], df['BOLL_lower'] = talib.BBANDS(
-            df['close'], timeperiod=20, nbdevup=2, nbdevdn=2, matype=0
-        )
-        
-        # KDJ指标
-        df['K'], df['D'] = talib.STOCH(
-            df['high'], df['low'], df['close'],
-            fastk_period=9, slowk_period=3, slowk_matype=0,
-            slowd_period=3, slowd_matype=0
-        )
-        df['J'] = 3 * df['K'] - 2 * df['D']
-        
-        # ATR - 波动性指标
-        df['ATR'] = talib.ATR(df['high'], df['low'], df['close'], timeperiod=14)
-        
-        # OBV - 成交量指标
-        df['OBV'] = talib.OBV(df['close'], df['volume'])
+        return compute_indicators(data, indicators)
+    
+    def get_stock_indicators(self, symbol: str, start_date: str, end_date: str = None,
+                             indicators: Optional[List[str]] = None) -> pd.DataFrame:
+        """获取股票数据及其技术指标，结果按（股票代码、开始日期、指标集合）缓存，新增的 K 线增量计算
         
-        return df
+        Args:
+            symbol: 股票代码
+            start_date: 开始日期
+            end_date: 结束日期，默认为今天
+            indicators: 要计算的指标名称，默认全部
+            
+        Returns:
+            添加了技术指标的只读DataFrame
+        """
+        data = self.get_stock_data(symbol, start_date, end_date)
+        return indicator_engine.get((symbol, pd.Timestamp(start_date).normalize()), data, indicators)
     
     def calculate_basic_stats(self, data: pd.DataFrame) -> Dict[str, float]:
         """计算基本统计量
@@ -169,15 +168,67 @@ class StockAnalysisService:
         
         return stats
     
-    def portfolio_optimization(self, stock_data: Dict[str, pd.DataFrame], risk_free_rate: float = 0.03) -> Dict[str, Any]:
-        """投资组合优化 - 马科维茨模型和夏普比率优化
+    def get_stocks_indicators(self, symbols: List[str], start_date: str, end_date: str = None,
+                              indicators: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+        """获取多只股票的数据及其技术指标，参数同 get_stock_indicators
+        
+        行情一次并行加载，各股票的指标在线程池中计算（TA-Lib 计算时释放 GIL），结果同样按股票缓存
+        
+        Returns:
+            股票代码 -> 添加了技术指标的只读DataFrame
+        """
+        stock_data = self.get_stocks_data(symbols, start_date, end_date)
+        start = pd.Timestamp(start_date).normalize()
+        if len(stock_data) <= 1:
+            return {symbol: indicator_engine.get((symbol, start), data, indicators)
+                    for symbol, data in stock_data.items()}
+        with ThreadPoolExecutor(max_workers=min(settings.OHLCV_LOAD_WORKERS, len(stock_data))) as executor:
+            frames = executor.map(lambda item: indicator_engine.get((item[0], start), item[1], indicators),
+                                  stock_data.items())
+            return dict(zip(stock_data, frames))
+    
+    def calculate_basic_stats_batch(self, stock_data: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, float]]:
+        """计算多只股票的基本统计量，结果与对每只股票调用 calculate_basic_stats 相同
+        
+        各股票的日收益率按日期对齐为一个面板（日期 × 股票），每个统计量对所有股票一次计算
         
         Args:
             stock_data: 股票数据字典，键为股票代码，值为DataFrame
-            risk_free_rate: 无风险利率，默认为3%
             
         Returns:
-            包含优化结果的字典
+            股票代码 -> 包含基本统计量的字典
+        """
+        # 各股票先在自己的交易日上计算收益率，再对齐；对齐产生的缺失值不参与统计
+        returns = pd.DataFrame({symbol: data['close'].pct_change().iloc[1:] for symbol, data in stock_data.items()})
+        
+        count = returns.count()
+        mean = returns.mean()
+        std = returns.std()
+        annualized_return = mean * 252
+        annualized_volatility = std * np.sqrt(252)
+        
+        panel = pd.DataFrame({
+            'mean': mean,
+            'median': returns.median(),
+            'std': std,
+            'min': returns.min(),
+            'max': returns.max(),
+            'skew': returns.skew(),
+            'kurtosis': returns.kurt(),
+            'annualized_return': annualized_return,
+            'annualized_volatility': annualized_volatility,
+            'sharpe_ratio': (annualized_return / annualized_volatility).where(std > 0, 0),
+            'positive_days': (returns > 0).sum() / count,
+            'negative_days': (returns < 0).sum() / count,
+        })
+        
+        return {symbol: {name: float(value) for name, value in row.items()} for symbol, row in panel.iterrows()}
+    
+    def _annualized_moments(self, stock_data: Dict[str, pd.DataFrame]):
+        """计算每只股票的年化收益率和年化协方差矩阵
+        
+        Returns:
+            (股票代码列表, 年化收益率数组, 年化协方差矩阵)
         """
         # 计算每只股票的日收益率
         returns_dict = {}
@@ -188,65 +239,177 @@ class StockAnalysisService:
         returns = pd.DataFrame(returns_dict)
         
         # 计算年化收益率和协方差矩阵
-        annual_returns = returns.mean() * 252
-        cov_matrix = returns.cov() * 252
-        
-        # 生成随机投资组合
-        num_portfolios = 10000
-        results = np.zeros((3, num_portfolios))
-        weights_record = []
-        
-        for i in range(num_portfolios):
-            # 生成随机权重
-            weights = np.random.random(len(returns.columns))
-            weights /= np.sum(weights)
-            weights_record.append(weights)
+        return list(returns.columns), (returns.mean() * 252).to_numpy(), (returns.cov() * 252).to_numpy()
+    
+    def portfolio_optimization(self, stock_data: Dict[str, pd.DataFrame], risk_free_rate: float = 0.03,
+                               num_portfolios: int = 10000, chunk_size: int = 100000,
+                               frontier_points: int = 10000) -> Dict[str, Any]:
+        """投资组合优化 - 马科维茨模型和夏普比率优化
+        
+        用蒙特卡洛方法生成随机权重的投资组合。每次生成一个权重矩阵（每行一个组合），用矩阵运算
+        一次算出所有组合的收益率、波动率和夏普比率；组合数较多时分块计算，内存占用与组合总数无关。
+        
+        Args:
+            stock_data: 股票数据字典，键为股票代码，值为DataFrame
+            risk_free_rate: 无风险利率，默认为3%
+            num_portfolios: 随机投资组合数，默认为10000
+            chunk_size: 每块计算的投资组合数
+            frontier_points: 有效前沿最多返回的点数，组合数更多时等间隔抽样
+            
+        Returns:
+            包含优化结果的字典
+        """
+        symbols, annual_returns, cov_matrix = self._annualized_moments(stock_data)
+        
+        # 有效前沿每隔 stride 个组合取一个点
+        stride = -(-num_portfolios // max(frontier_points, 1))
+        frontier = []
+        max_sharpe = min_vol = None
+        
+        for offset in range(0, num_portfolios, chunk_size):
+            # 生成随机权重，每行一个投资组合
+            weights = np.random.random((min(chunk_size, num_portfolios - offset), len(symbols)))
+            weights /= weights.sum(axis=1, keepdims=True)
             
-            # 计算组合收益率和风险
-            portfolio_return = np.sum(weights * annual_returns)
-            portfolio_std_dev = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
+            # 计算组合收益率和风险：w·μ 和 sqrt(wᵀΣw)
+            portfolio_returns = weights @ annual_returns
+            portfolio_std_devs = np.sqrt(np.einsum('ij,ij->i', weights @ cov_matrix, weights))
             
             # 计算夏普比率
-            sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_std_dev
+            sharpe_ratios = (portfolio_returns - risk_free_rate) / portfolio_std_devs
+            results = np.vstack([portfolio_returns, portfolio_std_devs, sharpe_ratios])
             
-            # 记录结果
-            results[0, i] = portfolio_return
-            results[1, i] = portfolio_std_dev
-            results[2, i] = sharpe_ratio
-        
-        # 找到最优组合（最高夏普比率）
-        max_sharpe_idx = np.argmax(results[2])
-        max_sharpe_weights = weights_record[max_sharpe_idx]
-        max_sharpe_return = results[0, max_sharpe_idx]
-        max_sharpe_std_dev = results[1, max_sharpe_idx]
-        max_sharpe_ratio = results[2, max_sharpe_idx]
-        
-        # 找到最小方差组合
-        min_vol_idx = np.argmin(results[1])
-        min_vol_weights = weights_record[min_vol_idx]
-        min_vol_return = results[0, min_vol_idx]
-        min_vol_std_dev = results[1, min_vol_idx]
-        min_vol_sharpe = results[2, min_vol_idx]
+            # 记录本块中的最优组合（最高夏普比率）和最小方差组合
+            i = np.argmax(sharpe_ratios)
+            if max_sharpe is None or sharpe_ratios[i] > max_sharpe[1][2]:
+                max_sharpe = (weights[i], results[:, i])
+            i = np.argmin(portfolio_std_devs)
+            if min_vol is None or portfolio_std_devs[i] < min_vol[1][1]:
+                min_vol = (weights[i], results[:, i])
+            
+            frontier.append(results[:, (-offset) % stride::stride])
+        
+        frontier = np.hstack(frontier)
+        max_sharpe_weights, (max_sharpe_return, max_sharpe_std_dev, max_sharpe_ratio) = max_sharpe
+        min_vol_weights, (min_vol_return, min_vol_std_dev, min_vol_sharpe) = min_vol
         
         # 构建有效前沿
         return {
-            'symbols': list(returns.columns),
+            'symbols': symbols,
+            'num_portfolios': num_portfolios,
             'max_sharpe': {
-                'weights': dict(zip(returns.columns, max_sharpe_weights)),
-                'return': max_sharpe_return,
-                'volatility': max_sharpe_std_dev,
-                'sharpe_ratio': max_sharpe_ratio
+                'weights': dict(zip(symbols, max_sharpe_weights.tolist())),
+                'return': float(max_sharpe_return),
+                'volatility': float(max_sharpe_std_dev),
+                'sharpe_ratio': float(max_sharpe_ratio)
             },
             'min_volatility': {
-                'weights': dict(zip(returns.columns, min_vol_weights)),
-                'return': min_vol_return,
-                'volatility': min_vol_std_dev,
-                'sharpe_ratio': min_vol_sharpe
+                'weights': dict(zip(symbols, min_vol_weights.tolist())),
+                'return': float(min_vol_return),
+                'volatility': float(min_vol_std_dev),
+                'sharpe_ratio': float(min_vol_sharpe)
             },
             'efficient_frontier': {
-                'returns': results[0, :].tolist(),
-                'volatilities': results[1, :].tolist(),
-                'sharpe_ratios': results[2, :].tolist()
+                'returns': frontier[0].tolist(),
+                'volatilities': frontier[1].tolist(),
+                'sharpe_ratios': frontier[2].tolist()
+            }
+        }
+
+    def efficient_frontier(self, stock_data: Dict[str, pd.DataFrame], risk_free_rate: float = 0.03,
+                           num_points: int = 50, min_weight: float = 0.0, max_weight: float = 1.0) -> Dict[str, Any]:
+        """投资组合优化 - 用二次规划求解马科维茨有效前沿
+        
+        直接求解最小方差组合、最大夏普比率组合（切点组合），以及在最小方差组合收益率和可达到的最高
+        收益率之间均匀取 num_points 个目标收益率时的最小方差组合。每个前沿点以上一个点的权重作为
+        初始值，求解只需少量迭代。结果与 portfolio_optimization 的格式相同，前沿上另外返回各点的权重。
+        
+        Args:
+            stock_data: 股票数据字典，键为股票代码，值为DataFrame
+            risk_free_rate: 无风险利率，默认为3%
+            num_points: 有效前沿的点数，默认为50
+            min_weight: 单只股票的最小权重，默认为0（不允许卖空）
+            max_weight: 单只股票的最大权重，默认为1
+            
+        Returns:
+            包含优化结果的字典
+            
+        Raises:
+            ValueError: 权重范围无法满足权重之和为 1，或求解失败
+        """
+        symbols, annual_returns, cov_matrix = self._annualized_moments(stock_data)
+        n = len(symbols)
+        if min_weight > max_weight or min_weight * n > 1 + 1e-9 or max_weight * n < 1 - 1e-9:
+            raise ValueError(f"权重范围 [{min_weight}, {max_weight}] 内 {n} 只股票的权重之和无法为 1")
+        bounds = [(min_weight, max_weight)] * n
+        budget = {'type': 'eq', 'fun': lambda w: w.sum() - 1, 'jac': lambda w: np.ones(n)}
+        # 收益率序列相同或线性相关时协方差矩阵奇异，求解时在对角线上加一个很小的值使最优解唯一
+        ridge = 1e-8 * max(float(np.trace(cov_matrix)) / n, 1e-12)
+        solver_cov = cov_matrix + ridge * np.eye(n)
+        
+        def variance(w):
+            # 组合方差 wᵀΣw 及其梯度
+            cov_w = solver_cov @ w
+            return w @ cov_w, 2 * cov_w
+        
+        def negative_sharpe(w):
+            # 负夏普比率及其梯度
+            excess = w @ annual_returns - risk_free_rate
+            cov_w = solver_cov @ w
+            volatility = np.sqrt(w @ cov_w)
+            return -excess / volatility, -(annual_returns * volatility - excess * cov_w / volatility) / volatility ** 2
+        
+        def solve(objective, initial, constraints):
+            result = minimize(objective, initial, jac=True, method='SLSQP', bounds=bounds,
+                              constraints=constraints, options={'ftol': 1e-12, 'maxiter': 500})
+            if not result.success:
+                raise ValueError(f"投资组合优化求解失败: {result.message}")
+            return np.clip(result.x, min_weight, max_weight)
+        
+        def summary(w):
+            portfolio_return = float(w @ annual_returns)
+            portfolio_std_dev = float(np.sqrt(w @ cov_matrix @ w))
+            return {
+                'weights': dict(zip(symbols, w.tolist())),
+                'return': portfolio_return,
+                'volatility': portfolio_std_dev,
+                'sharpe_ratio': (portfolio_return - risk_free_rate) / portfolio_std_dev
+            }
+        
+        # 最小方差组合和切点组合，从等权组合开始求解
+        min_vol_weights = solve(variance, np.full(n, 1 / n), [budget])
+        max_sharpe_weights = solve(negative_sharpe, min_vol_weights, [budget])
+        
+        # 可达到的最高收益率：所有股票取最小权重后，按收益率从高到低依次补到最大权重
+        highest = np.full(n, float(min_weight))
+        remaining = 1 - highest.sum()
+        for i in np.argsort(-annual_returns):
+            highest[i] += min(max_weight - min_weight, remaining)
+            remaining = 1 - highest.sum()
+        
+        # 逐个目标收益率求解最小方差组合，以上一个点的结果作为初始值
+        frontier = []
+        weights = min_vol_weights
+        lowest_return, highest_return = min_vol_weights @ annual_returns, highest @ annual_returns
+        if highest_return - lowest_return <= 1e-12 * max(1.0, abs(highest_return)):
+            # 各股票收益率相同时目标收益率约束与权重之和约束重复，前沿退化为最小方差组合
+            frontier = [summary(min_vol_weights)] * num_points
+        else:
+            for target in np.linspace(lowest_return, highest_return, num_points):
+                target_return = {'type': 'eq', 'fun': lambda w, t=target: w @ annual_returns - t,
+                                 'jac': lambda w: annual_returns}
+                weights = solve(variance, weights, [budget, target_return])
+                frontier.append(summary(weights))
+        
+        return {
+            'symbols': symbols,
+            'max_sharpe': summary(max_sharpe_weights),
+            'min_volatility': summary(min_vol_weights),
+            'efficient_frontier': {
+                'returns': [point['return'] for point in frontier],
+                'volatilities': [point['volatility'] for point in frontier],
+                'sharpe_ratios': [point['sharpe_ratio'] for point in frontier],
+                'weights': [point['weights'] for point in frontier]
             }
         }
 
@@ -0,0 +1,137 @@
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+from app.core.config import settings
+
+# 运行状态（Hash）和进度事件（Stream）的键
+RUN_KEY = "workflow_run:{}"
+EVENTS_KEY = "workflow_run:{}:events"
+
+# 运行状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class WorkflowRunStore:
+    """异步工作流运行的状态和进度事件
+
+    提交接口创建运行记录并把工作流交给 Celery 执行，HTTP 请求立即返回运行ID。执行工作流的 worker
+    把每个节点的开始和结束事件写入 Redis Stream，同时更新运行状态中的完成计数；查询接口轮询状态，
+    或按事件ID增量读取、订阅事件流。API 进程和任意数量的 worker 通过 Redis 共享这些数据。
+    """
+
+    def __init__(self, redis_client, ttl: int, max_events: int):
+        """初始化运行记录存储
+
+        Args:
+            redis_client: Redis 客户端（decode_responses=True）
+            ttl: 运行记录和事件保留的时间（秒），从最后一次更新算起
+            max_events: 每次运行最多保留的事件数
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_events = max_events
+
+    def create(self, user_id: Any, experiment_id: Any, total_nodes: int) -> str:
+        """创建运行记录，返回运行ID"""
+        run_id = uuid.uuid4().hex
+        key = RUN_KEY.format(run_id)
+        pipe = self.redis_client.pipeline()
+        pipe.hset(key, mapping={
+            "run_id": run_id,
+            "user_id": str(user_id),
+            "experiment_id": str(experiment_id),
+            "status": QUEUED,
+            "total_nodes": total_nodes,
+            "completed_nodes": 0,
+            "cached_nodes": 0,
+            "created_at": time.time(),
+        })
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return run_id
+
+    def start(self, run_id: str):
+        """worker 开始执行"""
+        self._update(run_id, {"status": RUNNING, "started_at": time.time()}, {"type": "run_started"})
+
+    def publish(self, run_id: str, event: Dict[str, Any]):
+        """记录一个节点事件，节点完成时更新完成计数"""
+        pipe = self.redis_client.pipeline()
+        key = RUN_KEY.format(run_id)
+        if event.get("type") == "node_finished":
+            pipe.hincrby(key, "completed_nodes", 1)
+            if event.get("cached"):
+                pipe.hincrby(key, "cached_nodes", 1)
+        self._append(pipe, run_id, event)
+        pipe.execute()
+
+    def finish(self, run_id: str, result: Dict[str, Any]):
+        """保存工作流的执行结果"""
+        status = SUCCEEDED if result.get("success") else FAILED
+        self._update(run_id, {
+            "status": status,
+            "finished_at": time.time(),
+            "result": json.dumps(result, ensure_ascii=False, default=str),
+        }, {"type": "run_finished", "status": status, "success": bool(result.get("success"))})
+
+    def _update(self, run_id: str, fields: Dict[str, Any], event: Dict[str, Any]):
+        pipe = self.redis_client.pipeline()
+        pipe.hset(RUN_KEY.format(run_id), mapping=fields)
+        self._append(pipe, run_id, event)
+        pipe.execute()
+
+    def _append(self, pipe, run_id: str, event: Dict[str, Any]):
+        events_key = EVENTS_KEY.format(run_id)
+        pipe.xadd(events_key, {"event": json.dumps(event, ensure_ascii=False, default=str)},
+                  maxlen=self.max_events, approximate=True)
+        pipe.expire(events_key, self.ttl)
+        pipe.expire(RUN_KEY.format(run_id), self.ttl)
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """获取运行状态，运行不存在或已过期时返回 None"""
+        run = self.redis_client.hgetall(RUN_KEY.format(run_id))
+        if not run:
+            return None
+        for field in ("total_nodes", "completed_nodes", "cached_nodes"):
+            run[field] = int(run.get(field, 0))
+        for field in ("created_at", "started_at", "finished_at"):
+            if field in run:
+                run[field] = float(run[field])
+        if "result" in run:
+            run["result"] = json.loads(run["result"])
+        return run
+
+    def events(self, run_id: str, after: str = "0", count: int = 100,
+               block_ms: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """读取 after 之后的事件
+
+        Args:
+            run_id: 运行ID
+            after: 上次读到的事件ID，"0" 表示从头读取
+            count: 最多返回的事件数
+            block_ms: 没有新事件时最多等待多少毫秒，None 表示不等待
+
+        Returns:
+            [(事件ID, 事件)]
+        """
+        response = self.redis_client.xread({EVENTS_KEY.format(run_id): after or "0"},
+                                           count=count, block=block_ms)
+        if not response:
+            return []
+        return [(event_id, json.loads(fields["event"])) for event_id, fields in response[0][1]]
+
+
+# 创建运行记录存储实例
+workflow_runs = WorkflowRunStore(
+    redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0, decode_responses=True),
+    settings.WORKFLOW_RUN_TTL,
+    settings.WORKFLOW_RUN_MAX_EVENTS,
+)
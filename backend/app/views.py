@@ -32,7 +32,7 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         workflow_engine = WorkflowEngine()
         
         # 异步执行工作流
-        from .tasks import execute_workflow_task
+        from .worker import execute_workflow_task
         task = execute_workflow_task.delay(
             workflow_data, 
             request.user.id, 
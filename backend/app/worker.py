@@ -1,6 +1,56 @@
 # backend/app/worker.py
+import logging
+from typing import Any, Dict, Optional
+
+from celery.signals import worker_process_init
+
 from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.engine import WorkflowEngine
+from app.kernel_manager import get_kernel_manager
+from app.services.workflow_runs import workflow_runs
+
+logger = logging.getLogger(__name__)
+
+@worker_process_init.connect
+def start_kernel_pool(**kwargs):
+    """worker 进程启动时预热内核容器池，第一个工作流节点也不用等待容器启动"""
+    if not settings.WORKFLOW_POOLED_KERNELS:
+        return
+    try:
+        get_kernel_manager().start_pool()
+    except Exception as e:
+        logger.error(f"启动内核预热池失败: {str(e)}")
 
 @celery_app.task(acks_late=True)
 def test_celery(word: str) -> str:
-    return f"test task return {word}"
\ No newline at end of file
+    return f"test task return {word}"
+
+@celery_app.task(acks_late=True)
+def execute_workflow_task(workflow_data: Dict[str, Any], user_id: Any, experiment_id: Any,
+                          run_id: Optional[str] = None, use_cache: bool = True) -> Dict[str, Any]:
+    """执行工作流，节点进度和最终结果写入运行记录
+
+    Args:
+        workflow_data: 工作流定义，包含 nodes 和 edges
+        user_id: 用户ID
+        experiment_id: 实验ID
+        run_id: 提交接口创建的运行ID，未提供时在此创建
+        use_cache: 是否使用缓存的节点输出
+
+    Returns:
+        运行ID和是否成功，完整结果通过运行记录获取
+    """
+    if run_id is None:
+        run_id = workflow_runs.create(user_id, experiment_id, len(workflow_data.get("nodes", [])))
+    workflow_runs.start(run_id)
+    try:
+        result = WorkflowEngine().execute_workflow(
+            workflow_data, user_id, experiment_id,
+            use_cache=use_cache,
+            on_event=lambda event: workflow_runs.publish(run_id, event)
+        )
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    workflow_runs.finish(run_id, result)
+    return {"run_id": run_id, "success": bool(result.get("success"))}
@@ -0,0 +1,243 @@
+import ast
+import json
+import posixpath
+import re
+from typing import Any, Dict, List, Optional
+
+# 所有内核容器挂载同一个 Docker 卷，节点之间通过其中的文件传递数据
+ARTIFACT_ROOT = "/home/jovyan/artifacts"
+
+# 节点执行后内核中保存结果清单的变量，通过执行回复的 user_expressions 取回
+MANIFEST_VAR = "_wf_manifest"
+
+# 节点输出缓存的目录（见 app.workflow_cache），不随工作流结束删除
+CACHE_DIR = "cache"
+
+# 在内核中定义的读写函数。表格保存为 Parquet（Arrow），数组保存为 .npy，
+# 较大的 JSON 值保存为 .json 文件，无法序列化为 JSON 的对象（如模型）使用 pickle。
+# 清单中只包含小的引用：{"__artifact__": 相对路径, "format": 格式, ...}
+# 共享卷对所有内核可写，pickle 文件在清单中记录内容哈希，读取时哈希不一致（被其他人替换）则拒绝反序列化
+KERNEL_HELPERS = '''
+import hashlib as _wf_hashlib
+import json as _wf_json
+import os as _wf_os
+import pickle as _wf_pickle
+import shutil as _wf_shutil
+import time as _wf_time
+
+_WF_ROOT = %(root)r
+
+
+def _wf_default(value):
+    if hasattr(value, "item") and getattr(value, "ndim", None) == 0:
+        return value.item()
+    raise TypeError(type(value).__name__)
+
+
+def _wf_load(value):
+    if isinstance(value, list):
+        return [_wf_load(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    path = value.get("__artifact__")
+    if path is None:
+        return {key: _wf_load(item) for key, item in value.items()}
+    full = _wf_os.path.join(_WF_ROOT, path)
+    fmt = value["format"]
+    if fmt == "parquet":
+        import pandas as _wf_pd
+        frame = _wf_pd.read_parquet(full)
+        if value.get("series"):
+            series = frame.iloc[:, 0]
+            series.name = value.get("name")
+            return series
+        return frame
+    if fmt == "npy":
+        import numpy as _wf_np
+        return _wf_np.load(full, allow_pickle=False)
+    if fmt == "json":
+        with open(full, "r", encoding="utf-8") as f:
+            return _wf_json.load(f)
+    with open(full, "rb") as f:
+        data = f.read()
+    if _wf_hashlib.sha256(data).hexdigest() != value.get("sha256"):
+        raise ValueError("输入文件 %%s 已被修改，拒绝加载" %% path)
+    return _wf_pickle.loads(data)
+
+
+def _wf_pickle_dump(value, path):
+    data = _wf_pickle.dumps(value, protocol=_wf_pickle.HIGHEST_PROTOCOL)
+    with open(path + ".pkl", "wb") as f:
+        f.write(data)
+    return ({"format": "pickle", "type": type(value).__name__, "sha256": _wf_hashlib.sha256(data).hexdigest()},
+            path + ".pkl")
+
+
+def _wf_dump(value, path):
+    import numpy as _wf_np
+    import pandas as _wf_pd
+    if isinstance(value, (_wf_pd.DataFrame, _wf_pd.Series)):
+        is_series = isinstance(value, _wf_pd.Series)
+        frame = value.to_frame(name="value") if is_series else value
+        try:
+            frame.to_parquet(path + ".parquet")
+        except Exception:
+            # 列名不是字符串等 Parquet 不支持的情况
+            return _wf_pickle_dump(value, path)
+        info = {"format": "parquet", "rows": int(len(frame)),
+                "columns": [str(column) for column in frame.columns]}
+        if is_series:
+            info.update(series=True, name=value.name if isinstance(value.name, str) else None)
+        return info, path + ".parquet"
+    if isinstance(value, _wf_np.ndarray) and value.dtype != object:
+        _wf_np.save(path + ".npy", value, allow_pickle=False)
+        return {"format": "npy", "shape": list(value.shape), "dtype": str(value.dtype)}, path + ".npy"
+    return _wf_pickle_dump(value, path)
+
+
+def _wf_store(value, run_dir, name, inline_limit):
+    import numpy as _wf_np
+    import pandas as _wf_pd
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return {key: _wf_store(item, run_dir, "%%s-%%d" %% (name, i), inline_limit)
+                for i, (key, item) in enumerate(value.items())}
+    path = _wf_os.path.join(run_dir, name)
+    if not isinstance(value, (_wf_pd.DataFrame, _wf_pd.Series, _wf_np.ndarray)):
+        try:
+            text = _wf_json.dumps(value, default=_wf_default)
+        except (TypeError, ValueError):
+            info, full = _wf_pickle_dump(value, path)
+        else:
+            if inline_limit is None or len(text) <= inline_limit:
+                return _wf_json.loads(text)
+            with open(path + ".json", "w", encoding="utf-8") as f:
+                f.write(text)
+            info, full = {"format": "json", "bytes": len(text)}, path + ".json"
+    else:
+        info, full = _wf_dump(value, path)
+    info["__artifact__"] = _wf_os.path.relpath(full, _WF_ROOT)
+    info["bytes"] = _wf_os.path.getsize(full)
+    return info
+
+
+def _wf_relocate(value, source, target):
+    if isinstance(value, list):
+        return [_wf_relocate(item, source, target) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__artifact__" in value:
+        return dict(value, __artifact__=target + value["__artifact__"][len(source):])
+    return {key: _wf_relocate(item, source, target) for key, item in value.items()}
+
+
+def _wf_store_result(value, output_dir, node_name, inline_limit, publish_dir=None):
+    full_dir = _wf_os.path.join(_WF_ROOT, output_dir)
+    _wf_os.makedirs(full_dir, exist_ok=True)
+    manifest = _wf_store(value, full_dir, node_name, inline_limit)
+    if publish_dir is not None:
+        # 全部写完后整体改名，目标目录中只会出现完整的输出
+        target = _wf_os.path.join(_WF_ROOT, publish_dir)
+        _wf_os.makedirs(_wf_os.path.dirname(target), exist_ok=True)
+        _wf_os.rename(full_dir, target)
+        manifest = _wf_relocate(manifest, output_dir, publish_dir)
+    return _wf_json.dumps(manifest)
+
+
+def _wf_sweep(directory, ttl, skip=()):
+    if not _wf_os.path.isdir(directory):
+        return
+    cutoff = _wf_time.time() - ttl
+    for entry in _wf_os.scandir(directory):
+        try:
+            if entry.name not in skip and entry.is_dir() and entry.stat().st_mtime < cutoff:
+                _wf_shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _wf_cleanup(run_id, ttl, directories, cache_ttl):
+    for directory in [run_id] + directories:
+        _wf_shutil.rmtree(_wf_os.path.join(_WF_ROOT, directory), ignore_errors=True)
+    # 同时清理异常退出的工作流遗留的目录和各用户过期的节点缓存
+    _wf_sweep(_WF_ROOT, ttl, skip=(%(cache)r,))
+    cache_root = _wf_os.path.join(_WF_ROOT, %(cache)r)
+    if _wf_os.path.isdir(cache_root):
+        for entry in _wf_os.scandir(cache_root):
+            if entry.is_dir():
+                _wf_sweep(entry.path, cache_ttl)
+''' % {"root": ARTIFACT_ROOT, "cache": CACHE_DIR}
+
+
+def safe_name(node_id: Any) -> str:
+    """可以用作文件名的节点ID或用户ID"""
+    return re.sub(r"[^\w.-]", "_", str(node_id))[:64] or "node"
+
+
+def node_code(output_dir: str, node_id: Any, component_code: str, inputs: Dict[Any, Any],
+              inline_limit: Optional[int], publish_dir: Optional[str] = None) -> str:
+    """生成节点的执行代码
+
+    Args:
+        output_dir: 节点产生的文件保存在共享卷中的哪个目录（相对路径），如本次工作流执行的ID下的目录
+        node_id: 节点ID
+        component_code: 组件代码，从 input_data 读取输入，把输出赋给 result
+        inputs: 前驱节点ID -> 前驱节点的结果清单
+        inline_limit: 结果中 JSON 值序列化后不超过多少字符时直接放在清单中，None 表示全部放在清单中
+        publish_dir: 输出全部写完后把 output_dir 改名为该目录（如节点输出缓存的目录），清单引用改名后的路径
+
+    Returns:
+        可以在内核中执行的代码，执行后结果清单保存在 MANIFEST_VAR 中
+    """
+    return f"""{KERNEL_HELPERS}
+# 输入数据（按引用读取前驱节点的输出）
+input_data = _wf_load(_wf_json.loads({json.dumps(json.dumps(inputs))}))
+
+# 组件代码
+{component_code}
+
+# 输出结果
+{MANIFEST_VAR} = _wf_store_result(result, {output_dir!r}, {safe_name(node_id)!r}, {inline_limit!r}, {publish_dir!r})
+"""
+
+
+def cleanup_code(run_id: str, ttl: int, directories: Optional[List[str]] = None,
+                 cache_ttl: Optional[int] = None) -> str:
+    """生成清理共享卷的代码
+
+    Args:
+        run_id: 工作流执行的ID，删除其目录
+        ttl: 删除超过 ttl 秒的遗留目录
+        directories: 其他需要删除的目录，如被淘汰的节点缓存
+        cache_ttl: 删除超过 cache_ttl 秒的节点缓存目录，默认与 ttl 相同
+    """
+    cache_ttl = ttl if cache_ttl is None else cache_ttl
+    return f"{KERNEL_HELPERS}\n_wf_cleanup({run_id!r}, {ttl!r}, {list(directories or [])!r}, {cache_ttl!r})\n"
+
+
+def check_artifacts(manifest: Any, directory: str):
+    """检查结果清单引用的文件都在节点自己的输出目录中
+
+    清单由内核中的代码生成，用户代码可以伪造它来引用共享卷中其他用户的文件
+
+    Raises:
+        ValueError: 引用了输出目录以外的文件
+    """
+    if isinstance(manifest, list):
+        for item in manifest:
+            check_artifacts(item, directory)
+    elif isinstance(manifest, dict):
+        path = manifest.get("__artifact__")
+        if path is None:
+            for item in manifest.values():
+                check_artifacts(item, directory)
+        elif not isinstance(path, str) or not posixpath.normpath(path).startswith(directory.rstrip("/") + "/"):
+            raise ValueError(f"结果引用了输出目录以外的文件: {path}")
+
+
+def parse_manifest(execution_result: Dict[str, Any]) -> Any:
+    """从执行回复的 user_expressions 中取出节点的结果清单"""
+    expression = (execution_result.get("user_expressions") or {}).get(MANIFEST_VAR) or {}
+    if expression.get("status") != "ok":
+        raise ValueError(f"无法读取节点结果: {expression.get('evalue', '缺少结果清单')}")
+    # text/plain 是清单字符串的 repr
+    return json.loads(ast.literal_eval(expression["data"]["text/plain"]))
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.services.result_cache import code_hash
+from app.workflow_artifacts import CACHE_DIR, safe_name
+
+# 条目的结果清单（String，带有效期）
+ENTRY_KEY = "node_cache:entry:{}"
+# 最近使用时间（Sorted Set）、输出文件大小（Hash）、输出目录（Hash）、文件总大小（String），成员为 "用户:缓存键"
+LRU_KEY = "node_cache:lru"
+SIZES_KEY = "node_cache:sizes"
+DIRS_KEY = "node_cache:dirs"
+BYTES_KEY = "node_cache:bytes"
+# 已淘汰、等待删除的目录（List）
+EVICTED_KEY = "node_cache:evicted"
+# 正在使用某个目录的工作流执行（Set），以及某次执行使用的目录（Set）
+PIN_KEY = "node_cache:pin:{}"
+RUN_PINS_KEY = "node_cache:run:{}"
+
+# 删除成员的索引并把它的目录加入待删除列表（KEYS 与下面的脚本相同）
+_REMOVE_LUA = """
+local function remove(member)
+    local size = redis.call('HGET', KEYS[2], member)
+    if size then
+        redis.call('DECRBY', KEYS[4], size)
+    end
+    local directory = redis.call('HGET', KEYS[3], member)
+    if directory then
+        redis.call('RPUSH', KEYS[5], directory)
+    end
+    redis.call('HDEL', KEYS[2], member)
+    redis.call('HDEL', KEYS[3], member)
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('DEL', ARGV[1] .. member)
+end
+"""
+
+# 写入条目，替换同一键的旧条目，再按最近最少使用淘汰到条目数和文件总大小都不超过上限
+# KEYS: LRU, 大小, 目录, 总大小, 待删除; ARGV: 条目键前缀, 成员, 清单, 目录, 大小, 时间, 有效期, 最大条目数, 最大总大小
+_PUT_SCRIPT = _REMOVE_LUA + """
+-- 同一目录重复写入时不删除目录
+if redis.call('HGET', KEYS[3], ARGV[2]) == ARGV[4] then
+    redis.call('HDEL', KEYS[3], ARGV[2])
+end
+remove(ARGV[2])
+redis.call('SET', ARGV[1] .. ARGV[2], ARGV[3], 'EX', ARGV[7])
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[5])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[4])
+redis.call('INCRBY', KEYS[4], ARGV[5])
+redis.call('ZADD', KEYS[1], ARGV[6], ARGV[2])
+while redis.call('ZCARD', KEYS[1]) > 1 and (redis.call('ZCARD', KEYS[1]) > tonumber(ARGV[8])
+        or tonumber(redis.call('GET', KEYS[4]) or '0') > tonumber(ARGV[9])) do
+    remove(redis.call('ZRANGE', KEYS[1], 0, 0)[1])
+end
+"""
+
+# 删除条目；ARGV: 条目键前缀, 成员
+_REMOVE_SCRIPT = _REMOVE_LUA + """
+remove(ARGV[2])
+"""
+
+
+def node_key(code: str, upstream: Iterable[Tuple[Any, str]], user_id: Any = None) -> str:
+    """节点输出的缓存键
+
+    由用户、节点代码（规范化后忽略注释和格式）和各前驱节点的缓存键计算，前驱的键又包含了它自己的
+    代码和上游，因此任何上游节点的修改都会改变所有下游节点的键。不同用户的相同代码使用不同的键。
+
+    Args:
+        code: 节点代码
+        upstream: (前驱节点ID, 前驱节点的缓存键)
+        user_id: 用户ID
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(str(user_id)).encode("utf-8"))
+    digest.update((code_hash(code) or hashlib.sha256(code.encode("utf-8")).hexdigest()).encode("ascii"))
+    for pred, key in sorted(upstream, key=lambda item: str(item[0])):
+        digest.update(json.dumps([str(pred), key]).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def artifact_bytes(manifest: Any) -> int:
+    """结果清单引用的文件总大小"""
+    if isinstance(manifest, list):
+        return sum(artifact_bytes(item) for item in manifest)
+    if not isinstance(manifest, dict):
+        return 0
+    if "__artifact__" in manifest:
+        return int(manifest.get("bytes", 0))
+    return sum(artifact_bytes(item) for item in manifest.values())
+
+
+class NodeOutputCache:
+    """工作流节点输出的缓存
+
+    学生修改工作流中的一个节点后重新运行时，未修改且上游也未修改的节点直接使用上次的输出，
+    只执行修改的节点及其下游。输出文件保存在共享卷中该用户的 cache/u<用户>/<键>.<执行ID> 目录：
+    节点先写入本次执行的临时目录，写完后整体改名，缓存目录中只会出现完整的输出，
+    同一个键的并发写入也各自使用不同的目录。
+
+    结果清单、最近使用时间、文件大小和目录保存在 Redis 中，所有进程共享同一份索引和淘汰顺序。
+    条目按最近最少使用淘汰，被淘汰条目的目录在某个工作流结束时由内核删除；
+    工作流执行期间使用的目录会被标记，标记解除（或过期）前不删除。
+    共享卷中的缓存目录超过 ttl 后由内核清理，条目从写入起超过 ttl 也随之失效。
+    """
+
+    def __init__(self, redis_client, max_entries: int, max_bytes: int, ttl: float, pin_ttl: float = 3600):
+        """初始化节点输出缓存
+
+        Args:
+            redis_client: Redis 客户端（decode_responses=True）
+            max_entries: 最多缓存的节点数，0 表示不缓存
+            max_bytes: 缓存的输出文件总大小上限（字节）
+            ttl: 条目的有效期（秒）
+            pin_ttl: 目录使用标记的有效期（秒），工作流异常退出时标记在此之后失效
+        """
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.pin_ttl = pin_ttl
+        self._put_script = redis_client.register_script(_PUT_SCRIPT)
+        self._remove_script = redis_client.register_script(_REMOVE_SCRIPT)
+        self._keys = [LRU_KEY, SIZES_KEY, DIRS_KEY, BYTES_KEY, EVICTED_KEY]
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _member(user_id: Any, key: str) -> str:
+        return f"{user_id}:{key}"
+
+    @staticmethod
+    def namespace(user_id: Any) -> str:
+        """用户的缓存目录（相对共享卷）"""
+        return f"{CACHE_DIR}/u{safe_name(user_id)}"
+
+    def directory(self, user_id: Any, key: str, run_id: str) -> str:
+        """某次执行写入的缓存输出目录（相对共享卷）"""
+        return f"{self.namespace(user_id)}/{key}.{run_id}"
+
+    def get(self, user_id: Any, key: str, run_id: Optional[str] = None) -> Optional[Any]:
+        """查找用户的节点结果清单，未命中或已过期时返回 None
+
+        Args:
+            user_id: 用户ID
+            key: 缓存键
+            run_id: 工作流执行的ID，命中时标记本次执行正在使用该目录
+        """
+        member = self._member(user_id, key)
+        pipe = self.redis_client.pipeline()
+        pipe.get(ENTRY_KEY.format(member))
+        pipe.hget(DIRS_KEY, member)
+        value, directory = pipe.execute()
+        if value is None:
+            if directory is not None:
+                # 已过期，删除索引，目录等待删除
+                self._remove_script(keys=self._keys, args=[ENTRY_KEY.format(""), member])
+            with self._lock:
+                self._misses += 1
+            return None
+        if run_id is not None and directory is not None:
+            self._pin(run_id, directory)
+        self.redis_client.zadd(LRU_KEY, {member: time.time()}, xx=True)
+        with self._lock:
+            self._hits += 1
+        return json.loads(value)
+
+    def put(self, user_id: Any, key: str, manifest: Any, directory: str, run_id: Optional[str] = None):
+        """缓存节点的结果清单
+
+        Args:
+            user_id: 用户ID
+            key: 缓存键
+            manifest: 结果清单
+            directory: 输出文件所在的目录，见 :meth:`directory`
+            run_id: 工作流执行的ID，标记本次执行正在使用该目录，避免被其他进程淘汰后立即删除
+        """
+        if run_id is not None:
+            self._pin(run_id, directory)
+        self._put_script(keys=self._keys, args=[
+            ENTRY_KEY.format(""), self._member(user_id, key), json.dumps(manifest), directory,
+            artifact_bytes(manifest), time.time(), max(1, int(self.ttl)), self.max_entries, self.max_bytes,
+        ])
+
+    def invalidate(self, user_id: Any, key: str):
+        """删除条目（如输出文件已不可读）"""
+        self._remove_script(keys=self._keys, args=[ENTRY_KEY.format(""), self._member(user_id, key)])
+
+    def _pin(self, run_id: str, directory: str):
+        pipe = self.redis_client.pipeline()
+        pipe.sadd(PIN_KEY.format(directory), run_id)
+        pipe.expire(PIN_KEY.format(directory), int(self.pin_ttl))
+        pipe.sadd(RUN_PINS_KEY.format(run_id), directory)
+        pipe.expire(RUN_PINS_KEY.format(run_id), int(self.pin_ttl))
+        pipe.execute()
+
+    def unpin(self, run_id: str):
+        """工作流结束，解除本次执行对目录的使用标记"""
+        directories = self.redis_client.smembers(RUN_PINS_KEY.format(run_id))
+        pipe = self.redis_client.pipeline()
+        for directory in directories:
+            pipe.srem(PIN_KEY.format(directory), run_id)
+        pipe.delete(RUN_PINS_KEY.format(run_id))
+        pipe.execute()
+
+    def take_evicted(self, limit: int = 100) -> List[str]:
+        """取出待删除的目录，仍被其他工作流使用的目录放回"""
+        pipe = self.redis_client.pipeline()
+        pipe.lrange(EVICTED_KEY, 0, limit - 1)
+        pipe.ltrim(EVICTED_KEY, limit, -1)
+        directories = list(dict.fromkeys(pipe.execute()[0]))
+        if not directories:
+            return []
+        pipe = self.redis_client.pipeline()
+        for directory in directories:
+            pipe.exists(PIN_KEY.format(directory))
+        pinned = pipe.execute()
+        in_use = [d for d, is_pinned in zip(directories, pinned) if is_pinned]
+        if in_use:
+            self.restore_evicted(in_use)
+        return [d for d, is_pinned in zip(directories, pinned) if not is_pinned]
+
+    def restore_evicted(self, directories: List[str]):
+        """删除失败时放回，下次再试"""
+        if directories:
+            self.redis_client.rpush(EVICTED_KEY, *directories)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计（命中次数为本进程的统计）"""
+        pipe = self.redis_client.pipeline()
+        pipe.zcard(LRU_KEY)
+        pipe.get(BYTES_KEY)
+        pipe.llen(EVICTED_KEY)
+        entries, total_bytes, pending = pipe.execute()
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": entries,
+                "total_bytes": int(total_bytes or 0),
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 3) if total else None,
+                "pending_evictions": pending,
+            }
+
+
+# 创建节点输出缓存实例
+node_output_cache = NodeOutputCache(
+    redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0, decode_responses=True),
+    settings.WORKFLOW_NODE_CACHE_ENTRIES,
+    settings.WORKFLOW_NODE_CACHE_MB * 1024 * 1024,
+    settings.WORKFLOW_NODE_CACHE_TTL,
+    settings.WORKFLOW_ARTIFACT_TTL,
+)
@@ -0,0 +1,13 @@
+import os
+
+# 在导入 app 之前设置：Celery 任务在测试进程中同步执行
+os.environ.setdefault("CELERY_TASK_ALWAYS_EAGER", "true")
+
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def redis_client():
+    """每个测试使用独立的内存 Redis"""
+    return fakeredis.FakeStrictRedis()
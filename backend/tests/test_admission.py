@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from app.services.admission import RUNNING_KEY, AdmissionController, AdmissionRejected
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+def make_controller(redis_client, **kwargs):
+    options = dict(max_concurrent=2, cpu_budget=8, memory_budget_mb=100000,
+                   user_limits={"code": 2, "kernel": 1}, max_queue=10, max_wait=0)
+    options.update(kwargs)
+    return AdmissionController(redis_client, **options)
+
+
+def test_budget_is_shared_between_processes(redis_client):
+    first, second = make_controller(redis_client), make_controller(redis_client)
+
+    running = [first.submit("alice"), second.submit("bob")]
+    queued = second.submit("carol")
+
+    assert all(ticket.granted for ticket in running)
+    assert not queued.granted
+    assert first.stats()["running"] == 2
+    assert queued.position()["queue_position"] == 1
+
+    # 另一个进程释放后，排队的票据由后台线程通知获准
+    running[0].release()
+    assert queued.wait(2)
+    assert second.stats()["running"] == 2
+
+
+def test_least_loaded_user_goes_first(redis_client):
+    controller = make_controller(redis_client, max_concurrent=2)
+    alice = [controller.submit("alice"), controller.submit("alice")]
+    alice_next = controller.submit("alice")
+    bob = controller.submit("bob")
+
+    assert bob.position()["queue_position"] == 1
+    alice[0].release()
+
+    assert bob.wait(2)
+    assert not alice_next.granted
+
+
+def test_per_user_limit(redis_client):
+    controller = make_controller(redis_client, max_concurrent=4)
+    kernel = controller.submit("alice", "kernel")
+    second_kernel = controller.submit("alice", "kernel")
+
+    assert kernel.granted and not second_kernel.granted
+    assert controller.submit("bob", "kernel").granted
+
+
+def test_rejects_when_queue_is_full_and_on_timeout(redis_client):
+    controller = make_controller(redis_client, max_concurrent=1, max_queue=1)
+    controller.submit("alice")
+    controller.submit("bob")
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.submit("carol")
+    assert rejected.value.position == 2
+    with pytest.raises(AdmissionRejected):
+        make_controller(redis_client, max_concurrent=1, max_queue=5).acquire("dave", timeout=0.2)
+
+    stats = controller.stats()
+    assert (stats["waiting"], stats["rejected"]) == (1, 2)
+
+
+def test_tickets_of_dead_process_expire(redis_client):
+    crashed = make_controller(redis_client, max_concurrent=1, lease=0.2)
+    ticket = crashed.submit("alice")
+    # 模拟进程退出：不再续租
+    crashed._tickets.clear()
+    assert ticket.granted
+
+    time.sleep(0.3)
+    assert make_controller(redis_client, max_concurrent=1).submit("bob").granted
+    assert redis_client.zcard(RUNNING_KEY) == 1
+
+
+def test_admit_async_releases_on_exit(redis_client):
+    controller = make_controller(redis_client)
+
+    async def run():
+        async with controller.admit_async("alice", "code", timeout=1) as ticket:
+            assert ticket.granted
+            assert controller.stats()["running"] == 1
+
+    asyncio.run(run())
+    stats = controller.stats()
+    assert (stats["running"], stats["admitted"], stats["cpu_used"]) == (0, 1, 0)
+
+
+def test_code_slots_are_per_process(redis_client):
+    first = make_controller(redis_client, max_concurrent=10, slots={"code": 1})
+    second = make_controller(redis_client, max_concurrent=10, slots={"code": 1})
+
+    running = first.submit("alice")
+    queued = first.submit("bob")
+    # 全局预算充足，但第一个进程的执行器已满
+    assert running.granted and not queued.granted
+    assert second.submit("carol").granted
+    assert first.submit("dave", "kernel").granted
+
+    # 排队位置和等待时间只计算争用同一执行器的请求，按执行器的工作进程数分摊
+    assert queued.position() == {"queue_position": 1, "estimated_wait": 5.0}
+    assert first.estimate("code") == {"queue_position": 2, "estimated_wait": 10.0}
+    assert second.estimate("code") == {"queue_position": 1, "estimated_wait": 5.0}
+    assert first.stats()["slots"] == {"code": {"used": 1, "total": 1}}
+
+    running.release()
+    assert queued.wait(2)
+
+
+def test_async_paths_do_not_call_redis_on_the_event_loop(redis_client, monkeypatch):
+    controller = make_controller(redis_client)
+    call, threads = controller._call, []
+
+    def recording_call(*args):
+        threads.append(threading.current_thread())
+        return call(*args)
+
+    monkeypatch.setattr(controller, "_call", recording_call)
+
+    async def events():
+        yield {"type": "done", "success": True}
+
+    async def run():
+        loop_thread = threading.current_thread()
+        async with controller.admit_async("alice", "code", timeout=1):
+            pass
+        ticket = await controller.submit_async("bob")
+        assert [event async for event in controller.stream(ticket, events)] == [{"type": "done", "success": True}]
+        return loop_thread
+
+    loop_thread = asyncio.run(run())
+    assert threads and loop_thread not in threads
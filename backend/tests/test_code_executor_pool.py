@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.code_executor import CodeExecutorPool
+
+
+class FakeWorker:
+    """按代码内容模拟执行结果，代码为 "crash" 时模拟进程崩溃后被替换"""
+
+    def __init__(self):
+        self.restarts = 0
+        self.jobs = []
+
+    def run(self, job, timeout, on_event=None):
+        self.jobs.append(job)
+        if job["code"] == "crash":
+            self.restarts += 1
+            return {"output": "Error: 代码执行进程异常退出", "charts": [], "success": False}
+        return {"output": "", "charts": [], "success": True}
+
+
+def make_pool(workers=2):
+    pool = CodeExecutorPool(max_workers=workers, timeout=5, memory_limit_mb=0)
+    pool._workers = [FakeWorker() for _ in range(workers)]
+    pool._waiter = ThreadPoolExecutor(max_workers=workers)
+    return pool
+
+
+def test_restart_resets_only_the_sessions_of_that_worker():
+    pool = make_pool()
+
+    async def run():
+        for session in ("alice", "bob", "carol"):
+            await pool.run("x = 1", session=session)
+        crashed = pool._affinity["alice"][0]
+        survivors = [s for s in ("bob", "carol") if pool._affinity[s][0] != crashed]
+        await pool.run("crash", session="alice")
+
+        # 同一进程上的其他会话下一次执行时收到重置通知，其他进程上的会话不受影响
+        results = {s: await pool.run("y = 2", session=s) for s in ("alice", "bob", "carol")}
+        again = await pool.run("y = 2", session="alice")
+        events = [event async for event in pool.stream("y = 2", session="alice")]
+        return results, survivors, again, events
+
+    results, survivors, again, events = asyncio.run(run())
+
+    assert {s for s, r in results.items() if r.get("session_reset")} == {"alice", "bob", "carol"} - set(survivors)
+    assert "session_reset" not in again
+    assert events[0]["type"] != "session_reset"
+    assert pool.stats()["session_resets"] == 2
+
+
+def test_explicit_reset_is_not_reported_and_stream_reports_reset():
+    pool = make_pool(workers=1)
+
+    async def run():
+        await pool.run("x = 1", session="alice")
+        await pool.run("x = 1", session="bob")
+        await pool.run("crash", session="alice")
+        explicit = await pool.run("y = 2", session="alice", reset_session=True)
+        events = [event async for event in pool.stream("y = 2", session="bob")]
+        return explicit, events
+
+    explicit, events = asyncio.run(run())
+
+    assert "session_reset" not in explicit
+    assert events[0] == {"type": "session_reset"}
+    assert events[-1]["type"] == "done"
+
+
+def test_jobs_without_session_avoid_session_bound_workers():
+    pool = make_pool(workers=3)
+
+    async def run():
+        await pool.run("x = 1", session="alice")
+        bound = pool._affinity["alice"][0]
+        for _ in range(5):
+            await pool.run("crash")
+        return bound, await pool.run("y = 2", session="alice")
+
+    bound, result = asyncio.run(run())
+
+    assert all(job["session"] == "alice" for job in pool._workers[bound].jobs)
+    assert "session_reset" not in result
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.stock_analysis import StockAnalysisService
+
+
+@pytest.fixture
+def service(tmp_path):
+    return StockAnalysisService(str(tmp_path))
+
+
+def random_walk(seed, n=250):
+    dates = pd.bdate_range("2020-01-01", periods=n)
+    close = 100 * np.exp(np.random.RandomState(seed).randn(n).cumsum() * 0.01)
+    return pd.DataFrame({"close": close}, index=dates)
+
+
+def test_identical_series_do_not_break_the_solver(service):
+    # 模拟数据源对所有股票返回相同的价格，协方差矩阵奇异
+    stock_data = service.get_stocks_data(["A", "B", "C"], "2020-01-01", "2020-12-31")
+
+    result = service.efficient_frontier(stock_data, num_points=5)
+
+    weights = result["min_volatility"]["weights"]
+    assert sum(weights.values()) == pytest.approx(1)
+    assert all(w == pytest.approx(1 / 3) for w in weights.values())
+    assert len(result["efficient_frontier"]["returns"]) == 5
+    assert np.isfinite(result["max_sharpe"]["sharpe_ratio"])
+
+
+def test_rank_deficient_covariance_matches_monte_carlo(service):
+    stock_data = {"A": random_walk(1), "B": random_walk(1), "C": random_walk(2), "D": random_walk(3)}
+
+    result = service.efficient_frontier(stock_data, num_points=5)
+    np.random.seed(0)
+    sampled = service.portfolio_optimization(stock_data, num_portfolios=20000)
+
+    # 重复的股票分到相同的权重
+    weights = result["min_volatility"]["weights"]
+    assert weights["A"] == pytest.approx(weights["B"], abs=1e-6)
+    assert sum(weights.values()) == pytest.approx(1)
+    # 解析解不差于随机抽样的结果
+    assert result["min_volatility"]["volatility"] <= sampled["min_volatility"]["volatility"] + 1e-9
+    assert result["max_sharpe"]["sharpe_ratio"] >= sampled["max_sharpe"]["sharpe_ratio"] - 1e-9
+    returns = result["efficient_frontier"]["returns"]
+    assert returns == sorted(returns)
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from app.api.v1.endpoints.execute_code import TicketStreamingResponse
+
+
+class FakeTicket:
+    def __init__(self):
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+
+
+async def events(started):
+    started.append(True)
+    yield "data: {}\n\n"
+
+
+async def receive():
+    await asyncio.sleep(3600)
+
+
+def test_ticket_is_released_when_sending_headers_fails():
+    ticket, started = FakeTicket(), []
+    response = TicketStreamingResponse(events(started), ticket, media_type="text/event-stream")
+
+    async def send(message):
+        raise OSError("客户端已断开")
+
+    # Starlette 把发送失败转换为 ClientDisconnect
+    with pytest.raises(Exception):
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+
+    # 响应体没有执行，票据仍被释放
+    assert started == []
+    assert ticket.releases == 1
+
+
+def test_ticket_is_released_after_body_is_sent():
+    ticket, started, sent = FakeTicket(), [], []
+    response = TicketStreamingResponse(events(started), ticket, media_type="text/event-stream")
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+
+    assert started == [True]
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    assert ticket.releases == 1
@@ -0,0 +1,213 @@
+import json
+import time
+import uuid
+
+import pytest
+
+from app.engine import WorkflowEngine
+from app.kernel_manager import ACTIVITY_KEY, KERNEL_KEY, KernelManager
+
+
+class FakeContainer:
+    def __init__(self, client, name):
+        self.client = client
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.stopped = False
+
+    def stop(self, timeout=None):
+        self.stopped = True
+
+    def remove(self, force=False):
+        self.client.containers.by_id.pop(self.id, None)
+
+
+class FakeContainers:
+    def __init__(self, client):
+        self.client = client
+        self.by_id = {}
+
+    def run(self, image, name=None, **kwargs):
+        container = FakeContainer(self.client, name)
+        self.by_id[container.id] = container
+        return container
+
+    def get(self, container_id):
+        if container_id not in self.by_id:
+            raise RuntimeError("No such container")
+        return self.by_id[container_id]
+
+    def list(self, all=False, filters=None):
+        return []
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.containers = FakeContainers(self)
+
+
+class FakeTicket:
+    def __init__(self):
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+
+
+class FakeAdmission:
+    def __init__(self):
+        self.tickets = []
+
+    def acquire(self, user, kind="code", timeout=None, max_wait=None):
+        ticket = FakeTicket()
+        self.tickets.append(ticket)
+        return ticket
+
+
+class CountingRedis:
+    """记录每种命令的调用次数，其余调用交给真正的客户端"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return attr(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def docker_client():
+    return FakeDockerClient()
+
+
+def make_manager(docker_client, redis_client, admission=None):
+    manager = KernelManager(docker_client=docker_client, redis_client=redis_client,
+                            admission=admission or FakeAdmission())
+    # 测试中显式调用回收
+    manager.start_reaper = lambda: None
+    return manager
+
+
+def stored(redis_client, kernel_id):
+    return json.loads(redis_client.get(KERNEL_KEY.format(kernel_id)))
+
+
+def test_create_kernel_records_info_and_activity(docker_client, redis_client):
+    manager = make_manager(docker_client, redis_client)
+
+    kernel_id = manager.create_kernel("alice", 1)
+
+    info = stored(redis_client, kernel_id)
+    assert (info["status"], info["user_id"], info["pooled"]) == ("running", "alice", False)
+    assert info["container_id"] in docker_client.containers.by_id
+    assert redis_client.zscore(ACTIVITY_KEY, kernel_id) == pytest.approx(time.time(), abs=5)
+
+
+def test_reaps_only_idle_kernels_that_are_not_busy(docker_client, redis_client):
+    admission = FakeAdmission()
+    manager = make_manager(docker_client, redis_client, admission)
+    idle = [manager.create_kernel("alice", n) for n in range(3)]
+    busy = manager.create_kernel("bob", 1)
+    active = manager.create_kernel("carol", 1)
+    old = time.time() - 3600
+    redis_client.zadd(ACTIVITY_KEY, {kernel_id: old for kernel_id in idle + [busy]})
+    manager._busy.add(busy)
+
+    reaped = manager.reap_idle_kernels(idle_timeout=60, batch_size=2)
+
+    assert sorted(reaped) == sorted(idle)
+    assert {k.decode() for k in redis_client.zrange(ACTIVITY_KEY, 0, -1)} == {busy, active}
+    for kernel_id in idle:
+        info = stored(redis_client, kernel_id)
+        assert info["status"] == "terminated" and "reaped_at" in info
+        assert info["container_id"] not in docker_client.containers.by_id
+        assert kernel_id not in manager.kernels
+    assert stored(redis_client, busy)["status"] == "running"
+    assert [ticket.releases for ticket in admission.tickets] == [1, 1, 1, 0, 0]
+
+
+def test_kernel_is_reaped_by_one_process_and_synced_by_its_owner(docker_client, redis_client):
+    owner_admission = FakeAdmission()
+    owner = make_manager(docker_client, redis_client, owner_admission)
+    other = make_manager(docker_client, redis_client)
+    kernel_id = owner.create_kernel("alice", 1)
+    redis_client.zadd(ACTIVITY_KEY, {kernel_id: time.time() - 3600})
+
+    assert other.reap_idle_kernels(idle_timeout=60) == [kernel_id]
+    assert owner.reap_idle_kernels(idle_timeout=60) == []
+    assert owner_admission.tickets[0].releases == 0
+
+    owner.sync_kernels()
+
+    assert kernel_id not in owner.kernels
+    assert owner_admission.tickets[0].releases == 1
+
+
+def test_get_kernels_reads_missing_kernels_with_one_mget(docker_client, redis_client):
+    owner = make_manager(docker_client, redis_client)
+    kernel_ids = [owner.create_kernel("alice", n) for n in range(3)]
+    counting = CountingRedis(redis_client)
+    other = make_manager(docker_client, counting)
+    local = other.kernels["local"] = {"kernel_id": "local", "status": "running"}
+
+    kernels = other.get_kernels(kernel_ids + ["local", "missing"])
+
+    assert counting.calls.get("mget") == 1
+    assert set(kernels) == set(kernel_ids) | {"local"}
+    assert kernels["local"] is local
+    assert kernels[kernel_ids[0]]["user_id"] == "alice"
+
+
+def test_save_kernels_writes_all_states_in_one_pipeline(docker_client, redis_client):
+    manager = make_manager(docker_client, redis_client)
+    kernel_ids = [manager.create_kernel("alice", n) for n in range(3)]
+    counting = CountingRedis(redis_client)
+    manager.redis_client = counting
+
+    manager._save_kernels({k: dict(manager.kernels[k], status="terminated") for k in kernel_ids})
+
+    assert counting.calls == {"pipeline": 1}
+    assert manager.kernels == {}
+    assert redis_client.zcard(ACTIVITY_KEY) == 0
+    assert all(stored(redis_client, k)["status"] == "terminated" for k in kernel_ids)
+
+
+def test_terminate_kernel_releases_admission_ticket(docker_client, redis_client):
+    admission = FakeAdmission()
+    manager = make_manager(docker_client, redis_client, admission)
+    kernel_id = manager.create_kernel("alice", 1)
+    container = docker_client.containers.get(stored(redis_client, kernel_id)["container_id"])
+
+    assert manager.terminate_kernel(kernel_id)
+
+    assert container.stopped
+    assert stored(redis_client, kernel_id)["status"] == "terminated"
+    assert admission.tickets[0].releases == 1
+    assert not manager.terminate_kernel("missing")
+
+
+def test_workflow_nodes_use_the_warm_pool_by_default():
+    class RecordingManager:
+        def __init__(self):
+            self.workspaces = []
+
+        def create_kernel(self, user_id, experiment_id, workspace=True, admission_timeout=None):
+            self.workspaces.append(workspace)
+            return "kernel"
+
+        def execute_code(self, kernel_id, code, timeout=None, user_expressions=None):
+            return {"status": "ok"}
+
+    manager = RecordingManager()
+    engine = WorkflowEngine(kernel_manager=manager, node_cache=object())
+
+    engine._run_node("result = 1", None, "alice", 1, 0.0)
+
+    assert manager.workspaces == [False]
@@ -0,0 +1,194 @@
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.kernel_pool import POOL_LABEL, POOL_OWNER_LABEL, POOL_OWNERS_KEY, POOL_SLOTS_KEY, KernelPool
+
+
+class FakeContainer:
+    def __init__(self, client, labels):
+        self.client = client
+        self.id = uuid.uuid4().hex
+        self.labels = dict(labels or {})
+        self.status = "running"
+        self.on_reload = None
+
+    def reload(self):
+        if self.on_reload is not None:
+            self.on_reload()
+        if self.id not in self.client.containers.by_id:
+            raise RuntimeError("No such container")
+
+    def exec_run(self, cmd, user=None):
+        return SimpleNamespace(exit_code=0)
+
+    def remove(self, force=False):
+        self.client.containers.by_id.pop(self.id, None)
+        self.client.containers.removed.append(self.id)
+
+
+class FakeContainers:
+    def __init__(self, client):
+        self.client = client
+        self.by_id = {}
+        self.removed = []
+
+    def run(self, labels=None):
+        container = FakeContainer(self.client, labels)
+        self.by_id[container.id] = container
+        return container
+
+    def list(self, all=False, filters=None):
+        label = (filters or {}).get("label")
+        return [c for c in self.by_id.values() if label is None or label in c.labels]
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.containers = FakeContainers(self)
+
+
+def make_pool(docker_client, **kwargs):
+    options = dict(size=1, max_total=4, acquire_timeout=1, health_check_interval=60)
+    options.update(kwargs)
+    return KernelPool(docker_client, lambda labels: docker_client.containers.run(labels=labels), **options)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "条件未在期限内满足"
+        time.sleep(0.01)
+
+
+def test_miss_then_hit_for_same_user():
+    docker_client = FakeDockerClient()
+    pool = make_pool(docker_client)
+
+    first = pool.acquire("alice")
+    assert first.labels[POOL_OWNER_LABEL] == pool.instance
+    pool.release(first.id)
+    second = pool.acquire("alice")
+
+    assert second is first
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["recycled"]) == (1, 1, 1)
+
+
+def test_prefers_container_last_used_by_same_user():
+    docker_client = FakeDockerClient()
+    pool = make_pool(docker_client, size=2)
+    alice, bob = pool.acquire("alice"), pool.acquire("bob")
+    pool.release(alice.id)
+    pool.release(bob.id)
+
+    assert pool.acquire("bob") is bob
+
+
+def test_dead_idle_container_is_replaced_without_holding_lock():
+    docker_client = FakeDockerClient()
+    pool = make_pool(docker_client)
+    container = pool.acquire("alice")
+    pool.release(container.id)
+
+    lock_free = []
+
+    def probe():
+        # 在另一个线程中尝试获取池的锁，reload 期间不应被占用
+        acquired = pool._cond.acquire(timeout=0.5)
+        lock_free.append(acquired)
+        if acquired:
+            pool._cond.release()
+
+    def on_reload():
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+
+    container.on_reload = on_reload
+    del docker_client.containers.by_id[container.id]
+
+    replacement = pool.acquire("alice")
+
+    assert lock_free == [True]
+    assert replacement is not container
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["discarded"]) == (0, 2, 1)
+
+
+def test_background_thread_refills_idle_containers():
+    docker_client = FakeDockerClient()
+    pool = make_pool(docker_client, size=2)
+    pool.start()
+    try:
+        wait_until(lambda: pool.stats()["idle"] == 2)
+        container = pool.acquire("alice")
+        assert pool.stats()["hits"] == 1
+        wait_until(lambda: pool.stats()["idle"] == 2)
+        assert len(docker_client.containers.by_id) == 3
+
+        pool.release(container.id, reusable=False)
+        assert container.id in docker_client.containers.removed
+    finally:
+        pool.shutdown()
+    assert docker_client.containers.by_id == {}
+
+
+def test_stale_cleanup_only_removes_containers_of_dead_owners(redis_client):
+    docker_client = FakeDockerClient()
+    legacy = docker_client.containers.run(labels={POOL_LABEL: "warm"})
+    orphaned = docker_client.containers.run(labels={POOL_LABEL: "warm", POOL_OWNER_LABEL: "other-host:1:dead"})
+    alive = docker_client.containers.run(labels={POOL_LABEL: "warm", POOL_OWNER_LABEL: "other-host:2:alive"})
+    unrelated = docker_client.containers.run(labels={})
+    redis_client.zadd(POOL_OWNERS_KEY, {"other-host:2:alive": time.time() + 60, "other-host:1:dead": time.time() - 1})
+
+    pool = make_pool(docker_client, size=0, redis_client=redis_client)
+    pool.start()
+    pool.shutdown()
+
+    assert set(docker_client.containers.removed) == {legacy.id, orphaned.id}
+    assert alive.id in docker_client.containers.by_id
+    assert unrelated.id in docker_client.containers.by_id
+
+
+def test_stale_cleanup_without_redis_checks_local_processes():
+    docker_client = FakeDockerClient()
+    pool = make_pool(docker_client, size=0)
+    host = pool.instance.split(":")[0]
+    dead = docker_client.containers.run(labels={POOL_LABEL: "warm", POOL_OWNER_LABEL: f"{host}:999999999:x"})
+    sibling = docker_client.containers.run(labels={POOL_LABEL: "warm", POOL_OWNER_LABEL: f"{host}:1:x"})
+
+    pool._remove_stale()
+
+    assert docker_client.containers.removed == [dead.id]
+    assert sibling.id in docker_client.containers.by_id
+
+
+def test_max_total_is_shared_between_instances(redis_client):
+    docker_client = FakeDockerClient()
+    first = make_pool(docker_client, size=0, max_total=1, acquire_timeout=0.3, redis_client=redis_client)
+    second = make_pool(docker_client, size=0, max_total=1, acquire_timeout=0.3, redis_client=redis_client)
+
+    container = first.acquire("alice")
+    assert redis_client.zcard(POOL_SLOTS_KEY) == 1
+    with pytest.raises(TimeoutError):
+        second.acquire("bob")
+
+    first.release(container.id)
+    assert redis_client.zcard(POOL_SLOTS_KEY) == 0
+    second.acquire("bob")
+    assert redis_client.zcard(POOL_SLOTS_KEY) == 1
+
+
+def test_expired_slots_of_crashed_instance_are_reclaimed(redis_client):
+    docker_client = FakeDockerClient()
+    redis_client.zadd(POOL_SLOTS_KEY, {"crashed:1:x:slot": time.time() - 1})
+    pool = make_pool(docker_client, size=0, max_total=1, redis_client=redis_client)
+
+    pool.acquire("alice")
+
+    assert b"crashed:1:x:slot" not in redis_client.zrange(POOL_SLOTS_KEY, 0, -1)
+    assert redis_client.zcard(POOL_SLOTS_KEY) == 1
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from app.services.ohlcv_store import OHLCVStore
+from app.services.stock_analysis import StockAnalysisService
+
+
+class RecordingFetch:
+    """使用与 StockAnalysisService 相同的模拟行情，并记录每次获取的区间"""
+
+    def __init__(self, service):
+        self.service = service
+        self.calls = []
+
+    def __call__(self, symbol, start, end):
+        self.calls.append((pd.Timestamp(start), pd.Timestamp(end)))
+        return self.service._mock_stock_data(symbol, start, end)
+
+
+def write_legacy(directory, symbol, start, end, frame):
+    frame.to_csv(directory / f"{symbol}_{start}_{end}.csv")
+
+
+def old_mock(start, end):
+    """旧版从查询开始日期生成的模拟数据，与当前数据源在同一日期的价格不同"""
+    dates = pd.date_range(start=start, end=end, freq="B")
+    close = np.random.RandomState(0).randn(len(dates)).cumsum() + 50
+    return pd.DataFrame({"open": close, "high": close, "low": close, "close": close,
+                         "volume": np.full(len(dates), 1000)}, index=dates)
+
+
+def test_inconsistent_legacy_file_is_not_spliced(tmp_path):
+    service = StockAnalysisService(str(tmp_path))
+    fetch = RecordingFetch(service)
+    write_legacy(tmp_path, "AAA", "2019-07-01", "2019-12-31", old_mock("2019-07-01", "2019-12-31"))
+    store = OHLCVStore(str(tmp_path / "ohlcv"), legacy_dir=str(tmp_path))
+
+    frame = store.get("AAA", "2019-10-01", "2020-03-31", fetch)
+
+    expected = service._mock_stock_data("AAA", "2019-10-01", "2020-03-31")
+    pd.testing.assert_frame_equal(frame, expected, check_freq=False, check_dtype=False)
+    # 区间边界处没有跳变
+    boundary = frame.loc["2019-12-27":"2020-01-06", "close"]
+    assert boundary.diff().abs().max() < 10
+    assert store._ranges("AAA") == [(pd.Timestamp("2019-10-01"), pd.Timestamp("2020-03-31"))]
+
+
+def test_consistent_legacy_file_is_imported(tmp_path):
+    service = StockAnalysisService(str(tmp_path))
+    write_legacy(tmp_path, "AAA", "2019-07-01", "2019-12-31",
+                 service._mock_stock_data("AAA", "2019-07-01", "2019-12-31"))
+    store = OHLCVStore(str(tmp_path / "ohlcv"), legacy_dir=str(tmp_path))
+    fetch = RecordingFetch(service)
+
+    frame = store.get("AAA", "2019-10-01", "2020-03-31", fetch)
+
+    pd.testing.assert_frame_equal(frame, service._mock_stock_data("AAA", "2019-10-01", "2020-03-31"),
+                                  check_freq=False, check_dtype=False)
+    # 除了核对用的少量日期，只获取旧版文件没有覆盖的区间
+    assert (pd.Timestamp("2020-01-01"), pd.Timestamp("2020-03-31")) in fetch.calls
+    assert all(end - start < pd.Timedelta(days=10) for start, end in fetch.calls[:-1])
+    assert store._ranges("AAA") == [(pd.Timestamp("2019-07-01"), pd.Timestamp("2020-03-31"))]
+
+
+def test_overlapping_queries_only_fetch_missing_dates(tmp_path):
+    service = StockAnalysisService(str(tmp_path))
+    fetch = RecordingFetch(service)
+    store = OHLCVStore(str(tmp_path / "ohlcv"))
+
+    store.get("AAA", "2020-01-01", "2020-03-31", fetch)
+    frame = store.get("AAA", "2020-03-01", "2020-06-30", fetch)
+
+    assert fetch.calls == [(pd.Timestamp("2020-01-01"), pd.Timestamp("2020-03-31")),
+                           (pd.Timestamp("2020-04-01"), pd.Timestamp("2020-06-30"))]
+    pd.testing.assert_frame_equal(frame, service._mock_stock_data("AAA", "2020-03-01", "2020-06-30"),
+                                  check_freq=False, check_dtype=False)
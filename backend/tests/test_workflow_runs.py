@@ -0,0 +1,177 @@
+import json
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.api.v1.deps as deps
+import app.worker as worker
+from app.core.security import create_access_token
+from app.db.session import get_db
+from app.api.v1.endpoints import workflows
+from app.services.workflow_runs import EVENTS_KEY, RUN_KEY, WorkflowRunStore, workflow_runs
+from app.worker import execute_workflow_task
+
+WORKFLOW = {"nodes": [{"id": "a", "code": "result = 1"}, {"id": "b", "code": "result = 2"}],
+            "edges": [{"source": "a", "target": "b"}]}
+
+
+class FakeEngine:
+    """按顺序“执行”节点并发送进度事件，第二个节点命中缓存"""
+
+    calls = []
+
+    def execute_workflow(self, workflow_data, user_id, experiment_id, use_cache=True, on_event=None):
+        FakeEngine.calls.append((user_id, experiment_id, use_cache))
+        for i, node in enumerate(workflow_data["nodes"]):
+            cached = i == 1
+            if not cached:
+                on_event({"type": "node_started", "node": node["id"]})
+            on_event({"type": "node_finished", "node": node["id"], "success": True, "cached": cached,
+                      "duration": 0.0})
+        return {"success": True, "results": {"b": 2}}
+
+
+class FailingEngine:
+    def execute_workflow(self, *args, **kwargs):
+        raise RuntimeError("内核启动失败")
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """运行记录使用内存 Redis，工作流引擎使用假的实现"""
+    monkeypatch.setattr(workflow_runs, "redis_client", fakeredis.FakeStrictRedis(decode_responses=True))
+    monkeypatch.setattr(worker, "WorkflowEngine", FakeEngine)
+    FakeEngine.calls = []
+    return workflow_runs
+
+
+@pytest.fixture
+def app(runs, monkeypatch):
+    """只挂载工作流路由，用户按令牌中的 sub 查找（不访问数据库）"""
+    app = FastAPI()
+    app.include_router(workflows.router, prefix="/workflows")
+    app.dependency_overrides[get_db] = lambda: None
+    monkeypatch.setattr(deps.user_service, "get",
+                        lambda db, user_id: SimpleNamespace(id=user_id) if user_id in (7, 8) else None)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    with TestClient(app, headers={"Authorization": f"Bearer {create_access_token(7)}"}) as test_client:
+        yield test_client
+
+
+def event_types(events):
+    return [event["type"] for _, event in events]
+
+
+def test_store_tracks_progress_and_expires():
+    store = WorkflowRunStore(fakeredis.FakeStrictRedis(decode_responses=True), ttl=60, max_events=100)
+    run_id = store.create(7, 3, total_nodes=2)
+    assert store.get(run_id)["status"] == "queued"
+
+    store.start(run_id)
+    store.publish(run_id, {"type": "node_finished", "node": "a", "cached": True})
+    store.publish(run_id, {"type": "node_finished", "node": "b", "cached": False})
+    store.finish(run_id, {"success": True, "results": {}})
+
+    run = store.get(run_id)
+    assert (run["status"], run["completed_nodes"], run["cached_nodes"], run["total_nodes"]) == ("succeeded", 2, 1, 2)
+    assert run["result"] == {"success": True, "results": {}}
+    assert 0 < store.redis_client.ttl(RUN_KEY.format(run_id)) <= 60
+    assert 0 < store.redis_client.ttl(EVENTS_KEY.format(run_id)) <= 60
+
+    events = store.events(run_id)
+    assert event_types(events) == ["run_started", "node_finished", "node_finished", "run_finished"]
+    # 从某个事件ID之后增量读取
+    assert event_types(store.events(run_id, after=events[1][0])) == ["node_finished", "run_finished"]
+    assert store.get("missing") is None
+
+
+def test_task_runs_eagerly_and_streams_progress(runs):
+    run_id = runs.create(7, 3, len(WORKFLOW["nodes"]))
+    result = execute_workflow_task.apply_async(args=(WORKFLOW, 7, 3), kwargs={"run_id": run_id, "use_cache": False},
+                                               task_id=run_id).get()
+
+    assert result == {"run_id": run_id, "success": True}
+    assert FakeEngine.calls == [(7, 3, False)]
+    run = runs.get(run_id)
+    assert (run["status"], run["completed_nodes"], run["cached_nodes"]) == ("succeeded", 2, 1)
+    assert event_types(runs.events(run_id)) == [
+        "run_started", "node_started", "node_finished", "node_finished", "run_finished"]
+
+
+def test_task_records_engine_failure(runs, monkeypatch):
+    monkeypatch.setattr(worker, "WorkflowEngine", FailingEngine)
+    result = execute_workflow_task.delay(WORKFLOW, 7, 3).get()
+
+    run = runs.get(result["run_id"])
+    assert result["success"] is False
+    assert run["status"] == "failed"
+    assert run["result"] == {"success": False, "message": "内核启动失败"}
+    assert runs.events(result["run_id"])[-1][1] == {"type": "run_finished", "status": "failed", "success": False}
+
+
+def test_submit_and_poll_status(client):
+    response = client.post("/workflows/runs", json={"workflow": WORKFLOW, "experiment_id": 3})
+    assert response.status_code == 200
+    run_id = response.json()["run_id"]
+
+    run = client.get(f"/workflows/runs/{run_id}").json()
+    assert (run["status"], run["completed_nodes"], run["user_id"]) == ("succeeded", 2, "7")
+    assert run["result"]["results"] == {"b": 2}
+
+    page = client.get(f"/workflows/runs/{run_id}/events").json()
+    assert [event["type"] for event in page["events"]][-1] == "run_finished"
+    assert page["last_id"] == page["events"][-1]["id"]
+    assert client.get(f"/workflows/runs/{run_id}/events", params={"after": page["last_id"]}).json()["events"] == []
+
+
+def test_submit_validates_request(client):
+    assert client.post("/workflows/runs", json={"workflow": {"nodes": []}, "experiment_id": 3}).status_code == 400
+    assert client.post("/workflows/runs", json={"workflow": WORKFLOW}).status_code == 400
+
+
+def test_runs_are_private(client, runs):
+    run_id = runs.create(8, 3, 1)
+    assert client.get(f"/workflows/runs/{run_id}").status_code == 403
+    assert client.get(f"/workflows/runs/{run_id}/stream").status_code == 403
+    assert client.get("/workflows/runs/missing").status_code == 404
+
+    owner = {"Authorization": f"Bearer {create_access_token(8)}"}
+    assert client.get(f"/workflows/runs/{run_id}", headers=owner).status_code == 200
+
+
+def test_runs_require_a_valid_token(app, runs):
+    with TestClient(app) as anonymous:
+        assert anonymous.post("/workflows/runs", json={"workflow": WORKFLOW, "experiment_id": 3}).status_code == 401
+        for token in ("not-a-jwt", create_access_token(99)):
+            response = anonymous.get("/workflows/runs/missing", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 401
+    assert FakeEngine.calls == []
+
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("id"), json.loads(fields["data"])))
+    return events
+
+
+def test_stream_replays_events_and_resumes_after_last_event_id(client):
+    run_id = client.post("/workflows/runs", json={"workflow": WORKFLOW, "experiment_id": 3}).json()["run_id"]
+
+    response = client.get(f"/workflows/runs/{run_id}/stream")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert event_types(events) == ["run_started", "node_started", "node_finished", "node_finished", "run_finished"]
+
+    # 断线重连：只推送 Last-Event-ID 之后的事件
+    resumed = parse_sse(client.get(f"/workflows/runs/{run_id}/stream",
+                                   headers={"Last-Event-ID": events[2][0]}).text)
+    assert resumed == events[3:]